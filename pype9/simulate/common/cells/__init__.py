@@ -1,4 +1,4 @@
-from .base import Cell, CellMetaClass
+from .base import Cell, CellMetaClass, CellArray
 from .with_synapses import (
     DynamicsWithSynapses, DynamicsWithSynapsesProperties, WithSynapses,
     MultiDynamicsWithSynapses, MultiDynamicsWithSynapsesProperties,
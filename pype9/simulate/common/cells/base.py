@@ -14,6 +14,8 @@
 from builtins import next
 from builtins import object
 from itertools import chain
+from collections import namedtuple
+import weakref
 import numpy as np
 import quantities as pq
 import neo
@@ -37,6 +39,13 @@ logger = logging.Logger("Pype9")
 # e.g. 'Izhikevich'
 BUILD_NAME_SUFFIX = '9ML'
 
+# Precomputed details of the parameters and state variables of a cell class,
+# 'kind' is either 'parameter' or 'state_variable', 'units'/'units_str' are the
+# units used in the simulator for the dimension and 'build_name' is the name of
+# the variable in the generated code
+VariableInfo = namedtuple('VariableInfo', ('kind', 'dimension', 'units',
+                                           'units_str', 'build_name'))
+
 
 class CellMetaClass(type):
     """
@@ -53,40 +62,26 @@ class CellMetaClass(type):
         The name of the cell class, which is used for the generated simulator
         code. If None, the name of the component_class is used. Note, names
         must be unique among classes loaded within the same simulation script.
+    build_url : str | None
+        The URL the component class was loaded from (only used in log
+        messages as builds are looked up by the checksum of the build
+        component class)
     """
 
     def __new__(cls, component_class, build_url=None, build_version=None,
                 build_base_dir=None, code_generator=None, build_mode='lazy',
                 **kwargs):
-        # Grab the url before the component class is cloned
-        url = (build_url if build_url is not None else component_class.url)
-        # Clone component class so annotations can be added to it and not bleed
-        # into the calling code.
-        component_class = component_class.clone()
-        # If the component class is not already wrapped in a WithSynapses
-        # object, wrap it in one before passing to the code template generator
-        if not isinstance(component_class, WithSynapses):
-            component_class = WithSynapses.wrap(component_class)
-        # Extract name from component class and append build_version if
-        # provided
-        name = component_class.name + BUILD_NAME_SUFFIX
-        if build_version is not None:
-            name += build_version
-        if code_generator is None:
-            try:
-                code_generator = cls.Simulation.active().code_generator
-            except Pype9NoActiveSimulationError:
-                code_generator = cls.CodeGenerator(base_dir=build_base_dir)
-        # Get transformed build class
-        build_component_class = code_generator.transform_for_build(
-            name=name, component_class=component_class, **kwargs)
+        (name, url, component_class, build_component_class, checksum,
+         code_generator) = cls._prepare_build(
+             component_class, build_url=build_url,
+             build_version=build_version, build_base_dir=build_base_dir,
+             code_generator=code_generator, **kwargs)
         try:
             Cell = cls._built_types[name]
         except KeyError:
             build = True
         else:
-            if not Cell.build_component_class.equals(
-                    build_component_class, annotations_ns=[PYPE9_NS]):
+            if Cell.checksum != checksum:
                 serial_kwargs = {'format': 'yaml', 'version': 2,
                                  'to_str': True}
                 raise Pype9BuildMismatchError(
@@ -117,17 +112,21 @@ class CellMetaClass(type):
                 # Generate and compile cell class
                 code_generator.generate(component_class=build_component_class,
                                         url=url, build_mode=build_mode,
-                                        **kwargs)
+                                        checksum=checksum, **kwargs)
             # Make slave nodes wait for the root node to finish building
             mpi_comm.barrier()
             # Load newly built model
-            code_generator.load_libraries(name, url)
+            code_generator.load_libraries(name, checksum)
+            unit_handler = code_generator.UnitHandler(component_class)
             # Create class member dict of new class
             dct = {'name': name,
                    'component_class': component_class,
                    'build_component_class': build_component_class,
+                   'checksum': checksum,
                    'code_generator': code_generator,
-                   'unit_handler': code_generator.UnitHandler(component_class),
+                   'unit_handler': unit_handler,
+                   '_variables': cls._variable_table(
+                       component_class, build_component_class, unit_handler),
                    'Simulation': cls.Simulation}
             # Create new class using Type.__new__ method
             Cell = super(CellMetaClass, cls).__new__(
@@ -136,6 +135,192 @@ class CellMetaClass(type):
             cls._built_types[name] = Cell
         return Cell
 
+    def create_many(cls, size, prototype_=None, regime_=None, **kwargs):  # @NoSelf @IgnorePep8
+        """
+        Creates a CellArray of independent cells of the cell class (NB: this
+        method is called on the cell class created by the metaclass)
+
+        Parameters
+        ----------
+        size : int
+            The number of cells to create
+        prototype_ : DynamicsProperties | None
+            A dynamics properties object used as the "prototype" for the cells
+        regime_ : str | None
+            Name of regime the cells will be initiated in
+        kwargs : dict(str, nineml.Quantity | pq.Quantity)
+            Properties and initial state variables to initiate the cells with,
+            either a single value for all cells or an array with a value for
+            each cell
+        """
+        return type(cls).CellArray(cls, size, prototype_=prototype_,
+                                   regime_=regime_, **kwargs)
+
+    @classmethod
+    def _variable_table(cls, component_class, build_component_class,
+                        unit_handler):
+        """
+        Precomputes the details of each parameter and state variable of the
+        component class required to get and set them, so they don't need to
+        be looked up in the component class on every attribute access
+        """
+        variables = {}
+        for kind, elements in (
+                ('parameter', component_class.parameters),
+                ('state_variable', component_class.state_variables)):
+            for element in elements:
+                units = unit_handler.dimension_to_units(element.dimension)
+                _, compound = unit_handler.dimension_to_units_compound(
+                    element.dimension)
+                variables[element.name] = VariableInfo(
+                    kind=kind, dimension=element.dimension, units=units,
+                    units_str=unit_handler.compound_to_units_str(compound),
+                    build_name=cls._build_name(element.name, component_class,
+                                               build_component_class))
+        return variables
+
+    @classmethod
+    def _build_name(cls, name, component_class, build_component_class):  # @UnusedVariable @IgnorePep8
+        """
+        The name of the variable in the generated code (can be overridden by
+        simulators that rename variables in their build transforms)
+        """
+        return name
+
+    @classmethod
+    def _prepare_build(cls, component_class, build_url=None,
+                       build_version=None, build_base_dir=None,
+                       code_generator=None, **kwargs):
+        """
+        Wraps and transforms the component class into the build component
+        class and calculates its checksum (used by both __new__ and
+        build_all so they arrive at the same build)
+        """
+        # Grab the url before the component class is cloned
+        url = (build_url if build_url is not None else component_class.url)
+        source_class = component_class
+        # Clone component class so annotations can be added to it and not bleed
+        # into the calling code.
+        component_class = component_class.clone()
+        # If the component class is not already wrapped in a WithSynapses
+        # object, wrap it in one before passing to the code template generator
+        if not isinstance(component_class, WithSynapses):
+            component_class = WithSynapses.wrap(component_class)
+        # Extract name from component class and append build_version if
+        # provided
+        name = component_class.name + BUILD_NAME_SUFFIX
+        if build_version is not None:
+            name += build_version
+        if code_generator is None:
+            try:
+                code_generator = cls.Simulation.active().code_generator
+            except Pype9NoActiveSimulationError:
+                code_generator = cls.CodeGenerator(base_dir=build_base_dir)
+        # Get transformed build class
+        build_component_class = code_generator.transform_for_build(
+            name=name, component_class=component_class, **kwargs)
+        # Calculate the checksum used to look up previous builds
+        checksum = cls._checksum(source_class, build_component_class,
+                                 code_generator, kwargs)
+        return (name, url, component_class, build_component_class, checksum,
+                code_generator)
+
+    @classmethod
+    def _checksum(cls, source_class, build_component_class, code_generator,
+                  kwargs):
+        """
+        Calculates the checksum of the build component class, which is
+        memoized on the identity of the component class it was transformed
+        from (along with the build name, code generator and template
+        arguments) so the build component class only needs to be serialized
+        the first time a cell class is created from it
+        """
+        key = (id(source_class), build_component_class.name,
+               type(code_generator),
+               code_generator.canonical_template_args(kwargs))
+        checksums = cls._checksums
+        try:
+            ref, checksum = checksums[key]
+        except KeyError:
+            pass
+        else:
+            # Check the id hasn't been reused by a new component class
+            if ref() is source_class:
+                return checksum
+        checksum = code_generator.checksum(build_component_class, **kwargs)
+
+        def remove(ref):
+            # Drop the entry when the component class is garbage collected
+            if checksums.get(key, (None,))[0] is ref:
+                del checksums[key]
+
+        checksums[key] = (weakref.ref(source_class, remove), checksum)
+        return checksum
+
+    @classmethod
+    def build_all(cls, cell_kwargs, build_mode='lazy', num_workers=None,
+                  combined=False):
+        """
+        Generates and compiles the code for multiple cell classes at the same
+        time in a pool of worker processes. The libraries are not loaded, this
+        happens when the cell classes are subsequently created with the
+        CellMetaClass.
+
+        Parameters
+        ----------
+        cell_kwargs : list(dict(str, object))
+            The keyword arguments that will be passed to the CellMetaClass to
+            create each cell class
+        build_mode : str
+            The build mode (see BaseCodeGenerator.generate)
+        num_workers : int | None
+            The maximum number of build processes to run at the same time. If
+            None the number of CPUs is used
+        combined : bool
+            Whether to compile the cell classes together into a single
+            library, which is loaded straight away (only supported by
+            simulators that link all mechanisms into a single library, i.e.
+            NEURON)
+        """
+        # Group the builds by code generator (typically there will only be
+        # one)
+        builds = []
+        scheduled = set()
+        for kwargs in cell_kwargs:
+            kwargs = dict(kwargs)
+            kwargs.pop('build_mode', None)  # Overridden by build_mode arg
+            (name, url, _, build_component_class, checksum,
+             code_generator) = cls._prepare_build(**kwargs)
+            # Name clashes with previously loaded classes are checked when the
+            # class is created
+            if name in cls._built_types or (name, checksum) in scheduled:
+                continue
+            scheduled.add((name, checksum))
+            for k in ('component_class', 'build_url', 'build_version',
+                      'build_base_dir', 'code_generator'):
+                kwargs.pop(k, None)
+            build = (build_component_class, url, checksum, kwargs)
+            try:
+                next(b for cg, b in builds if cg == code_generator).append(
+                    build)
+            except StopIteration:
+                builds.append((code_generator, [build]))
+        for code_generator, cg_builds in builds:
+            # Only build the components on the root node
+            if is_mpi_master():
+                if combined:
+                    code_generator.generate_combined(
+                        cg_builds, build_mode=build_mode,
+                        num_workers=num_workers)
+                else:
+                    code_generator.generate_all(
+                        cg_builds, build_mode=build_mode,
+                        num_workers=num_workers)
+            # Make slave nodes wait for the root node to finish building
+            mpi_comm.barrier()
+            if combined:
+                code_generator.load_combined(cg_builds)
+
     def __init__(self, component_class, **kwargs):
         # This initializer is empty, but since I have changed the signature of
         # the __new__ method in the deriving metaclasses it complains otherwise
@@ -254,8 +439,7 @@ class Cell(object):
         super(Cell, self).__setattr__('_created', flag)
 
     def __contains__(self, varname):
-        return varname in chain(self.component_class.parameter_names,
-                                self.component_class.state_variable_names)
+        return varname in self._variables
 
     def __getattr__(self, varname):
         """
@@ -271,10 +455,7 @@ class Cell(object):
                                 self.component_class.parameter_names,
                                 self.component_class.state_variable_names))))
             val = self._get(varname)
-            qty = self.unit_handler.assign_units(
-                val, self.component_class.element(
-                    varname, child_types=Dynamics.nineml_children).dimension)
-            return qty
+            return self._assign_units(varname, val)
 
     def __setattr__(self, varname, val):
         """
@@ -289,6 +470,30 @@ class Cell(object):
         """
         if self._created:
             # Once the __init__ method has set all the members
+            qty = self._check_quantity(varname, val)
+            self._set_nineml(varname, qty)
+            # Set the value in the simulator
+            self._set(varname, float(self.unit_handler.scale_value(qty)))
+        else:
+            super(Cell, self).__setattr__(varname, val)
+
+    def get_many(self, varnames):
+        """
+        Gets the values of multiple parameters and state variables, retrieving
+        them from the simulator together
+
+        Parameters
+        ----------
+        varnames : list(str)
+            Names of the parameters and state variables to get
+
+        Returns
+        -------
+        values : dict(str, pq.Quantity)
+            The values of the parameters and state variables
+        """
+        varnames = list(varnames)
+        for varname in varnames:
             if varname not in self:
                 raise Pype9AttributeError(
                     "'{}' is not a parameter or state variable of the '{}'"
@@ -297,28 +502,77 @@ class Cell(object):
                             "', '".join(chain(
                                 self.component_class.parameter_names,
                                 self.component_class.state_variable_names))))
-            if isinstance(val, pq.Quantity):
-                qty = self.unit_handler.from_pq_quantity(val)
-            else:
-                qty = val
-            if qty.units.dimension != self.component_class.dimension_of(
-                    varname):
-                raise Pype9DimensionError(
-                    "Attempting so set '{}', which has dimension {} to "
-                    "{}, which has dimension {}".format(
-                        varname,
-                        self.component_class.dimension_of(varname), qty,
-                        qty.units.dimension))
-            if not self.in_array:
-                # Set the quantity in the nineml class
-                if varname in self.component_class.state_variable_names:
-                    self._nineml.set(Initial(varname, qty))
-                else:
-                    self._nineml.set(Property(varname, qty))
-            # Set the value in the simulator
-            self._set(varname, float(self.unit_handler.scale_value(qty)))
+        return dict((n, self._assign_units(n, v))
+                    for n, v in zip(varnames, self._get_many(varnames)))
+
+    def set_many(self, **values):
+        """
+        Sets the values of multiple parameters and state variables. All the
+        values are checked before any are set, and they are then passed to the
+        simulator together
+
+        Parameters
+        ----------
+        values : dict(str, float | pq.Quantity | nineml.Quantity)
+            The values to set
+        """
+        qtys = [(n, self._check_quantity(n, v)) for n, v in values.items()]
+        for varname, qty in qtys:
+            self._set_nineml(varname, qty)
+        self._set_many(dict(
+            (n, float(self.unit_handler.scale_value(q))) for n, q in qtys))
+
+    def _check_quantity(self, varname, val):
+        """
+        Checks that varname is a parameter or state variable of the component
+        class and the dimension of the value matches it, returning the value
+        as a nineml.Quantity
+        """
+        if varname not in self:
+            raise Pype9AttributeError(
+                "'{}' is not a parameter or state variable of the '{}'"
+                " component class ('{}')"
+                .format(varname, self.component_class.name,
+                        "', '".join(chain(
+                            self.component_class.parameter_names,
+                            self.component_class.state_variable_names))))
+        if isinstance(val, pq.Quantity):
+            qty = self.unit_handler.from_pq_quantity(val)
         else:
-            super(Cell, self).__setattr__(varname, val)
+            qty = val
+        dimension = self._variables[varname].dimension
+        if qty.units.dimension != dimension:
+            raise Pype9DimensionError(
+                "Attempting so set '{}', which has dimension {} to "
+                "{}, which has dimension {}".format(
+                    varname, dimension, qty, qty.units.dimension))
+        return qty
+
+    def _set_nineml(self, varname, qty):
+        if not self.in_array:
+            # Set the quantity in the nineml class
+            if self._variables[varname].kind == 'state_variable':
+                self._nineml.set(Initial(varname, qty))
+            else:
+                self._nineml.set(Property(varname, qty))
+
+    def _assign_units(self, varname, val):
+        return pq.Quantity(val, self._variables[varname].units_str)
+
+    def _get_many(self, varnames):
+        """
+        Gets multiple values from the simulator (can be overridden by derived
+        classes to retrieve them in a single call)
+        """
+        return [self._get(n) for n in varnames]
+
+    def _set_many(self, values):
+        """
+        Sets multiple values in the simulator (can be overridden by derived
+        classes to set them in a single call)
+        """
+        for varname, value in values.items():
+            self._set(varname, value)
 
     def set_regime(self, regime):
         if regime not in self.component_class.regime_names:
@@ -343,8 +597,7 @@ class Cell(object):
         return self._nineml.prop(varname)
 
     def set(self, **kwargs):
-        for k, v in kwargs.items():
-            setattr(self, k, v)
+        self.set_many(**kwargs)
 
     def __dir__(self):
         """
@@ -413,6 +666,32 @@ class Cell(object):
             setattr(self, iv.name, iv.quantity)
         self._set_regime()
 
+    def _get_checkpoint(self):
+        """
+        Returns the current state of the cell for Simulation.checkpoint
+        """
+        names = list(self.state_variable_names)
+        return {'name': self.name,
+                'state': dict(zip(names, (float(v) for v in
+                                          self._get_many(names)))),
+                'regime': int(self._get(
+                    self.code_generator.REGIME_VARNAME))}
+
+    def _restore_checkpoint(self, checkpoint):
+        """
+        Sets the state of the cell from a checkpoint returned by
+        _get_checkpoint. The values are also set as the initial values so they
+        are not overwritten when the simulation is initialized
+        """
+        if checkpoint['name'] != self.name:
+            raise Pype9UsageError(
+                "Checkpoint of '{}' cell cannot be restored into a '{}' cell"
+                .format(checkpoint['name'], self.name))
+        self.set_many(**dict((n, v * self._variables[n].units)
+                             for n, v in checkpoint['state'].items()))
+        super(Cell, self).__setattr__('_regime_index', checkpoint['regime'])
+        self._set_regime()
+
     def write(self, file, **kwargs):  # @ReservedAssignment
         if self.in_array:
             raise Pype9UsageError(
@@ -429,6 +708,7 @@ class Cell(object):
         """
         super(Cell, self).__setattr__('_recorders', {})
         super(Cell, self).__setattr__('_recordings', {})
+        super(Cell, self).__setattr__('_recording_cache', {})
 
     def _initialize_local_recording(self):
         if not hasattr(self, '_recorders'):
@@ -448,7 +728,7 @@ class Cell(object):
         """
         raise NotImplementedError("Should be implemented by derived class")
 
-    def recording(self, port_name, t_start=None):
+    def recording(self, port_name, t_start=None, raw=False):
         """
         Return recorded data as a dictionary containing one numpy array for
         each neuron, ids as keys.
@@ -457,6 +737,12 @@ class Cell(object):
         ----------
         port_name : str
             Name of the port to retrieve the recording for
+        t_start : pq.Quantity | None
+            The time to return the recording from
+        raw : bool
+            Whether to return the recording as a (times, values) tuple of
+            numpy arrays (in ms and simulator units respectively) instead of
+            a neo object. For event ports the values are None
         """
         raise NotImplementedError("Should be implemented by derived class")
 
@@ -481,6 +767,45 @@ class Cell(object):
     def _regime_recording(self):
         raise NotImplementedError("Should be implemented by derived class")
 
+    def _recorded(self, key):
+        """
+        Returns the raw data recorded for the given port (or the regime),
+        from the cache if the simulation has been killed.
+
+        Returns
+        -------
+        data : numpy.array
+            The recorded spike times (in ms) or signal values
+        interval : float | None
+            The sampling interval of the signal in ms (None for spike times)
+        """
+        try:
+            return self._recording_cache[key]
+        except KeyError:
+            return self._fetch_recording(key)
+
+    def _fetch_recording(self, key, copy=False):
+        """
+        Retrieves the raw data recorded for the given key from the simulator
+        in the format returned by _recorded. If 'copy' is False the data may
+        be a view onto memory held by the simulator
+        """
+        raise NotImplementedError("Should be implemented by derived class")
+
+    def _recording_keys(self):
+        """
+        The keys of all recordings held by the simulator for the cell
+        """
+        return list(self._recorders)
+
+    def _release_recorders(self):
+        """
+        Releases the references to the simulator recording objects (the keys
+        are kept so the recordings can still be listed)
+        """
+        super(Cell, self).__setattr__(
+            '_recorders', dict((k, None) for k in self._recorders))
+
     def regime_epochs(self):
         """
         Retrieves the periods spent in each regime during the simulation
@@ -573,7 +898,12 @@ class Cell(object):
         data to be accessed after a simulation has completed, and potentially
         a new simulation to have been started.
         """
-        # TODO: Cache has not been implemented yet
+        if hasattr(self, '_recorders') and not self.is_dead():
+            # Copy the recorded data into numpy arrays held by the cell
+            self._recording_cache.update(
+                (k, self._fetch_recording(k, copy=True))
+                for k in self._recording_keys())
+            self._release_recorders()
         super(Cell, self).__setattr__('_t_stop', t_stop)
 
     def is_dead(self):
@@ -599,3 +929,164 @@ class Cell(object):
     # This has to go last to avoid clobbering the property decorators
     def property(self, name):
         return self._nineml.property(name)
+
+
+class CellArray(object):
+    """
+    A set of independent cells of the same cell class, created by
+    ``create_many``, which can be set and recorded together. This generic
+    implementation creates and accesses each cell separately and is overridden
+    by simulators that can create them in bulk
+
+    Parameters
+    ----------
+    cell_class : Cell
+        The cell class (created by a CellMetaClass) of the cells
+    size : int
+        The number of cells in the array
+    prototype_ : DynamicsProperties | None
+        A dynamics properties object used as the "prototype" for the cells
+    regime_ : str | None
+        Name of regime the cells will be initiated in
+    kwargs : dict(str, nineml.Quantity | pq.Quantity)
+        Properties and initial state variables to initiate the cells with,
+        either a single value for all cells or an array with a value for each
+        cell
+    """
+
+    def __init__(self, cell_class, size, prototype_=None, regime_=None,
+                 **kwargs):
+        self._cell_class = cell_class
+        self._size = int(size)
+        per_cell = dict((n, self._split_value(n, v))
+                        for n, v in kwargs.items())
+        if prototype_ is not None:
+            args = (prototype_,)
+        else:
+            args = ()
+        self._cells = [
+            cell_class(*args, regime_=regime_,
+                       **dict((n, v[i]) for n, v in per_cell.items()))
+            for i in range(self._size)]
+
+    @property
+    def cell_class(self):
+        return self._cell_class
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        return self._cells[index]
+
+    def __iter__(self):
+        return iter(self._cells)
+
+    def __repr__(self):
+        return "{}(cell_class={}, size={})".format(
+            type(self).__name__, self._cell_class.name, self._size)
+
+    def get(self, varnames):
+        """
+        Gets the values of parameters and state variables for all cells
+
+        Parameters
+        ----------
+        varnames : list(str)
+            Names of the parameters and state variables to get
+
+        Returns
+        -------
+        values : dict(str, pq.Quantity)
+            An array of the values of each cell for each variable
+        """
+        varnames = list(varnames)
+        self._check_varnames(varnames)
+        values = np.array([c._get_many(varnames) for c in self._cells],
+                          dtype=float).reshape(self._size, len(varnames))
+        return self._to_quantities(varnames, values)
+
+    def set(self, **values):
+        """
+        Sets the values of parameters and state variables for all cells
+
+        Parameters
+        ----------
+        values : dict(str, nineml.Quantity | pq.Quantity)
+            Either a single value for all cells or an array with a value for
+            each cell
+        """
+        per_cell = dict((n, self._split_value(n, v))
+                        for n, v in values.items())
+        for i, cell in enumerate(self._cells):
+            cell.set_many(**dict((n, v[i]) for n, v in per_cell.items()))
+
+    def record(self, port_name, **kwargs):
+        for cell in self._cells:
+            cell.record(port_name, **kwargs)
+
+    def recording(self, port_name, t_start=None):
+        """
+        Returns a list of the recordings of each cell (see Cell.recording)
+        """
+        return [c.recording(port_name, t_start=t_start) for c in self._cells]
+
+    def play(self, port_name, signal, properties=[]):
+        """
+        Plays a signal into the given port of each cell
+
+        Parameters
+        ----------
+        port_name : str
+            The name of the receive port to play the signal into
+        signal : neo.AnalogSignal | neo.SpikeTrain | list
+            Signal to play into all cells or a list with a signal for each
+            cell
+        properties : list(nineml.Property)
+            The connection properties of the event port
+        """
+        if isinstance(signal, (neo.AnalogSignal, neo.SpikeTrain)):
+            signal = [signal] * self._size
+        elif len(signal) != self._size:
+            raise Pype9UsageError(
+                "Number of signals ({}) doesn't match size of cell array "
+                "({})".format(len(signal), self._size))
+        for cell, sig in zip(self._cells, signal):
+            cell.play(port_name, sig, properties=properties)
+
+    def _check_varnames(self, varnames):
+        for varname in varnames:
+            if varname not in self._cell_class._variables:
+                raise Pype9AttributeError(
+                    "'{}' is not a parameter or state variable of the '{}'"
+                    " component class ('{}')".format(
+                        varname, self._cell_class.component_class.name,
+                        "', '".join(self._cell_class._variables)))
+
+    def _to_quantities(self, varnames, values):
+        return dict(
+            (n, pq.Quantity(values[:, i],
+                            self._cell_class._variables[n].units_str))
+            for i, n in enumerate(varnames))
+
+    def _split_value(self, varname, value):
+        """
+        Splits a value into a list containing a value for each cell
+        """
+        self._check_varnames([varname])
+        if isinstance(value, pq.Quantity):
+            if value.ndim == 0:
+                return [value] * self._size
+            values = list(value)
+        elif isinstance(value, nineml.Quantity):
+            if value.value.nineml_type != 'ArrayValue':
+                return [value] * self._size
+            values = [nineml.Quantity(float(v), value.units)
+                      for v in value.value]
+        else:
+            values = list(value)
+        if len(values) != self._size:
+            raise Pype9UsageError(
+                "Number of values provided for '{}' ({}) doesn't match size "
+                "of cell array ({})".format(varname, len(values), self._size))
+        return values
@@ -12,31 +12,35 @@
 from __future__ import absolute_import
 from builtins import object
 from future.utils import PY3
+from past.builtins import basestring, long
 import platform
 import os
 import subprocess as sp
 import time
+import hashlib
+import json
+import multiprocessing
 from itertools import chain
+import numpy
 from copy import deepcopy
 import shutil
 from os.path import join
-from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from jinja2 import (
+    Environment, FileSystemLoader, FileSystemBytecodeCache, StrictUndefined)
 from future.utils import with_metaclass
 from abc import ABCMeta, abstractmethod
 import sympy
 from nineml import units
-from nineml.exceptions import NineMLNameError, NineMLSerializationError
 from pype9.exceptions import (
-    Pype9BuildError, Pype9CommandNotFoundError, Pype9RuntimeError)
-from ..cells.with_synapses import read
+    Pype9BuildError, Pype9CommandNotFoundError, Pype9RuntimeError,
+    Pype9UsageError)
 import pype9.annotations
 from pype9.annotations import PYPE9_NS, BUILD_PROPS
 from os.path import expanduser
-import re
-from nineml.serialization import url_re
 import sysconfig
 from pype9 import __version__
 from pype9.utils.paths import remove_ignore_missing
+from pype9.utils.misc import spawn_pool
 from pype9.utils.logging import logger
 
 BASE_BUILD_DIR = os.path.join(
@@ -69,6 +73,16 @@ class BaseCodeGenerator(with_metaclass(ABCMeta, object)):
     _INSTL_DIR = 'install'
     _CMPL_DIR = 'compile'  # Ignored for NEURON but used for NEST
     _BUILT_COMP_CLASS = 'built_component_class.xml'
+    _CHECKSUM_FILE = 'checksum.txt'  # Only written once the build completes
+
+    # Digests of the template directories, calculated the first time they are
+    # required
+    _template_digests = {}
+
+    # Jinja2 environments, keyed by the template search path and bytecode
+    # cache directory, so templates are only compiled once per process
+    _jinja_envs = {}
+    _BYTECODE_CACHE_DIR = '.template_cache'
 
     # Python functions and annotations to be made available in the templates
     _globals = dict(
@@ -84,11 +98,14 @@ class BaseCodeGenerator(with_metaclass(ABCMeta, object)):
     # units
     DEFAULT_UNITS = {}
 
-    def __init__(self, base_dir=None, **kwargs):  # @UnusedVariable
+    def __init__(self, base_dir=None, bytecode_cache=True, **kwargs):  # @UnusedVariable @IgnorePep8
         if base_dir is None:
             base_dir = BASE_BUILD_DIR
         self._base_dir = os.path.join(
             base_dir, self.SIMULATOR_NAME + self.SIMULATOR_VERSION)
+        # Whether to store compiled templates within the build directory
+        # so they can be reused between processes
+        self._bytecode_cache = bytecode_cache
 
     def __repr__(self):
         return "{}CodeGenerator(base_dir='{}')".format(
@@ -126,7 +143,8 @@ class BaseCodeGenerator(with_metaclass(ABCMeta, object)):
     def compile_source_files(self, compile_dir, name):
         pass
 
-    def generate(self, component_class, build_mode='lazy', url=None, **kwargs):
+    def generate(self, component_class, build_mode='lazy', url=None,
+                 checksum=None, **kwargs):
         """
         Generates and builds the required simulator-specific files for a given
         NineML cell class
@@ -135,29 +153,29 @@ class BaseCodeGenerator(with_metaclass(ABCMeta, object)):
         ----------
         component_class : nineml.Dynamics
             9ML Dynamics object
-        name : str
-            Name of the generated cell class
-        install_dir : str
-            Path to the directory where the NMODL files
-            will be generated and compiled
         build_mode : str
             Available build options:
-                lazy - only build if files are modified
+                lazy - only build if there isn't a completed build with a
+                       matching checksum
                 force - always generate and build
                 purge - remove all config files, generate and rebuild
                 require - require built binaries are present
                 build_only - build and then quit
                 generate_only - generate src and then quit
-                recompile - don't generate src but compile
-        build_version : str
-            A suffix appended to the cell build name to distinguish
-            it from other code generated from the component class
         url : str
-            The URL where the component class is stored (used to form the
-            build path)
+            The URL where the component class is stored (only used in log
+            messages as builds are stored by checksum)
+        checksum : str | None
+            The checksum of the component class and template arguments as
+            returned by the 'checksum' method. If None it will be calculated.
         kwargs : dict
             A dictionary of (potentially simulator- specific) template
             arguments
+
+        Returns
+        -------
+        install_dir : str
+            The directory the compiled libraries are installed in
         """
         # Save original working directory to reinstate it afterwards (just to
         # be polite)
@@ -165,63 +183,54 @@ class BaseCodeGenerator(with_metaclass(ABCMeta, object)):
         orig_dir = os.getcwd()
         if url is None:
             url = component_class.url
+        if checksum is None:
+            checksum = self.checksum(component_class, **kwargs)
         # Calculate compile directory path within build directory
-        src_dir = self.get_source_dir(name, url)
-        compile_dir = self.get_compile_dir(name, url)
-        install_dir = self.get_install_dir(name, url)
+        src_dir = self.get_source_dir(name, checksum)
+        compile_dir = self.get_compile_dir(name, checksum)
+        install_dir = self.get_install_dir(name, checksum)
         # Path of the build component class
         built_comp_class_pth = os.path.join(src_dir, self._BUILT_COMP_CLASS)
         # Determine whether the installation needs rebuilding or whether there
         # is an existing library module to use.
         if build_mode == 'purge':
-            remove_ignore_missing(src_dir)
-            remove_ignore_missing(install_dir)
-            remove_ignore_missing(compile_dir)
+            remove_ignore_missing(self.get_build_dir(name, checksum))
             generate_source = compile_source = True
         elif build_mode in ('force', 'build_only'):  # Force build
             generate_source = compile_source = True
         elif build_mode == 'require':  # Just check that prebuild is present
+            if not self.is_built(name, checksum):
+                raise Pype9BuildError(
+                    "Prebuilt installation of '{}' (checksum {}) is not "
+                    "present in '{}', and is required for 'require' build "
+                    "option".format(name, checksum,
+                                    self.get_build_dir(name, checksum)))
             generate_source = compile_source = False
         elif build_mode == 'generate_only':  # Only generate
             generate_source = True
             compile_source = False
-        elif build_mode == 'lazy':  # Generate if source has been modified
-            compile_source = True
-            if not os.path.exists(built_comp_class_pth):
-                generate_source = True
+        elif build_mode == 'lazy':  # Generate if no matching build is found
+            if self.is_built(name, checksum):
+                generate_source = compile_source = False
+                logger.info("Found existing build of '{}' with matching "
+                            "checksum in '{}' directory, code generation and "
+                            "compilation skipped (set 'build_mode' argument "
+                            "to 'force' or 'build_only' to enforce "
+                            "regeneration)".format(
+                                name, self.get_build_dir(name, checksum)))
             else:
-                try:
-                    built_component_class = read(built_comp_class_pth)[name]
-                    if built_component_class.equals(component_class,
-                                                    annotations_ns=[PYPE9_NS]):
-                        generate_source = False
-                        logger.info("Found existing source in '{}' directory, "
-                                    "code generation skipped (set 'build_mode'"
-                                    " argument to 'force' or 'build_only' to "
-                                    "enforce regeneration)".format(src_dir))
-                    else:
-                        generate_source = True
-                        logger.info("Found existing source in '{}' directory, "
-                                    "but the component classes differ so "
-                                    "regenerating sources".format(src_dir))
-                except (NineMLNameError, NineMLSerializationError):
-                    generate_source = True
-                    logger.info("Found existing source in '{}' directory, "
-                                "but could not find '{}' component class so "
-                                "regenerating sources".format(name, src_dir))
-        # Check if required directories are present depending on build_mode
-        elif build_mode == 'require':
-            if not os.path.exists(install_dir):
-                raise Pype9BuildError(
-                    "Prebuilt installation directory '{}' is not "
-                    "present, and is required for  'require' build option"
-                    .format(install_dir))
+                generate_source = compile_source = True
         else:
             raise Pype9BuildError(
                 "Unrecognised build option '{}', must be one of ('{}')"
                 .format(build_mode, "', '".join(self.BUILD_MODE_OPTIONS)))
         # Generate source files from NineML code
         if generate_source:
+            logger.info("Generating source files for '{}' (loaded from '{}') "
+                        "in '{}' directory".format(name, url, src_dir))
+            # Remove the checksum file so an incomplete build is not
+            # mistaken for a complete one
+            remove_ignore_missing(self._checksum_path(name, checksum))
             self.clean_src_dir(src_dir, name)
             self.generate_source_files(
                 name=name,
@@ -234,34 +243,198 @@ class BaseCodeGenerator(with_metaclass(ABCMeta, object)):
                                   preserve_order=True, version=2.0)
         if compile_source:
             # Clean existing compile & install directories from previous builds
-            if generate_source:
-                self.clean_compile_dir(compile_dir,
-                                       purge=(build_mode == 'purge'))
-                self.configure_build_files(
-                    name=name, src_dir=src_dir, compile_dir=compile_dir,
-                    install_dir=install_dir, **kwargs)
-                self.clean_install_dir(install_dir)
+            self.clean_compile_dir(compile_dir,
+                                   purge=(build_mode == 'purge'))
+            self.configure_build_files(
+                name=name, src_dir=src_dir, compile_dir=compile_dir,
+                install_dir=install_dir, **kwargs)
+            self.clean_install_dir(install_dir)
             self.compile_source_files(compile_dir, name)
+            # Mark the build as complete by writing the checksum file
+            with open(self._checksum_path(name, checksum), 'w') as f:
+                f.write(checksum)
         # Switch back to original dir
         os.chdir(orig_dir)
-        # Cache any dimension maps that were calculated during the generation
-        # process
         return install_dir
 
-    def get_build_dir(self, name, url):
-        return os.path.join(self.base_dir, self.url_build_path(url), name)
+    def generate_all(self, builds, build_mode='lazy', num_workers=None):
+        """
+        Generates and builds multiple component classes at the same time in a
+        pool of worker processes, which are spawned rather than forked so they
+        don't inherit the state of the simulator in the parent process
+
+        Parameters
+        ----------
+        builds : list(tuple(nineml.Dynamics, str, str, dict))
+            The build component class, url, checksum and template arguments
+            of each build (see 'generate')
+        build_mode : str
+            The build mode (see 'generate')
+        num_workers : int | None
+            The maximum number of build processes to run at the same time. If
+            None the number of CPUs is used
+        """
+        if not builds:
+            return
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        num_workers = min(num_workers, len(builds))
+        jobs = [(self, component_class, url, checksum, build_mode, kwargs)
+                for component_class, url, checksum, kwargs in builds]
+        logger.info("Building {} component classes with {} worker processes"
+                    .format(len(jobs), num_workers))
+        if num_workers > 1:
+            pool = spawn_pool(num_workers)
+            try:
+                pool.map(_generate, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                _generate(job)
+
+    def generate_combined(self, builds, build_mode='lazy', num_workers=None):  # @UnusedVariable @IgnorePep8
+        """
+        Generates multiple component classes and compiles them together into
+        a single library (overridden by simulators that support it)
+        """
+        raise Pype9UsageError(
+            "Combined builds are not supported for {}".format(
+                self.SIMULATOR_NAME))
+
+    def load_combined(self, builds):  # @UnusedVariable
+        """
+        Loads the library built by 'generate_combined' (overridden by
+        simulators that support it)
+        """
+        raise Pype9UsageError(
+            "Combined builds are not supported for {}".format(
+                self.SIMULATOR_NAME))
+
+    def checksum(self, component_class, **template_args):
+        """
+        Calculates a checksum of the build component class, the simulator
+        version, the templates used to generate the code and the arguments
+        passed to them, which is used to look up previous builds of identical
+        component classes (regardless of where they were loaded from).
+
+        Parameters
+        ----------
+        component_class : nineml.Dynamics
+            The transformed build component class (see 'transform_for_build')
+        template_args : dict
+            The (potentially simulator-specific) template arguments the code
+            is generated with (see 'generate')
+
+        Returns
+        -------
+        checksum : str
+            Hex-digest of the SHA1 hash
+        """
+        serialized = component_class.serialize(format='xml', version=2,
+                                               to_str=True)
+        sha = hashlib.sha1()
+        args_str = self.canonical_template_args(template_args)
+        for part in (self.SIMULATOR_NAME, self.SIMULATOR_VERSION,
+                     pype9.__version__, self.template_digest(), serialized,
+                     args_str):
+            sha.update(part.encode('utf-8'))
+        return sha.hexdigest()
+
+    @classmethod
+    def canonical_template_args(cls, template_args):
+        """
+        Serializes the template arguments into a string that doesn't depend
+        on the order they were passed in or on the process they were
+        serialized in, so it can be used in the checksums of the builds
 
-    def get_source_dir(self, name, url):
+        Parameters
+        ----------
+        template_args : dict
+            The template arguments the code is generated with, the values of
+            which need to be None, bools, numbers, strings or (nested) lists,
+            tuples, sets or dicts of them
+
+        Returns
+        -------
+        args_str : str
+            The template arguments serialized as JSON with sorted keys
+        """
+        return json.dumps(
+            dict((k, cls._canonical_template_arg(k, v))
+                 for k, v in template_args.items()),
+            sort_keys=True, separators=(',', ':'))
+
+    @classmethod
+    def _canonical_template_arg(cls, name, value):
+        if value is None or isinstance(value, (bool, basestring)):
+            return value
+        elif isinstance(value, numpy.generic):
+            return value.item()
+        elif isinstance(value, (int, long, float)):
+            return value
+        elif isinstance(value, dict):
+            return dict((str(k), cls._canonical_template_arg(
+                '{}[{}]'.format(name, k), v)) for k, v in value.items())
+        elif isinstance(value, (list, tuple)):
+            return [cls._canonical_template_arg('{}[{}]'.format(name, i), v)
+                    for i, v in enumerate(value)]
+        elif isinstance(value, (set, frozenset)):
+            return sorted(cls._canonical_template_arg(name, v) for v in value)
+        raise Pype9UsageError(
+            "Template argument '{}' ({}) is not a None, bool, number, string "
+            "or a container of them, so it can't be included in the checksum "
+            "of the build".format(name, repr(value)))
+
+    @classmethod
+    def template_digest(cls):
+        """
+        A digest of the contents of the template directory so that changes to
+        the templates invalidate existing builds (calculated once per
+        process)
+        """
+        try:
+            return cls._template_digests[cls.BASE_TMPL_PATH]
+        except KeyError:
+            sha = hashlib.sha1()
+            for path, dirs, files in os.walk(cls.BASE_TMPL_PATH):
+                dirs.sort()  # Ensure the walk order is deterministic
+                for fname in sorted(files):
+                    fpath = os.path.join(path, fname)
+                    sha.update(
+                        os.path.relpath(fpath,
+                                        cls.BASE_TMPL_PATH).encode('utf-8'))
+                    with open(fpath, 'rb') as f:
+                        sha.update(f.read())
+            digest = cls._template_digests[cls.BASE_TMPL_PATH] = (
+                sha.hexdigest())
+            return digest
+
+    def is_built(self, name, checksum):
+        """
+        Checks whether there is a completed build matching the checksum
+        """
+        return os.path.exists(self._checksum_path(name, checksum))
+
+    def get_build_dir(self, name, checksum):
+        return os.path.join(self.base_dir, name, checksum)
+
+    def get_source_dir(self, name, checksum):
         return os.path.abspath(os.path.join(
-            self.get_build_dir(name, url), self._SRC_DIR))
+            self.get_build_dir(name, checksum), self._SRC_DIR))
 
-    def get_compile_dir(self, name, url):
+    def get_compile_dir(self, name, checksum):
         return os.path.abspath(os.path.join(
-            self.get_build_dir(name, url), self._CMPL_DIR))
+            self.get_build_dir(name, checksum), self._CMPL_DIR))
 
-    def get_install_dir(self, name, url):
+    def get_install_dir(self, name, checksum):
         return os.path.abspath(os.path.join(
-            self.get_build_dir(name, url), self._INSTL_DIR))
+            self.get_build_dir(name, checksum), self._INSTL_DIR))
+
+    def _checksum_path(self, name, checksum):
+        return os.path.join(self.get_build_dir(name, checksum),
+                            self._CHECKSUM_FILE)
 
     def clean_src_dir(self, src_dir, component_name):  # @UnusedVariable
         # Clean existing src directories from previous builds.
@@ -303,27 +476,56 @@ class BaseCodeGenerator(with_metaclass(ABCMeta, object)):
             self.BASE_TMPL_PATH,
             os.path.join(self.BASE_TMPL_PATH, 'includes')]
         # Add include paths for various switches (e.g. solver type)
-        for name, value in list(switches.items()):
+        for name, value in sorted(switches.items()):
             if value is not None:
                 template_paths.append(os.path.join(self.BASE_TMPL_PATH,
                                                    'includes', name, value))
         # Add default path for template includes
         template_paths.append(
             os.path.join(self.BASE_TMPL_PATH, 'includes', 'default'))
-        # Initialise the Jinja2 environment
-        jinja_env = Environment(loader=FileSystemLoader(template_paths),
-                                trim_blocks=True, lstrip_blocks=True,
-                                undefined=StrictUndefined)
-        # Add some globals used by the template code
-        jinja_env.globals.update(**self._globals)
         # Actually render the contents
-        contents = jinja_env.get_template(template).render(**args)
+        contents = self._jinja_env(template_paths).get_template(
+            template).render(**args)
         for old, new in list(post_hoc_subs.items()):
             contents = contents.replace(old, new)
         # Write the contents to file
         with open(os.path.join(directory, filename), 'w') as f:
             f.write(contents)
 
+    def _jinja_env(self, template_paths):
+        """
+        Returns the Jinja2 environment for the given template search path,
+        which is created the first time it is requested. Environments cache
+        their compiled templates so reusing them avoids recompiling the
+        templates on every call to 'render_to_file'.
+        """
+        if self._bytecode_cache:
+            cache_dir = os.path.join(self.base_dir, self._BYTECODE_CACHE_DIR)
+        else:
+            cache_dir = None
+        key = (tuple(template_paths), cache_dir)
+        try:
+            jinja_env = self._jinja_envs[key]
+        except KeyError:
+            if cache_dir is not None:
+                try:
+                    os.makedirs(cache_dir)
+                except OSError:
+                    if not os.path.isdir(cache_dir):
+                        raise
+                bytecode_cache = FileSystemBytecodeCache(cache_dir)
+            else:
+                bytecode_cache = None
+            # Initialise the Jinja2 environment
+            jinja_env = Environment(loader=FileSystemLoader(template_paths),
+                                    trim_blocks=True, lstrip_blocks=True,
+                                    undefined=StrictUndefined,
+                                    bytecode_cache=bytecode_cache)
+            # Add some globals used by the template code
+            jinja_env.globals.update(**self._globals)
+            self._jinja_envs[key] = jinja_env
+        return jinja_env
+
     def path_to_utility(self, utility_name, env_var='', **kwargs):  # @UnusedVariable @IgnorePep8
         """
         Returns the full path to an executable by searching the "PATH"
@@ -448,22 +650,21 @@ class BaseCodeGenerator(with_metaclass(ABCMeta, object)):
             mod_time = time.ctime(os.path.getmtime(url))
         return mod_time
 
-    @classmethod
-    def url_build_path(cls, url):
-        if url is None:
-            path = 'generated'
-        else:
-            if url_re.match(url) is not None:
-                path = os.path.join(
-                    'url',
-                    re.match(r'(:?\w+://)?([\.\/\w]+).*', url).group(1))
-            else:
-                path = os.path.join('file', os.path.realpath(url)[1:])
-        return path
-
-    def load_libraries(self, name, url, **kwargs):
+    def load_libraries(self, name, checksum, **kwargs):
         """
         To be overridden by derived classes to allow the model to be loaded
         from compiled external libraries
         """
         pass
+
+
+def _generate(job):
+    """
+    Runs the code generation and compilation of a single component class
+    (defined at the module level so it can be pickled and sent to worker
+    processes)
+    """
+    code_generator, component_class, url, checksum, build_mode, kwargs = job
+    return code_generator.generate(
+        component_class=component_class, url=url, build_mode=build_mode,
+        checksum=checksum, **kwargs)
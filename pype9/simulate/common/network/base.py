@@ -11,16 +11,26 @@ from past.builtins import basestring
 from builtins import object
 from collections import namedtuple, defaultdict
 from itertools import chain
+import json
+import hashlib
+import pickle
+import tempfile
+import weakref
+import numpy
 import quantities as pq
 import neo
 from nineml.user import Property
 from pype9.exceptions import Pype9RuntimeError
 from .values import get_pyNN_value
 import os.path
+import errno
 import nineml
 from nineml import units as un
 from pyNN.parameters import Sequence
+from pyNN.random import NumpyRNG
+import pyNN
 import pyNN.standardmodels
+import pype9
 from nineml import Document
 from nineml.exceptions import NineMLNameError
 from nineml.user.multi import (
@@ -38,10 +48,18 @@ from ..cells import (
     MultiDynamicsWithSynapsesProperties, ConnectionPropertySet,
     SynapseProperties)
 from pype9.exceptions import Pype9UsageError, Pype9NameError
+from pype9.utils.mpi import mpi_comm, is_mpi_master
+from pype9.utils.logging import logger
 
 
 _REQUIRED_SIM_PARAMS = ['timestep', 'min_delay', 'max_delay', 'temperature']
 
+# The details required to create a ConnectionGroup for a port connection of a
+# projection, where 'reverse' flags connections to the pre-synaptic cell
+_ConnectionGroupSpec = namedtuple(
+    '_ConnectionGroupSpec', ('name', 'projection', 'communicates',
+                             'source_port', 'destination_port', 'reverse'))
+
 
 class Network(object):
     """
@@ -57,13 +75,51 @@ class Network(object):
         A 9ML-Python model of a network (or Document containing
         populations and projections for 9MLv1) or a URL referring to a 9ML
         model.
+    build_mode : str
+        The build/compilation strategy for rebuilding the generated code (see
+        BaseCodeGenerator.generate)
+    num_build_workers : int | None
+        The maximum number of cell classes that are generated and compiled at
+        the same time in separate processes. If None the number of CPUs is
+        used.
+    combine_mechanisms : bool
+        Whether to compile the cell classes of the network together into a
+        single library that is loaded once (NEURON only)
+    connections_dir : str | None
+        A directory the connections of the network were saved to with
+        ``save_connections``. If provided, the projections are connected with
+        the saved connections instead of being resampled
+    connectivity_cache : str | None
+        A directory in which the sampled connections are cached, keyed by the
+        network model, the properties seeds and the number of processes. If a
+        matching set of connections has been cached by a previous
+        construction of the network they are loaded instead of being
+        resampled, otherwise the sampled connections are saved to the cache
+    flattening_cache : str | None
+        A directory in which the populations and projections of the network
+        flattened into component arrays and connection groups are cached,
+        keyed by a hash of the network model
     """
 
     # Name given to the "cell" component of the cell dynamics + linear synapse
     # dynamics multi-dynamics
     CELL_COMP_NAME = 'cell'
 
-    def __init__(self, nineml_model, build_mode='lazy', **kwargs):
+    # Name of the file listing the connection groups saved to a directory by
+    # save_connections
+    CONNECTIONS_MANIFEST = 'manifest.json'
+
+    # Incremented when changes to the flattening invalidate cached networks
+    _FLATTENING_CACHE_VERSION = 1
+
+    # Memoized dependency analysis of synapse component classes, keyed by
+    # the ids of the component classes they are made of, along with weak
+    # references to those classes (see _connection_dependencies)
+    _connection_dependencies_cache = {}
+
+    def __init__(self, nineml_model, build_mode='lazy', num_build_workers=None,
+                 combine_mechanisms=False, connections_dir=None,
+                 connectivity_cache=None, flattening_cache=None, **kwargs):
         if isinstance(nineml_model, basestring):
             nineml_model = nineml.read(nineml_model).as_network(
                 name=os.path.splitext(os.path.basename(nineml_model))[0])
@@ -74,32 +130,68 @@ class Network(object):
                 name = "Anonymous"
             nineml_model = nineml_model.as_network(name=name)
         self._nineml = nineml_model.clone()
-        # Get RNG for random distribution values and connectivity
-        rng = self.Simulation.active().properties_rng
-        if build_mode != 'build_only':
+        # Only generate/compile the code when build_mode is 'build_only' or
+        # 'generate_only'
+        construct = build_mode not in ('build_only', 'generate_only')
+        # Get RNG for the connectivity and the random connection properties,
+        # which is derived from the properties RNG so that exactly one value
+        # is drawn from the properties RNG whether the connections are sampled
+        # or loaded (e.g. from the connectivity cache)
+        rng = NumpyRNG(self.Simulation.active().derived_properties_seed)
+        cache_dir = None
+        if (connectivity_cache is not None and connections_dir is None and
+                construct):
+            cache_dir = os.path.join(connectivity_cache,
+                                     self._connectivity_key(self._nineml))
+            if os.path.exists(os.path.join(cache_dir,
+                                           self.CONNECTIONS_MANIFEST)):
+                logger.info("Loading cached connections of '{}' from '{}'"
+                            .format(self._nineml.name, cache_dir))
+                connections_dir = cache_dir
+                cache_dir = None
+        if construct:
             self.nineml.resample_connectivity(
-                connectivity_class=self.ConnectivityClass, rng=rng)
+                connectivity_class=self.ConnectivityClass, rng=rng,
+                **self._connectivity_kwargs())
         (flat_comp_arrays, flat_conn_groups,
-         flat_selections) = self._flatten_to_arrays_and_conns(self._nineml)
+         flat_selections) = self._flatten_to_arrays_and_conns(
+             self._nineml, cache_dir=flattening_cache)
+        cell_types = self._share_cell_types(flat_comp_arrays)
         self._component_arrays = {}
-        # Build the PyNN populations
+        self._selections = {}
+        self._connection_groups = {}
         # Add build args to distinguish models built for this network as
         # opposed to other networks
         build_url = kwargs.pop('build_url', nineml_model.url)
         build_version = nineml_model.name + kwargs.pop('build_version', '')
-        for name, comp_array in flat_comp_arrays.items():
-            self._component_arrays[name] = self.ComponentArrayClass(
-                comp_array, build_mode=build_mode,
+        # Generate and compile the code for all cell classes in parallel
+        # before they are loaded one-by-one when the arrays are created
+        PyNNCellWrapperMetaClass = (
+            self.ComponentArrayClass.PyNNCellWrapperMetaClass)
+        PyNNCellWrapperMetaClass.CellMetaClass.build_all(
+            (PyNNCellWrapperMetaClass.cell_metaclass_kwargs(
+                component_class=cell_types[name],
+                default_properties=ca.dynamics_properties,
+                initial_state=list(ca.dynamics_properties.initial_values),
                 build_url=build_url, build_version=build_version, **kwargs)
-        self._selections = {}
-        # Build the PyNN Selections
-        for selection in flat_selections.values():
-            # TODO: Assumes that selections are only concatenations (which is
-            #       true for 9MLv1.0 but not v2.0)
-            self._selections[selection.name] = self.SelectionClass(
-                selection, *[self.component_array(p.name)
-                             for p in selection.populations])
-        if build_mode != 'build_only':
+             for name, ca in flat_comp_arrays.items()),
+            build_mode=build_mode, num_workers=num_build_workers,
+            combined=combine_mechanisms)
+        if construct:
+            # Build the PyNN populations. The code has already been built by
+            # 'build_all' so it only needs to be checked for and loaded
+            for name, comp_array in flat_comp_arrays.items():
+                self._component_arrays[name] = self.ComponentArrayClass(
+                    comp_array, component_class=cell_types[name],
+                    build_mode='require', build_url=build_url,
+                    build_version=build_version, **kwargs)
+            # Build the PyNN Selections
+            for selection in flat_selections.values():
+                # TODO: Assumes that selections are only concatenations (which
+                #       is true for 9MLv1.0 but not v2.0)
+                self._selections[selection.name] = self.SelectionClass(
+                    selection, *[self.component_array(p.name)
+                                 for p in selection.populations])
             # Set the connectivity objects of the projections to the
             # PyNNConnectivity class
             if self.nineml.connectivity_has_been_sampled():
@@ -107,7 +199,7 @@ class Network(object):
                     "Connections have already been sampled, please reset them"
                     " using 'resample_connectivity' before constructing "
                     "network")
-            self._connection_groups = {}
+            endpoints = {}
             for name, conn_group in flat_conn_groups.items():
                 try:
                     source = self._component_arrays[conn_group.source.name]
@@ -118,10 +210,38 @@ class Network(object):
                         conn_group.destination.name]
                 except KeyError:
                     destination = self._selections[conn_group.destination.name]
+                endpoints[name] = (source, destination)
+            if connections_dir is not None:
+                # Only the connections to cells local to the process need to
+                # be loaded
+                saved_connections = self.load_connections(
+                    connections_dir, local_masks=dict(
+                        (n, d._mask_local) for n, (_, d) in endpoints.items()))
+            for name, conn_group in flat_conn_groups.items():
+                source, destination = endpoints[name]
+                if connections_dir is not None:
+                    try:
+                        connections = saved_connections[name]
+                    except KeyError:
+                        raise Pype9UsageError(
+                            "No connections saved for '{}' connection group "
+                            "in '{}'".format(name, connections_dir))
+                else:
+                    connections = None
                 self._connection_groups[name] = self.ConnectionGroupClass(
-                    conn_group, source=source, destination=destination)
+                    conn_group, source=source, destination=destination,
+                    connections=connections, rng=rng)
+            if cache_dir is not None:
+                self.save_connections(cache_dir)
             self._finalise_construction()
 
+    def _connectivity_kwargs(self):
+        """
+        Can be overriden by deriving classes to pass simulator-specific
+        options to the connectivity objects of the projections
+        """
+        return {}
+
     def _finalise_construction(self):
         """
         Can be overriden by deriving classes to do any simulator-specific
@@ -222,19 +342,126 @@ class Network(object):
 
     def save_connections(self, output_dir):
         """
-        Saves generated connections to output directory
+        Saves the connections of the network to the output directory, which
+        can be loaded again by passing the directory to the 'connections_dir'
+        argument of the Network. Each MPI process saves the connections it
+        holds locally to a separate numpy (.npz) file for each connection
+        group so the connections don't need to be gathered onto a single
+        process. The master process also writes a manifest listing the
+        connection groups and saved attributes.
 
-        @param output_dir:
+        Parameters
+        ----------
+        output_dir : str
+            The directory to save the connections to
         """
-        for conn_grp in self.connection_groups.values():
+        if is_mpi_master():
+            try:
+                os.makedirs(output_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        mpi_comm.barrier()
+        manifest = {'num_processes': self.num_processes,
+                    'connection_groups': {}}
+        for conn_grp in self.connection_groups:
             if isinstance(conn_grp.synapse_type,
                           pyNN.standardmodels.synapses.ElectricalSynapse):
-                attributes = 'weight'
+                attributes = ['weight']
             else:
-                attributes = 'all'
-            conn_grp.save(attributes, os.path.join(
-                output_dir, conn_grp.label + '.proj'), format='list',
-                gather=True)
+                attributes = ['weight', 'delay']
+            values = numpy.array(
+                conn_grp.get(attributes, format='list', with_address=True,
+                             gather=False),
+                dtype=float).reshape(-1, len(attributes) + 2)
+            columns = {'source': values[:, 0].astype(int),
+                       'destination': values[:, 1].astype(int)}
+            columns.update((a, values[:, i + 2])
+                           for i, a in enumerate(attributes))
+            numpy.savez(self._connections_path(output_dir, conn_grp.name,
+                                               self.rank), **columns)
+            manifest['connection_groups'][conn_grp.name] = {
+                'source': conn_grp.pre.label,
+                'destination': conn_grp.post.label,
+                'attributes': attributes}
+        if is_mpi_master():
+            with open(os.path.join(output_dir,
+                                   self.CONNECTIONS_MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+        mpi_comm.barrier()
+
+    @classmethod
+    def load_connections(cls, input_dir, local_masks=None):
+        """
+        Loads connections saved by ``save_connections``. If they were saved
+        with the same number of processes, each process only loads the file
+        it saved, which holds the connections to its local cells. Otherwise
+        the files saved by every process are read, so the connections can be
+        loaded with a different number of processes than they were saved
+        with, keeping only the connections to local cells if 'local_masks'
+        is provided.
+
+        Parameters
+        ----------
+        input_dir : str
+            The directory the connections were saved to
+        local_masks : dict(str, numpy.ndarray(bool)) | None
+            Masks of the destination cells that are local to the process for
+            each connection group
+
+        Returns
+        -------
+        connections : dict(str, ConnectionList)
+            The connections of each connection group as an array with columns
+            for the source and destination indices followed by the saved
+            attributes (as used by pyNN.FromListConnector)
+        """
+        try:
+            with open(os.path.join(input_dir, cls.CONNECTIONS_MANIFEST)) as f:
+                manifest = json.load(f)
+        except IOError:
+            raise Pype9UsageError(
+                "No connections manifest found in '{}', was it created with "
+                "'save_connections'?".format(input_dir))
+        if manifest['num_processes'] == mpi_comm.size:
+            ranks = [mpi_comm.rank]
+        else:
+            ranks = range(manifest['num_processes'])
+        connections = {}
+        for name, info in manifest['connection_groups'].items():
+            columns = ['source', 'destination'] + info['attributes']
+            rank_arrays = []
+            for rank in ranks:
+                saved = numpy.load(cls._connections_path(input_dir, name,
+                                                         rank))
+                array = numpy.column_stack(
+                    [saved[c].astype(float) for c in columns])
+                if local_masks is not None and name in local_masks:
+                    array = array[numpy.asarray(local_masks[name])[
+                        array[:, 1].astype(int)]]
+                rank_arrays.append(array)
+            connections[name] = ConnectionList(
+                numpy.concatenate(rank_arrays), info['attributes'])
+        return connections
+
+    def _connectivity_key(self, nineml_model):
+        """
+        A hash of everything that determines the sampled connections of the
+        network, used to look them up in the connectivity cache
+        """
+        sim = self.Simulation.active()
+        sha = hashlib.sha1()
+        for part in (sim.name, pyNN.__version__,
+                     str(sim.num_processes()),
+                     ','.join(str(s) for s in sim.all_properties_seeds),
+                     nineml_model.serialize(format='xml', version=2,
+                                            to_str=True)):
+            sha.update(part.encode('utf-8'))
+        return sha.hexdigest()
+
+    @classmethod
+    def _connections_path(cls, directory, name, rank):
+        return os.path.join(directory, '{}.{}.npz'.format(name, rank))
 
     def record(self, variable, t_start=None):  # @UnusedVariable
         """
@@ -329,25 +556,88 @@ class Network(object):
         return synapse, port_connections
 
     @classmethod
-    def _flatten_to_arrays_and_conns(cls, network_model):
+    def _flatten_to_arrays_and_conns(cls, network_model, cache_dir=None):
         """
         Convert populations and projections into component arrays and
         connection groups
+
+        Parameters
+        ----------
+        network_model : nineml.Network
+            The network to flatten
+        cache_dir : str | None
+            A directory to cache the flattened component arrays in, keyed by a
+            hash of the network model, so they can be reloaded instead of
+            being flattened again the next time the network is constructed
         """
-        component_arrays = {}
+        cache_path = flattened = None
+        if cache_dir is not None:
+            cache_path = os.path.join(
+                cache_dir, cls._flattening_key(network_model) + '.pkl')
+            flattened = cls._load_flattened(cache_path)
+        if flattened is None:
+            flattened = cls._flatten(network_model)
+            if cache_path is not None and is_mpi_master():
+                cls._save_flattened(cache_path, flattened)
+        component_arrays, selections, conn_group_specs = flattened
+        arrays_and_selections = dict(
+            chain(iter(component_arrays.items()), iter(selections.items())))
+        # Create the connection groups from the projections of the network
+        # (rather than the cache) so they use the connectivity objects that
+        # have been sampled for this network
         connection_groups = {}
+        for spec in conn_group_specs:
+            proj = network_model.projection(spec.projection)
+            if spec.reverse:
+                # If a "reverse connection" to the pre-synaptic cell
+                # the connectivity needs to be inverted
+                connectivity = InversePyNNConnectivity(proj.connectivity)
+                delay = 0.0 * un.s
+            else:
+                # If a connection from the pre-synaptic cell the delay
+                # is included
+                # TODO: In version 2 all port-connections will have
+                # their own delays
+                connectivity = proj.connectivity
+                delay = proj.delay
+            ConnectionGroupClass = (EventConnectionGroup9ML
+                                    if spec.communicates == 'event'
+                                    else AnalogConnectionGroup9ML)
+            connection_groups[spec.name] = ConnectionGroupClass(
+                spec.name,
+                arrays_and_selections[proj.pre.name],
+                arrays_and_selections[proj.post.name],
+                source_port=spec.source_port,
+                destination_port=spec.destination_port,
+                connectivity=connectivity,
+                delay=delay)
+        return component_arrays, connection_groups, selections
+
+    @classmethod
+    def _flatten(cls, network_model):
+        """
+        Flattens the populations and projections of the network into
+        component arrays, selections and the specifications of the connection
+        groups between them
+        """
+        component_arrays = {}
+        # Index the projections that project to/from each population and
+        # flatten the synapse of each projection once up front
+        receiving = defaultdict(list)
+        sending = defaultdict(list)
+        flat_synapses = {}
+        for proj in network_model.projections:
+            for pop_name in cls._population_names(proj.post):
+                receiving[pop_name].append(proj)
+            for pop_name in cls._population_names(proj.pre):
+                sending[pop_name].append(proj)
+            flat_synapses[proj.name] = cls._flatten_synapse(proj)
         # Create flattened component with all synapses combined with the post-
         # synaptic cell dynamics using MultiDynamics
         for pop in network_model.populations:
             # Get all the projections that project to/from the given population
-            receiving = [p for p in network_model.projections
-                         if (pop == p.post or
-                             (p.post.nineml_type == 'Selection' and
-                              pop in p.post.populations))]
-            sending = [p for p in network_model.projections
-                       if (pop == p.pre or
-                           (p.pre.nineml_type == 'Selection' and
-                            pop in p.pre.populations))]
+            receiving_projs = receiving[pop.name]
+            sending_projs = sending[pop.name]
             # Create a dictionary to hold the cell dynamics and any synapse
             # dynamics that can be flattened into the cell dynamics
             # (i.e. linear ones).
@@ -369,17 +659,17 @@ class Network(object):
             synapses = []
             connection_property_sets = []
             # FIXME: There has to be a way of avoiding this name clash
-            if any(p.name == cls.CELL_COMP_NAME for p in receiving):
+            if any(p.name == cls.CELL_COMP_NAME for p in receiving_projs):
                 raise Pype9RuntimeError(
                     "Cannot handle projections named '{}' (why would you "
                     "choose such a silly name?;)".format(cls.CELL_COMP_NAME))
-            for proj in receiving:
+            for proj in receiving_projs:
                 # Flatten response and plasticity into single dynamics class.
                 # TODO: this should be no longer necessary when we move to
                 # version 2 as response and plasticity elements will be
                 # replaced by a synapse element in the standard. It will need
                 # be copied at this point though as it is modified
-                synapse, proj_conns = cls._flatten_synapse(proj)
+                synapse, proj_conns = flat_synapses[proj.name]
                 # Get all connections to/from the pre-synaptic cell
                 pre_conns = [pc for pc in proj_conns
                              if 'pre' in (pc.receiver_role, pc.sender_role)]
@@ -419,8 +709,8 @@ class Network(object):
                             {'post': cls.CELL_COMP_NAME,
                              'pre': cls.CELL_COMP_NAME,
                              'synapse': proj.name}) for pc in post_conns]
-                    synapses.append(SynapseProperties(proj.name, synapse,
-                                                      synapse_conns))
+                    synapses.append(SynapseProperties(
+                        proj.name, synapse.clone(), synapse_conns))
                     # Add exposures to the post-synaptic cell for connections
                     # from the synapse
                     add_exposures(chain(*(
@@ -433,9 +723,9 @@ class Network(object):
                 role2name['pre'] = cls.CELL_COMP_NAME
             # Add exposures for connections to/from the pre-synaptic cell in
             # populations.
-            for proj in sending:
+            for proj in sending_projs:
                 # Not required after transition to version 2 syntax
-                synapse, proj_conns = cls._flatten_synapse(proj)
+                _, proj_conns = flat_synapses[proj.name]
                 # Add send and receive exposures to list
                 add_exposures(chain(*(
                     pc.expose_ports({'pre': cls.CELL_COMP_NAME})
@@ -467,21 +757,17 @@ class Network(object):
             selections[sel.name] = Selection9ML(
                 sel.name, Concatenate9ML(component_arrays[p.name]
                                            for p in sel.populations))
-        arrays_and_selections = dict(
-            chain(iter(component_arrays.items()), iter(selections.items())))
-        # Create ConnectionGroups from each port connection in Projection
+        # Create the specifications of a ConnectionGroup for each port
+        # connection in a Projection
+        conn_group_specs = []
         for proj in network_model.projections:
-            _, proj_conns = cls._flatten_synapse(proj)
+            _, proj_conns = flat_synapses[proj.name]
             # Get all connections to/from the pre-synaptic cell
             pre_conns = [pc for pc in proj_conns
                          if 'pre' in (pc.receiver_role, pc.sender_role)]
             # Create a connection group for each port connection of the
             # projection to/from the pre-synaptic cell
             for port_conn in pre_conns:
-                ConnectionGroupClass = (
-                    EventConnectionGroup9ML
-                    if port_conn.communicates == 'event'
-                    else AnalogConnectionGroup9ML)
                 if len(pre_conns) > 1:
                     name = ('__'.join((proj.name,
                                        port_conn.sender_role,
@@ -490,35 +776,111 @@ class Network(object):
                                        port_conn.receive_port_name)))
                 else:
                     name = proj.name
-                if port_conn.sender_role == 'pre':
-                    connectivity = proj.connectivity
-                    # If a connection from the pre-synaptic cell the delay
-                    # is included
-                    # TODO: In version 2 all port-connections will have
-                    # their own delays
-                    delay = proj.delay
-                else:
-                    # If a "reverse connection" to the pre-synaptic cell
-                    # the connectivity needs to be inverted
-                    connectivity = InversePyNNConnectivity(
-                        proj.connectivity)
-                    delay = 0.0 * un.s
                 # Append sub-component namespaces to the source/receive
                 # ports
                 ns_port_conn = port_conn.append_namespace_from_roles(
                     {'post': cls.CELL_COMP_NAME,
                      'pre': cls.CELL_COMP_NAME,
                      'synapse': proj.name})
-                conn_group = ConnectionGroupClass(
-                    name,
-                    arrays_and_selections[proj.pre.name],
-                    arrays_and_selections[proj.post.name],
-                    source_port=ns_port_conn.send_port_name,
-                    destination_port=(ns_port_conn.receive_port_name),
-                    connectivity=connectivity,
-                    delay=delay)
-                connection_groups[conn_group.name] = conn_group
-        return component_arrays, connection_groups, selections
+                conn_group_specs.append(_ConnectionGroupSpec(
+                    name, proj.name, port_conn.communicates,
+                    ns_port_conn.send_port_name,
+                    ns_port_conn.receive_port_name,
+                    port_conn.sender_role != 'pre'))
+        return component_arrays, selections, conn_group_specs
+
+    @classmethod
+    def _share_cell_types(cls, component_arrays):
+        """
+        Maps component arrays with flattened cell types that only differ in
+        their names (e.g. populations of the same cell model receiving the
+        same synapses) to a single component class, so the cell type is only
+        generated, compiled and loaded once. The properties and initial values
+        of each array are left unchanged.
+
+        Parameters
+        ----------
+        component_arrays : dict(str, nineml.ComponentArray)
+            The flattened component arrays of the network
+
+        Returns
+        -------
+        cell_types : dict(str, nineml.Dynamics)
+            The component class to build the cell type of each component array
+            from
+        """
+        cell_types = {}
+        shared = {}
+        for name in sorted(component_arrays):
+            props = component_arrays[name].dynamics_properties
+            component_class = props.component_class
+            # Strip the population name from the cell type so it can be
+            # compared with the cell types of other populations
+            anonymous = component_class.clone()
+            anonymous.name = cls.CELL_COMP_NAME
+            anonymous.dynamics.name = cls.CELL_COMP_NAME + '__sans_synapses'
+            cell_type = shared.setdefault(anonymous, component_class)
+            if cell_type is not component_class:
+                logger.info("Sharing cell type '{}' with '{}' component array"
+                            .format(cell_type.name, name))
+            cell_types[name] = cell_type
+        return cell_types
+
+    @classmethod
+    def _population_names(cls, population_or_selection):
+        if population_or_selection.nineml_type == 'Selection':
+            return set(p.name for p in population_or_selection.populations)
+        return set([population_or_selection.name])
+
+    @classmethod
+    def _flattening_key(cls, network_model):
+        """
+        A hash of the network model and pype9 version used to look up
+        previously flattened networks in the flattening cache
+        """
+        sha = hashlib.sha1()
+        for part in (pype9.__version__,
+                     network_model.serialize(format='xml', version=2,
+                                             to_str=True)):
+            sha.update(part.encode('utf-8'))
+        return sha.hexdigest()
+
+    @classmethod
+    def _load_flattened(cls, path):
+        try:
+            with open(path, 'rb') as f:
+                version, flattened = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if version != cls._FLATTENING_CACHE_VERSION:
+            return None
+        logger.info("Loaded flattened network from '{}'".format(path))
+        return flattened
+
+    @classmethod
+    def _save_flattened(cls, path, flattened):
+        """
+        Saves the flattened network to a temporary file that is then renamed
+        so that concurrent constructions never read a partially written file
+        """
+        try:
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump((cls._FLATTENING_CACHE_VERSION, flattened), f,
+                                protocol=2)
+                os.rename(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except (IOError, OSError) as e:
+            logger.debug("Could not save flattened network to '{}' ({})"
+                         .format(path, e))
 
     @classmethod
     def _extract_connection_property_sets(cls, dynamics_properties, namespace):
@@ -529,31 +891,98 @@ class Network(object):
         """
         component_class = dynamics_properties.component_class
         varying_params = set(
-            component_class.parameter(p.name).id
-            for p in dynamics_properties.properties
+            p.name for p in dynamics_properties.properties
             if p.value.nineml_type != 'SingleValue')
-        # Get list of ports refereneced (either directly or indirectly) by
-        # time derivatives and on-conditions
-        not_permitted = set(p.id for p in component_class.required_for(
-            chain(component_class.all_time_derivatives(),
-                  component_class.all_on_conditions())).parameters)
+        not_permitted, event_params = cls._connection_dependencies(
+            component_class)
         # If varying params intersects parameters that are referenced in time
         # derivatives they can not be redefined as connection parameters
         if varying_params & not_permitted:
             raise Pype9UnflattenableSynapseException()
-        conn_params = defaultdict(dict)
-        for on_event in component_class.all_on_events():
-            for param in component_class.required_for(
-                    on_event.state_assignments).parameters:
-                if param.id in varying_params:
-                    conn_params[on_event.src_port_name][param.id] = param
+        conn_params = defaultdict(list)
+        for port_name, param_names in event_params:
+            conn_params[port_name].extend(
+                n for n in param_names
+                if n in varying_params and n not in conn_params[port_name])
         return [
             ConnectionPropertySet(
                 append_namespace(prt, namespace),
-                [Property(append_namespace(p.name, namespace),
-                          dynamics_properties.property(p.name).quantity)
-                 for p in params.values()])
-            for prt, params in conn_params.items()]
+                [Property(append_namespace(n, namespace),
+                          dynamics_properties.property(n).quantity)
+                 for n in param_names])
+            for prt, param_names in conn_params.items() if param_names]
+
+    @classmethod
+    def _connection_dependencies(cls, component_class):
+        """
+        Returns the names of the parameters referenced (either directly or
+        indirectly) by the time derivatives and on-conditions of the synapse
+        component class, and the names of the parameters referenced by the
+        state assignments of each on-event.
+
+        A new multi-dynamics class is created for the synapse of every
+        projection when it is flattened, so the results are memoized on the
+        identities of the response and plasticity classes it is made of
+        along with its internal port connections and exposures. Therefore,
+        the dependency analysis is only done once for projections that share
+        the same synapse dynamics.
+        """
+        cache = cls._connection_dependencies_cache
+        sub_classes, key = cls._connection_dependencies_key(component_class)
+        try:
+            refs, dependencies = cache[key]
+        except KeyError:
+            pass
+        else:
+            # Check the ids haven't been reused by new component classes
+            if all(r() is c for r, c in zip(refs, sub_classes)):
+                return dependencies
+        dependencies = cls._analyse_connection_dependencies(component_class)
+
+        def remove(ref):
+            # Drop the entry when one of the component classes is garbage
+            # collected
+            if ref in cache.get(key, ((),))[0]:
+                del cache[key]
+
+        cache[key] = (tuple(weakref.ref(c, remove) for c in sub_classes),
+                      dependencies)
+        return dependencies
+
+    @classmethod
+    def _connection_dependencies_key(cls, component_class):
+        """
+        Returns the component classes a synapse component class is made of
+        and the key used to memoize its connection dependencies
+        """
+        try:
+            sub_components = sorted(component_class.sub_components,
+                                    key=lambda s: s.name)
+        except AttributeError:
+            # Not a multi-dynamics class
+            return (component_class,), (id(component_class),)
+        sub_classes = tuple(s.component_class for s in sub_components)
+        key = (
+            tuple((s.name, id(s.component_class)) for s in sub_components),
+            tuple(sorted((pc.sender_name, pc.send_port_name,
+                          pc.receiver_name, pc.receive_port_name)
+                         for pc in component_class.port_connections)),
+            tuple(sorted((pe.sub_component_name, pe.port_name)
+                         for pe in component_class.port_exposures)))
+        return sub_classes, key
+
+    @classmethod
+    def _analyse_connection_dependencies(cls, component_class):
+        not_permitted = frozenset(
+            p.name for p in component_class.required_for(
+                chain(component_class.all_time_derivatives(),
+                      component_class.all_on_conditions())).parameters)
+        event_params = tuple(
+            (on_event.src_port_name,
+             tuple(p.name for p in component_class.required_for(
+                 on_event.state_assignments).parameters))
+            for on_event in component_class.all_on_events())
+        return not_permitted, event_params
 
 #             raise NotImplementedError(
 #                 "Cannot convert population '{}' to component array as "
@@ -581,18 +1010,26 @@ class ComponentArray(object):
     ----------
     nineml_model : nineml.ComponentArray
         Component array nineml
+    component_class : nineml.Dynamics | None
+        The component class to build the cell type from if it is shared with
+        other arrays (see Network._share_cell_types). If None the component
+        class of the array's dynamics properties is used
     build_mode : str
         The build/compilation strategy for rebuilding the generated code, can
         be one of 'lazy', 'force', 'build_only', 'require'.
     """
 
-    def __init__(self, nineml_model, build_mode='lazy', **kwargs):
+    def __init__(self, nineml_model, component_class=None, build_mode='lazy',
+                 **kwargs):
         if not isinstance(nineml_model, ComponentArray9ML):
             raise Pype9RuntimeError(
                 "Expected a component array, found {}".format(nineml_model))
         self._nineml = nineml_model
         dynamics_properties = nineml_model.dynamics_properties
-        dynamics = dynamics_properties.component_class
+        if component_class is None:
+            dynamics = dynamics_properties.component_class
+        else:
+            dynamics = component_class
         celltype = self.PyNNCellWrapperMetaClass(
             component_class=dynamics,
             default_properties=dynamics_properties,
@@ -808,6 +1245,47 @@ class ComponentArray(object):
                     recording.analogsignals.append(asig)
         return recording
 
+    def _get_checkpoint(self):
+        """
+        Returns the current state of the cells in the array that are local to
+        the process for Simulation.checkpoint
+        """
+        names = list(self.component_class.state_variable_names)
+        regime_varname = self.celltype.model.code_generator.REGIME_VARNAME
+        values = self._get_local_state(names + [regime_varname])
+        return {'name': self.name,
+                'indices': numpy.asarray(self.id_to_index(self.local_cells)),
+                'state': dict(zip(names, values[:-1])),
+                'regime': numpy.asarray(values[-1], dtype=int)}
+
+    def _restore_checkpoint(self, checkpoint):
+        """
+        Sets the state of the cells in the array from a checkpoint returned by
+        _get_checkpoint
+        """
+        indices = checkpoint['indices']
+        if not numpy.array_equal(
+                indices, numpy.asarray(self.id_to_index(self.local_cells))):
+            raise Pype9UsageError(
+                "Cells in checkpoint of '{}' array don't match the cells in "
+                "the array".format(self.name))
+        initial_values = {}
+        # Values of cells that are not local to the process are ignored
+        for name, values in checkpoint['state'].items():
+            initial_values[name] = numpy.empty(self.size)
+            initial_values[name].fill(numpy.nan)
+            initial_values[name][indices] = values
+        initial_values['_regime'] = numpy.zeros(self.size, dtype=int)
+        initial_values['_regime'][indices] = checkpoint['regime']
+        self.initialize(**initial_values)
+
+    def _get_local_state(self, varnames):
+        """
+        Returns the values of the given state variables for each of the local
+        cells in the array as a (num variables x num local cells) array
+        """
+        raise NotImplementedError("Should be implemented by derived class")
+
     def _kill(self, t_stop):
         """
         Caches all recording data and sets all references to the actual
@@ -908,10 +1386,18 @@ class ConnectionGroup(object):
         Source component array
     destination : ComponentArray
         Destination component array
+    connections : ConnectionList | None
+        Previously saved connections to connect the group with instead of
+        sampling its connectivity (see Network.load_connections)
+    rng : pyNN.random.NumpyRNG | None
+        The RNG used to draw random connection properties. If None the
+        properties RNG of the active simulation is used
     """
 
-    def __init__(self, nineml_model, source, destination):
-        rng = self.Simulation.active().properties_rng
+    def __init__(self, nineml_model, source, destination, connections=None,
+                 rng=None):
+        if rng is None:
+            rng = self.Simulation.active().properties_rng
         if not isinstance(nineml_model, EventConnectionGroup9ML):
             raise Pype9RuntimeError(
                 "Expected a connection group model, found {}"
@@ -943,6 +1429,13 @@ class ConnectionGroup(object):
             weight = 0.0
         self._nineml = nineml_model
         delay = get_pyNN_value(nineml_model.delay, self.UnitHandler, rng)
+        if connections is not None:
+            # Connect with previously saved connections instead of sampling
+            # the connectivity
+            connector = self.FromListConnector(
+                connections.array, column_names=connections.attributes)
+        else:
+            connector = nineml_model.connectivity
         # FIXME: Ignores send_port, assumes there is only one...
         # NB: Simulator-specific derived classes extend the corresponding
         # PyNN population class
@@ -950,7 +1443,7 @@ class ConnectionGroup(object):
             self,
             presynaptic_population=source,
             postsynaptic_population=destination,
-            connector=nineml_model.connectivity,
+            connector=connector,
             synapse_type=self.SynapseClass(weight=weight, delay=delay),
             receptor_type=nineml_model.destination_port,
             label=nineml_model.name)
@@ -968,3 +1461,8 @@ class ConnectionGroup(object):
                 "connectivity='{}')".format(self.name, self.pre.name,
                                             self.post.name,
                                             self.connectivity))
+
+
+# Connections loaded from file, where 'array' has columns for the source and
+# destination indices followed by a column for each of the 'attributes'
+ConnectionList = namedtuple('ConnectionList', ('array', 'attributes'))
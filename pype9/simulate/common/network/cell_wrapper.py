@@ -81,6 +81,18 @@ class PyNNCellWrapperMetaClass(type):
         return super(PyNNCellWrapperMetaClass, cls).__new__(
             cls, celltype_id + 'PyNN', bases, dct)
 
+    @classmethod
+    def cell_metaclass_kwargs(cls, component_class, default_properties,
+                              initial_state, **kwargs):  # @UnusedVariable
+        """
+        Returns the keyword arguments passed to the CellMetaClass to create the
+        underlying cell class, so the builds of multiple cell classes can be
+        scheduled before the celltypes are created (see Network.__init__).
+        By default the component class and any build options are passed on,
+        which can be overridden by the simulator-specific metaclasses.
+        """
+        return dict(component_class=component_class, **kwargs)
+
     def __init__(cls, *args, **kwargs):
         """
         Not required, but since I have changed the signature of the new method
@@ -6,9 +6,13 @@
 """
 from __future__ import absolute_import
 from builtins import zip
+from builtins import object
+from builtins import range
+from itertools import chain
 from nineml.user.connectionrule import (
     BaseConnectivity, InverseConnectivity as BaseInverseConnectivity)
 from pyNN.parameters import LazyArray
+from pyNN.recording import gather_dict
 import numpy
 from pype9.exceptions import Pype9RuntimeError
 
@@ -18,17 +22,62 @@ class PyNNConnectivity(BaseConnectivity):
     def __init__(self, *args, **kwargs):
         super(PyNNConnectivity, self).__init__(*args, **kwargs)
         self._prev_connected = None
+        self._sparse_map = None
         self._rng = kwargs['rng']
         self._kwargs = kwargs
 
-    def connections(self):
+    def connections(self, local=False):
+        """
+        Returns an iterator over the (source, destination) index pairs of the
+        sampled connections, which are generated one at a time so that the
+        full list of connections is never created
+
+        Parameters
+        ----------
+        local : bool
+            Whether to only iterate over the connections stored on the local
+            MPI process. If False, the connections are gathered from all
+            processes (so it needs to be called on every process)
+        """
+        self._check_sampled()
+        if local:
+            return ((int(c.presynaptic_index), int(c.postsynaptic_index))
+                    for c in self._prev_connected.connections)
+        return self._iter_sparse_map()
+
+    def connection_array(self, local=False):
+        """
+        Returns the sampled connections as a (num_connections, 2) array of
+        source and destination indices
+
+        Parameters
+        ----------
+        local : bool
+            Whether to only include the connections stored on the local
+            MPI process (see 'connections')
+        """
+        self._check_sampled()
+        if local:
+            return numpy.fromiter(
+                chain.from_iterable(self.connections(local=True)),
+                dtype=int).reshape(-1, 2)
+        sparse_map = self.sparse_map
+        targets = numpy.repeat(numpy.arange(sparse_map.shape[1]),
+                               numpy.diff(sparse_map.indptr))
+        return numpy.column_stack((sparse_map.indices, targets))
+
+    def _iter_sparse_map(self):
+        sparse_map = self.sparse_map
+        for target in range(sparse_map.shape[1]):
+            for source in sparse_map.sources(target):
+                yield int(source), target
+
+    def _check_sampled(self):
         if not self.has_been_sampled():
             raise Pype9RuntimeError(
                 "Connections have not been generated for PyNNConnectivity "
                 "object (they are only generated during network construction "
                 "for efficiency")
-        raise NotImplementedError(
-            "Need to work out connection list from connection map")
 
     def connect(self, connection_group):
         if self.has_been_sampled():
@@ -44,10 +93,8 @@ class PyNNConnectivity(BaseConnectivity):
                 params = {}
             elif self.rule_properties.lib_type == 'Explicit':
                 connector_cls = self._pyNN_module.FromListConnector
-                src = self.rule_properties.property('sourceIndicies')
-                dst = self.rule_properties.property('destinationIndicies')
-                assert len(src) == len(dst)
-                params = {'conn_list': list(zip(src, dst))}
+                src, dst = self._explicit_indices()
+                params = {'conn_list': list(zip(src.tolist(), dst.tolist()))}
             elif self.rule_properties.lib_type == 'Probabilistic':
                 connector_cls = self._pyNN_module.FixedProbabilityConnector
                 params = {
@@ -72,13 +119,51 @@ class PyNNConnectivity(BaseConnectivity):
             connector.connect(connection_group)
             self._prev_connected = connection_group
 
+    def _explicit_indices(self):
+        """
+        Returns the source and destination indices listed in the properties
+        of an explicit connection rule as a pair of integer arrays
+        """
+        src, dst = (
+            numpy.asarray(list(self.rule_properties.property(n).value),
+                          dtype=int)
+            for n in ('sourceIndices', 'destinationIndices'))
+        assert len(src) == len(dst)
+        return src, dst
+
     def has_been_sampled(self):
         return self._prev_connected is not None
 
+    @property
+    def sparse_map(self):
+        """
+        The sampled connections as a SparseConnectionMap, which is gathered
+        from all processes the first time it is accessed
+        """
+        if self._sparse_map is None:
+            self._check_sampled()
+            # The local connections are reduced to a map before they are
+            # gathered so only its (compact) numpy array is sent between
+            # processes
+            sparse_map = SparseConnectionMap.from_addresses(
+                self.connection_array(local=True), self.source_size,
+                self.destination_size)
+            state = self._prev_connected._simulator.state
+            if state.num_processes > 1:
+                gathered = gather_dict({state.mpi_rank: sparse_map.keys},
+                                       all=True)
+                sparse_map = SparseConnectionMap.from_keys(
+                    numpy.concatenate([gathered[r] for r in sorted(gathered)]),
+                    self.source_size, self.destination_size)
+            self._sparse_map = sparse_map
+        return self._sparse_map
+
     @property
     def _connection_map(self):
-        return LazyArray(~numpy.isnan(
-            self._prev_connected.get(['weight'], 'array', gather='all')[0]))
+        # The map is evaluated lazily column by column by the MapConnector
+        # so the full pre x post matrix is never created
+        sparse_map = self.sparse_map
+        return LazyArray(sparse_map.is_connected, shape=sparse_map.shape)
 
     def clone(self, memo=None, **kwargs):
         if memo is None:
@@ -99,3 +184,84 @@ class InversePyNNConnectivity(BaseInverseConnectivity):
         raise NotImplementedError(
             "Inverse connectivity from post-synaptic/synapse dynamics to "
             "pre-synaptic dynamics has not been implemented yet.")
+
+
+class SparseConnectionMap(object):
+    """
+    Compact representation of the connections of a projection, in which the
+    source indices of the connections are stored in compressed rows for each
+    target (i.e. CSR format of the transposed connection matrix, as PyNN
+    connects projections one target at a time)
+
+    Parameters
+    ----------
+    indptr : numpy.ndarray(int)
+        Offsets into 'indices' of the sources of each target (length
+        num_targets + 1)
+    indices : numpy.ndarray(int)
+        The sorted source indices of the connections to each target
+    shape : tuple(int, int)
+        The number of sources and targets
+    """
+
+    def __init__(self, indptr, indices, shape):
+        self.indptr = numpy.asarray(indptr, dtype=int)
+        self.indices = numpy.asarray(indices, dtype=int)
+        self.shape = (int(shape[0]), int(shape[1]))
+        # Sorted flat indices (target * num_sources + source) of the
+        # connections used to look up whether arbitrary elements are connected
+        targets = numpy.repeat(numpy.arange(self.shape[1]),
+                               numpy.diff(self.indptr))
+        self.keys = targets * self.shape[0] + self.indices
+
+    @classmethod
+    def from_addresses(cls, addresses, num_sources, num_targets):
+        """
+        Creates the map from a list or (num_connections, 2) array of
+        (source, target) index pairs
+        """
+        addresses = numpy.asarray(addresses, dtype=float).reshape(-1, 2)
+        sources = addresses[:, 0].astype(int)
+        targets = addresses[:, 1].astype(int)
+        return cls.from_keys(targets * int(num_sources) + sources,
+                             num_sources, num_targets)
+
+    @classmethod
+    def from_keys(cls, keys, num_sources, num_targets):
+        """
+        Creates the map from the flat indices (target * num_sources + source)
+        of the connections, e.g. the 'keys' of maps gathered from several
+        processes
+        """
+        # Remove multiple connections between the same pair of cells and
+        # sort by target then source
+        keys = numpy.unique(numpy.asarray(keys, dtype=int))
+        indices = keys % int(num_sources)
+        counts = numpy.bincount(keys // int(num_sources),
+                                minlength=int(num_targets))
+        indptr = numpy.concatenate(([0], numpy.cumsum(counts)))
+        return cls(indptr, indices, (num_sources, num_targets))
+
+    def __len__(self):
+        return len(self.indices)
+
+    def sources(self, target):
+        """
+        The indices of the sources connected to a target
+        """
+        return self.indices[self.indptr[target]:self.indptr[target + 1]]
+
+    def is_connected(self, source_indices, target_indices):
+        """
+        Evaluates the elements of the boolean connection matrix at the given
+        source and target indices
+        """
+        keys = (numpy.asarray(target_indices) * self.shape[0] +
+                numpy.asarray(source_indices))
+        shape = keys.shape
+        keys = numpy.atleast_1d(keys)
+        if not len(self.keys):
+            return numpy.zeros(shape, dtype=bool)
+        pos = numpy.searchsorted(self.keys, keys)
+        pos[pos == len(self.keys)] = 0
+        return (self.keys[pos] == keys).reshape(shape)
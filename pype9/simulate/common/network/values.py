@@ -1,5 +1,5 @@
 from __future__ import division
-from past.utils import old_div
+import numpy
 from pyNN.parameters import Sequence
 from pyNN.random import RandomDistribution
 from nineml.values import SingleValue, ArrayValue, RandomDistributionValue
@@ -20,31 +20,58 @@ random_value_map = {
 
 
 def get_pyNN_value(qty, unit_handler, rng):
+    scalar = unit_handler.scalar(qty.units)
     if isinstance(qty.value, SingleValue):
         val = unit_handler.scale_value(qty)
     elif isinstance(qty.value, ArrayValue):
-        scalar = unit_handler.scalar(qty.units)
-        val = Sequence(v * scalar for v in qty.value)
+        val = Sequence(numpy.asarray(qty.value.values, dtype=float) * scalar)
     elif isinstance(qty.value, RandomDistributionValue):
-        if unit_handler.scalar(qty.units) != 1.0:
-            raise NotImplementedError(
-                "Cannot currently scale random distributions as required to "
-                "get {} into the correct units".format(qty))
         try:
             rv_name, rv_param_names = random_value_map[
                 qty.value.distribution.standard_library]
         except KeyError:
             raise NotImplementedError(
                 "Sorry, '{}' random distributions are not currently supported"
-                .format(qty.value.distribution.standard_libary))
+                .format(qty.value.distribution.standard_library))
         rv_params = [
             qty.value.distribution.property(n).value for n in rv_param_names]
         # UncertML uses 'rate' parameter whereas PyNN uses 'beta' parameter
         # (1/rate) to define exponential random distributions.
         if rv_name == 'exponential':
             rv_params[0] = 1.0 / rv_params[0]
-        # FIXME: Need to scale random distribution to correct units. Should
-        #        probably derive PyNN RandomDistribution class to multiply by
-        #        when a value is drawn
-        val = RandomDistribution(rv_name, rv_params, rng=rng)
+        if scalar != 1.0:
+            val = ScaledRandomDistribution(scalar, rv_name, rv_params,
+                                           rng=rng)
+        else:
+            val = RandomDistribution(rv_name, rv_params, rng=rng)
     return val
+
+
+class ScaledRandomDistribution(RandomDistribution):
+    """
+    A random distribution whose samples are multiplied by a scalar to convert
+    them into the units used by the simulator. Samples are drawn in blocks by
+    PyNN so the scaling is applied to the whole block at once.
+
+    Parameters
+    ----------
+    scalar : float
+        The value to multiply the drawn samples by
+    args : list
+        Positional arguments passed to pyNN.random.RandomDistribution
+    kwargs : dict
+        Keyword arguments passed to pyNN.random.RandomDistribution
+    """
+
+    def __init__(self, scalar, *args, **kwargs):
+        super(ScaledRandomDistribution, self).__init__(*args, **kwargs)
+        self.scalar = scalar
+
+    def next(self, *args, **kwargs):
+        return numpy.multiply(
+            super(ScaledRandomDistribution, self).next(*args, **kwargs),
+            self.scalar)
+
+    def __str__(self):
+        return "{} * {}".format(
+            self.scalar, super(ScaledRandomDistribution, self).__str__())
@@ -1,14 +1,31 @@
 from builtins import object
 from abc import ABCMeta, abstractmethod
+from collections import namedtuple
 from nineml import units as un
 import numpy
 import time
+import pickle
 from pype9.exceptions import Pype9UsageError, Pype9NoActiveSimulationError
 from pyNN.random import NumpyRNG
 from future.utils import with_metaclass
 from pype9.utils.logging import logger
 
 
+# Statistics of each chunk of a chunked run (see Simulation.run). The times
+# are in ms of simulated time and the rate is in ms of simulated time per
+# second of wall-clock time
+ChunkStats = namedtuple('ChunkStats', ('t_start', 't_stop', 'wall_time',
+                                       'rate'))
+
+
+def log_progress(simulation, stats):
+    """
+    A hook that logs the progress of a chunked run (see Simulation.add_hook)
+    """
+    logger.info("{} simulation reached {} ms ({:.1f} ms simulated per second)"
+                .format(simulation.name, stats.t_stop, stats.rate))
+
+
 class Simulation(with_metaclass(ABCMeta, object)):
     """
     Base class of all simulation classes that prepares and runs the simulator
@@ -62,6 +79,9 @@ class Simulation(with_metaclass(ABCMeta, object)):
 
     max_seed = 2 ** 32 - 1
 
+    # Incremented when the format of the checkpoint files changes
+    _CHECKPOINT_VERSION = 1
+
     def __init__(self, dt, t_start=0.0 * un.s, seed=None, properties_seed=None,
                  min_delay=1 * un.ms, max_delay=10 * un.ms,
                  code_generator=None, build_base_dir=None, **options):
@@ -77,6 +97,8 @@ class Simulation(with_metaclass(ABCMeta, object)):
         self._options = options
         self._registered_cells = None
         self._registered_arrays = None
+        self._hooks = []
+        self._chunk_stats = []
         if seed is not None and (seed < 0 or seed > self.max_seed):
             raise Pype9UsageError(
                 "Provided seed {} is out of range, must be between (0 and {})"
@@ -113,6 +135,10 @@ class Simulation(with_metaclass(ABCMeta, object)):
                 "Cannot enter context of multiple {} simulations at the same "
                 "time".format(self.__class__.name))
         self._set_seeds()
+        # Reset the time and chunk statistics in case the simulation is being
+        # re-entered
+        self._t = self._t_start
+        self._chunk_stats = []
         self._running = False
         self._prepare()
         self._registered_cells = []
@@ -234,7 +260,29 @@ class Simulation(with_metaclass(ABCMeta, object)):
         return int(self.properties_rng.uniform(low=0, high=self.max_seed,
                                                size=1))
 
-    def run(self, t_stop, **kwargs):
+    @property
+    def chunk_stats(self):
+        """
+        The statistics (ChunkStats) of each chunk run in the simulation
+        """
+        return self._chunk_stats
+
+    def add_hook(self, hook):
+        """
+        Adds a hook that is called between the chunks of a run (see ``run``).
+
+        Parameters
+        ----------
+        hook : callable
+            Called with the simulation and the ChunkStats of the chunk that
+            has just been run. If it returns True the run is stopped early.
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def run(self, t_stop, chunk=None, **kwargs):
         """
         Run the simulation until time ``t_stop``.
 
@@ -242,13 +290,183 @@ class Simulation(with_metaclass(ABCMeta, object)):
         ----------
         t_stop : nineml.Quantity (time)
             The time to run the simulation until
+        chunk : nineml.Quantity (time) | None
+            The length of the steps the simulation is advanced in, which is
+            rounded to a multiple of the min delay. After each chunk the
+            recordings are flushed (if supported) and the hooks (see
+            ``add_hook``) are called. If None the simulation is run in one
+            step unless the simulator requires chunks (e.g. for streamed
+            recordings)
         """
         self._check_units('t_stop', t_stop, un.time)
+        self._check_units('chunk', chunk, un.time, allow_none=True)
+        t = float(self.t.in_units(un.ms))
+        t_stop_ms = float(t_stop.in_units(un.ms))
+        # Tolerance for rounding errors when comparing times
+        tol = float(self.dt.in_units(un.ms)) / 2.0
+        if t_stop_ms < t + tol:
+            raise Pype9UsageError(
+                "Provided value to t_stop ({}) is not after the current time "
+                "of the simulation ({} ms)".format(t_stop, t))
         if not self._running:
             self._initialize()
             self._running = True
-        self._run(t_stop, **kwargs)
-        self._t = t_stop
+        if chunk is None:
+            chunk = self._default_chunk
+        if chunk is None:
+            chunk_ms = t_stop_ms - t
+        else:
+            min_delay = float((self.min_delay if self.min_delay is not None
+                               else self.dt).in_units(un.ms))
+            chunk_ms = max(round(float(chunk.in_units(un.ms)) / min_delay),
+                           1) * min_delay
+        while t < t_stop_ms - tol:
+            t_next = min(t + chunk_ms, t_stop_ms)
+            if t_stop_ms - t_next < tol:
+                t_next = t_stop_ms
+                t_next_qty = t_stop
+            else:
+                t_next_qty = t_next * un.ms
+            wall_start = time.time()
+            self._run(t_next_qty, **kwargs)
+            self._t = t_next_qty
+            wall_time = time.time() - wall_start
+            self._flush_recordings()
+            stats = ChunkStats(t, t_next, wall_time,
+                               ((t_next - t) / wall_time if wall_time
+                                else float('inf')))
+            self._chunk_stats.append(stats)
+            t = t_next
+            # Call all hooks before stopping in case any of them are required
+            # (e.g. checkpointing)
+            if any([hook(self, stats) for hook in self._hooks]):
+                logger.info("Stopping {} simulation early at {} ms as "
+                            "requested by hook".format(self.name, t))
+                break
+
+    def checkpoint(self, path):
+        """
+        Saves the state of the cells and arrays in the simulation (state
+        variables and regimes) along with the seeds and the state of the
+        properties RNG. The state can be restored into a new simulation
+        containing the same cells and networks (created in the same order)
+        with ``restore``. Recordings are not saved in the checkpoint, so any
+        recorded in the restored simulation start from the time it is
+        restored.
+
+        Parameters
+        ----------
+        path : str
+            The path of the checkpoint file. If there are multiple MPI
+            processes a separate file is written for each one with the rank
+            appended to the path
+        """
+        self._check_active('checkpoint')
+        checkpoint = {
+            'version': self._CHECKPOINT_VERSION,
+            'simulator': self.name,
+            'num_processes': self.num_processes(),
+            't': float(self.t.in_units(un.ms)),
+            'seeds': (self._properties_seeds, self._dynamics_seeds,
+                      self._global_seed),
+            'properties_rng': self.properties_rng.rng.get_state(),
+            'cells': [c._get_checkpoint() for c in self._registered_cells
+                      if not c.in_array],
+            'arrays': [a._get_checkpoint() for a in self._registered_arrays]}
+        with open(self._checkpoint_path(path), 'wb') as f:
+            pickle.dump(checkpoint, f, protocol=2)
+
+    def restore(self, path):
+        """
+        Restores the state saved by ``checkpoint``. Must be called after the
+        same cells and networks have been created in the simulation. The
+        simulator RNGs are reseeded with the saved seeds, so random processes
+        restart their streams from the restored seeds rather than continuing
+        from where they were at the time of the checkpoint. The simulation
+        time is not changed.
+
+        Parameters
+        ----------
+        path : str
+            The path the checkpoint was saved to
+
+        Returns
+        -------
+        t : nineml.Quantity (time)
+            The time the checkpoint was saved at
+        """
+        self._check_active('restore')
+        with open(self._checkpoint_path(path), 'rb') as f:
+            checkpoint = pickle.load(f)
+        if checkpoint['version'] != self._CHECKPOINT_VERSION:
+            raise Pype9UsageError(
+                "Checkpoint '{}' was saved with an incompatible version "
+                "({} vs {})".format(path, checkpoint['version'],
+                                    self._CHECKPOINT_VERSION))
+        if (checkpoint['simulator'] != self.name or
+                checkpoint['num_processes'] != self.num_processes()):
+            raise Pype9UsageError(
+                "Checkpoint '{}' was saved from a {} simulation with {} "
+                "processes, which doesn't match this simulation ({}, {})"
+                .format(path, checkpoint['simulator'],
+                        checkpoint['num_processes'], self.name,
+                        self.num_processes()))
+        cells = [c for c in self._registered_cells if not c.in_array]
+        if len(cells) != len(checkpoint['cells']):
+            raise Pype9UsageError(
+                "Number of cells in checkpoint '{}' ({}) doesn't match the "
+                "number in the simulation ({})".format(
+                    path, len(checkpoint['cells']), len(cells)))
+        for cell, cell_checkpoint in zip(cells, checkpoint['cells']):
+            cell._restore_checkpoint(cell_checkpoint)
+        arrays = dict((a.name, a) for a in self._registered_arrays)
+        for array_checkpoint in checkpoint['arrays']:
+            try:
+                array = arrays[array_checkpoint['name']]
+            except KeyError:
+                raise Pype9UsageError(
+                    "No array named '{}' (saved in checkpoint '{}') in the "
+                    "simulation".format(array_checkpoint['name'], path))
+            array._restore_checkpoint(array_checkpoint)
+        (self._properties_seeds, self._dynamics_seeds,
+         self._global_seed) = checkpoint['seeds']
+        self.properties_rng.rng.set_state(checkpoint['properties_rng'])
+        self._apply_seeds()
+        return checkpoint['t'] * un.ms
+
+    def _checkpoint_path(self, path):
+        if self.num_processes() > 1:
+            path = '{}.{}'.format(path, self.mpi_rank())
+        return path
+
+    def _check_active(self, action):
+        if self._registered_cells is None:
+            raise Pype9UsageError(
+                "Can only {} {} simulation within its context".format(
+                    action, self.name))
+
+    def _apply_seeds(self):
+        """
+        Reseeds the simulator RNGs after the seeds have been restored from a
+        checkpoint (overridden by simulators that seed their RNGs when they
+        are prepared)
+        """
+        pass
+
+    @property
+    def _default_chunk(self):
+        """
+        The chunk size used by 'run' if one isn't provided (overridden by
+        simulators that require chunked runs for some features)
+        """
+        return None
+
+    def _flush_recordings(self):
+        """
+        Called after each chunk of a run (overridden by simulators that
+        support flushing recordings during the simulation)
+        """
+        pass
 
     @abstractmethod
     def _run(self, t_stop, **kwargs):  # @UnusedVariable
@@ -0,0 +1,273 @@
+"""
+Runs simulations of a single cell model over a set of different properties
+in a pool of worker processes.
+
+  Author: Thomas G. Close (tclose@oist.jp)
+  Copyright: 2012-2014 Thomas G. Close.
+  License: This file is part of the "NineLine" package, which is released under
+           the MIT Licence, see LICENSE for details.
+"""
+from __future__ import absolute_import
+from builtins import object
+from itertools import product
+import multiprocessing
+import numpy
+import quantities as pq
+from nineml import units as un
+from pype9.exceptions import Pype9UsageError
+from pype9.utils.logging import logger
+from pype9.utils.misc import spawn_pool
+
+
+class Sweep(object):
+    """
+    Simulates a cell model for each of a list of property sets, spreading the
+    simulations over a pool of worker processes that each run their own
+    simulator kernel. The cell class is built once by the parent process
+    before the workers are started.
+
+    .. code-block:: python
+
+        sweep = Sweep(izhikevich, 100.0 * un.ms, 0.01 * un.ms,
+                      record=['V'], inputs={'Isyn': current})
+        results = sweep.run(Sweep.grid(a=[0.02, 0.1] * pq.dimensionless,
+                                       b=[0.2, 0.25] * pq.dimensionless))
+        results['V']  # An array of shape (num_sets, num_samples)
+
+    Parameters
+    ----------
+    model : nineml.Dynamics | nineml.DynamicsProperties
+        The cell model to simulate. If a DynamicsProperties object is provided
+        it is used as the prototype of the cells, which the property sets
+        override
+    t_stop : nineml.Quantity (time)
+        The time to run each simulation until
+    dt : nineml.Quantity (time)
+        The resolution of the simulations
+    record : list(str)
+        Names of the send ports and state variables to record
+    inputs : dict(str, neo.AnalogSignal | neo.SpikeTrain)
+        Signals to play into receive ports of the cells
+    regime : str | None
+        The initial regime of the cells (only required if the component class
+        has more than one regime)
+    seed : int | None
+        The seed of the first simulation, which is incremented for each
+        subsequent property set so each simulation is reproducible
+    build_kwargs : dict
+        Keyword arguments passed to the CellMetaClass (e.g. 'build_mode')
+    sim_kwargs : dict
+        Keyword arguments passed to each Simulation (e.g. 'min_delay')
+    """
+
+    CellMetaClass = None
+    Simulation = None
+
+    def __init__(self, model, t_stop, dt, record, inputs=None, regime=None,
+                 seed=None, build_kwargs=None, sim_kwargs=None):
+        if model.nineml_type == 'DynamicsProperties':
+            self._prototype = model
+            self._component_class = model.component_class
+        else:
+            self._prototype = None
+            self._component_class = model
+        self._t_stop = t_stop
+        self._dt = dt
+        self._record = list(record)
+        self._inputs = dict(inputs) if inputs is not None else {}
+        self._regime = regime
+        self._seed = seed
+        self._build_kwargs = dict(build_kwargs) if build_kwargs else {}
+        self._sim_kwargs = dict(sim_kwargs) if sim_kwargs else {}
+        if not self._record:
+            raise Pype9UsageError(
+                "At least one port or state variable must be recorded in the "
+                "sweep")
+        # External currents need to be known when building NEURON mechanisms
+        self._build_kwargs.setdefault('external_currents', [
+            p for p in self._inputs
+            if self._component_class.port(p).dimension == un.current])
+        self._Cell = None
+
+    @property
+    def component_class(self):
+        return self._component_class
+
+    @classmethod
+    def grid(cls, **values):
+        """
+        Creates a list of property sets from every combination of the given
+        values (the last keyword varies fastest)
+
+        Parameters
+        ----------
+        values : dict(str, pq.Quantity)
+            1-D arrays of the values of each parameter/state variable to
+            sweep
+
+        Returns
+        -------
+        property_sets : list(dict(str, pq.Quantity))
+            The property sets of the grid
+        """
+        names = sorted(values)
+        return [dict(zip(names, combination))
+                for combination in product(*(values[n] for n in names))]
+
+    def run(self, property_sets, num_workers=None):
+        """
+        Runs a simulation for each property set
+
+        Parameters
+        ----------
+        property_sets : list(dict(str, pq.Quantity | nineml.Quantity))
+            The properties and initial values of each simulation (see 'grid')
+        num_workers : int | None
+            The number of worker processes to run the simulations in. If None
+            the number of CPUs is used. If 1, the simulations are run in the
+            current process. NB: the worker processes are spawned rather than
+            forked (see pype9.utils.misc.spawn_pool)
+
+        Returns
+        -------
+        results : SweepResults
+            The recordings of every simulation stacked into arrays
+        """
+        property_sets = list(property_sets)
+        if not property_sets:
+            raise Pype9UsageError("No property sets provided to sweep")
+        if self.Simulation._active is not None:
+            raise Pype9UsageError(
+                "Sweeps cannot be run within an active simulation")
+        # Build the cell class in the parent so the workers only need to load
+        # it
+        self._build()
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        num_workers = min(num_workers, len(property_sets))
+        jobs = list(enumerate(property_sets))
+        logger.info("Running {} simulations of '{}' with {} worker processes"
+                    .format(len(jobs), self._component_class.name,
+                            num_workers))
+        if num_workers > 1:
+            pool = spawn_pool(num_workers, initializer=_init_worker,
+                              initargs=(self,))
+            try:
+                outputs = pool.map(_simulate, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            outputs = [self._simulate(i, p) for i, p in jobs]
+        return SweepResults(self, property_sets, outputs)
+
+    def _build(self):
+        if self._Cell is None:
+            self._Cell = self.CellMetaClass(self._component_class,
+                                            **self._build_kwargs)
+        return self._Cell
+
+    def _simulate(self, index, properties):
+        """
+        Runs a single simulation and returns the raw recordings of each port
+        """
+        Cell = self._build()
+        seed = self._seed + index if self._seed is not None else None
+        if self._prototype is not None:
+            args = (self._prototype,)
+        else:
+            args = ()
+        with self.Simulation(dt=self._dt, seed=seed,
+                             **self._sim_kwargs) as sim:
+            cell = Cell(*args, regime_=self._regime, **properties)
+            for port_name, signal in self._inputs.items():
+                cell.play(port_name, signal)
+            for port_name in self._record:
+                cell.record(port_name)
+            sim.run(self._t_stop)
+        return dict((p, cell.recording(p, raw=True)) for p in self._record)
+
+    def __getstate__(self):
+        # The cell class is reloaded in each worker from the build made by the
+        # parent process
+        state = dict(self.__dict__)
+        state['_Cell'] = None
+        state['_build_kwargs'] = dict(self._build_kwargs,
+                                      build_mode='require')
+        return state
+
+
+class SweepResults(object):
+    """
+    The recordings of a sweep, where the analog recordings of all the
+    simulations are stacked into a single array for each port
+
+    Parameters
+    ----------
+    sweep : Sweep
+        The sweep the results were generated by
+    property_sets : list(dict(str, pq.Quantity | nineml.Quantity))
+        The property sets of each simulation
+    outputs : list(dict(str, tuple(numpy.ndarray, numpy.ndarray | None)))
+        The raw recordings of each simulation
+    """
+
+    def __init__(self, sweep, property_sets, outputs):
+        self._property_sets = property_sets
+        self._times = {}
+        self._data = {}
+        unit_handler = sweep._build().unit_handler
+        for port_name in sweep._record:
+            raw = [o[port_name] for o in outputs]
+            if raw[0][1] is None:
+                # Spike trains have different lengths so can't be stacked
+                self._times[port_name] = None
+                self._data[port_name] = [
+                    pq.Quantity(times, 'ms') for times, _ in raw]
+            else:
+                units_str = unit_handler.dimension_to_unit_str(
+                    sweep.component_class.port(port_name).dimension,
+                    one_as_dimensionless=True)
+                self._times[port_name] = pq.Quantity(raw[0][0], 'ms')
+                self._data[port_name] = pq.Quantity(
+                    numpy.vstack([values for _, values in raw]), units_str)
+
+    def __len__(self):
+        return len(self._property_sets)
+
+    def __getitem__(self, port_name):
+        return self._data[port_name]
+
+    @property
+    def port_names(self):
+        return iter(self._data)
+
+    @property
+    def property_sets(self):
+        return iter(self._property_sets)
+
+    def times(self, port_name):
+        """
+        The sample times of an analog recording (None for spike trains)
+        """
+        return self._times[port_name]
+
+
+# The sweep run by each worker process, which is set once when the process
+# starts so it doesn't need to be sent with every job
+_worker_sweep = None
+
+
+def _init_worker(sweep):
+    global _worker_sweep
+    _worker_sweep = sweep
+    # Load the cell class built by the parent process once per worker
+    _worker_sweep._build()
+
+
+def _simulate(job):
+    """
+    Runs a single simulation of the sweep in a worker process (defined at the
+    module level so it can be pickled and sent to worker processes)
+    """
+    return _worker_sweep._simulate(*job)
@@ -5,8 +5,14 @@ from builtins import next  # @IgnorePep8
 from builtins import zip  # @IgnorePep8
 from builtins import str  # @IgnorePep8
 from past.builtins import basestring  # @IgnorePep8
+import os  # @IgnorePep8
+import errno  # @IgnorePep8
+import tempfile  # @IgnorePep8
+import pickle  # @IgnorePep8
+import atexit  # @IgnorePep8
 import operator  # @IgnorePep8
 from itertools import chain  # @IgnorePep8
+from collections import OrderedDict  # @IgnorePep8
 from operator import xor  # @IgnorePep8
 from abc import ABCMeta, abstractmethod  # @IgnorePep8
 import sympy  # @IgnorePep8
@@ -29,6 +35,7 @@ except ImportError:
 from functools import reduce  # @IgnorePep8
 from future.utils import with_metaclass  # @IgnorePep8
 from pype9.utils.logging import logger  # @IgnorePep8
+from pype9.simulate.common.code_gen.base import BASE_BUILD_DIR  # @IgnorePep8
 numpy.seterr(all='raise')
 
 
@@ -44,6 +51,21 @@ class UnitHandler(with_metaclass(ABCMeta, DynamicsDimensionResolver)):
                      pq.UnitSubstance: 'n', pq.UnitTemperature: 'k'}
 
     _CACHE_FILENAME = '.unit_handler_cache.pkl'
+    # Incremented whenever the format or the method used to select the
+    # projections changes so that stale caches are ignored
+    _CACHE_VERSION = 2
+    # Directory the persistent cache is stored in (BASE_BUILD_DIR if None)
+    _persistent_cache_dir = None
+    # Projections solved by previous processes (loaded on first use) and
+    # the projections solved by this process that haven't been saved yet,
+    # keyed by the basis and compound units they were solved for
+    _persistent_projections = None
+    _unsaved_projections = {}
+
+    # Maximum size of the LRU caches of the scaling exponent, compound and
+    # units string for each units object that is scaled, of which each unit
+    # handler class has its own (see _units_info)
+    _UNITS_INFO_CACHE_SIZE = 4096
 
     def assign_units_to_alias(self, alias):
         dims = self._flatten(sympify(alias))[1]
@@ -214,13 +236,23 @@ class UnitHandler(with_metaclass(ABCMeta, DynamicsDimensionResolver)):
         # compound, project the dimension onto the basis vectors, finding
         # the "minimal" solution (see _select_best_compound)
         else:
-            # Get projection of dimension onto basis units
-            b = array(list(dimension))
-            xs = diophantine.solve(cls.A, b)
-            min_x = cls._select_best_compound(xs)
-            x = numpy.concatenate((min_x, numpy.zeros(len(cls.compounds),
-                                                      dtype='int')))
-            cls.cache[tuple(dimension)] = x / int(abs(reduce(gcd, x)))
+            key = tuple(dimension)
+            try:
+                # Only exact matches are looked up in the projections solved
+                # by previous processes so the result is the same as if it
+                # was solved afresh
+                x = cls._persistent_cache()[key]
+            except KeyError:
+                # Get projection of dimension onto basis units
+                b = array(list(dimension))
+                xs = diophantine.solve(cls.A, b)
+                min_x = cls._select_best_compound(xs)
+                x = numpy.concatenate((min_x, numpy.zeros(len(cls.compounds),
+                                                          dtype='int')))
+                cls._unsaved_projections.setdefault(
+                    cls._persistent_cache_key(cls.basis, cls.compounds),
+                    {})[key] = x
+            cls.cache[key] = x / int(abs(reduce(gcd, x)))
         # Get list of compound units with the powers
         compound = [(u, p) for u, p in zip(cls.specified_units, x) if p]
         # Calculate the appropriate scale for the new compound quantity
@@ -305,8 +337,7 @@ class UnitHandler(with_metaclass(ABCMeta, DynamicsDimensionResolver)):
 
     @classmethod
     def scalar(cls, units):
-        exponent, _ = cls.dimension_to_units_compound(units.dimension)
-        return 10 ** (units.power - exponent)
+        return cls._units_info(units)[0]
 
     @classmethod
     def assign_units(cls, value, dimension):
@@ -315,11 +346,46 @@ class UnitHandler(with_metaclass(ABCMeta, DynamicsDimensionResolver)):
 
     @classmethod
     def to_pq_quantity(cls, qty):
-        exponent, compound = cls.dimension_to_units_compound(
-            qty.units.dimension)
-        scale = qty.units.power - exponent
-        units_str = cls.compound_to_units_str(compound)
-        return pq.Quantity(10 ** scale * float(qty.value), units_str)
+        scalar, _, units_str = cls._units_info(qty.units)
+        return pq.Quantity(scalar * float(qty.value), units_str)
+
+    @classmethod
+    def _units_info(cls, units):
+        """
+        Returns the scalar required to convert values in the given units to
+        the units used by the simulator along with the compound and string
+        representation of the simulator units. The results are memoized in
+        an LRU cache so that repeated scaling of values with the same units
+        doesn't need to project their dimension onto the basis each time.
+        """
+        lru = cls._units_info_lru()
+        key = (units.name, units.power, tuple(units.dimension))
+        try:
+            info = lru.pop(key)
+        except KeyError:
+            exponent, compound = cls.dimension_to_units_compound(
+                units.dimension)
+            info = (10 ** (units.power - exponent), compound,
+                    cls.compound_to_units_str(compound))
+            if len(lru) >= cls._UNITS_INFO_CACHE_SIZE:
+                lru.popitem(last=False)
+        # (Re)insert at the end of the cache so it is the most recently used
+        lru[key] = info
+        return info
+
+    @classmethod
+    def _units_info_lru(cls):
+        """
+        Returns the LRU cache used by _units_info, which is created the first
+        time it is required for each unit handler class so that handlers with
+        different bases don't share (and clear) each other's entries
+        """
+        try:
+            return cls.__dict__['_units_info_cache']
+        except KeyError:
+            lru = OrderedDict()
+            setattr(cls, '_units_info_cache', lru)
+            return lru
 
     @classmethod
     def from_pq_quantity(cls, qty):
@@ -392,6 +458,97 @@ class UnitHandler(with_metaclass(ABCMeta, DynamicsDimensionResolver)):
         """
         # Create a new cache with the specified units entered into it
         cls.cache = cls._init_cache(cls.basis, cls.compounds)
+        cls._units_info_lru().clear()
+
+    @classmethod
+    def _persistent_cache_key(cls, basis, compounds):
+        """
+        The key the projections onto a given set of basis and compound units
+        are stored under in the persistent cache
+        """
+        return tuple((u.name, tuple(u.dimension), u.power)
+                     for u in chain(basis, compounds))
+
+    @classmethod
+    def _persistent_cache_path(cls):
+        cache_dir = (cls._persistent_cache_dir
+                     if cls._persistent_cache_dir is not None
+                     else BASE_BUILD_DIR)
+        return os.path.join(cache_dir, cls._CACHE_FILENAME)
+
+    @classmethod
+    def _persistent_cache(cls):
+        """
+        The projections onto the basis and compound units of the class that
+        were solved by previous processes (loaded the first time they are
+        required)
+        """
+        if UnitHandler._persistent_projections is None:
+            UnitHandler._persistent_projections = (
+                cls._load_persistent_cache())
+        return UnitHandler._persistent_projections.get(
+            cls._persistent_cache_key(cls.basis, cls.compounds), {})
+
+    @classmethod
+    def _load_persistent_cache(cls):
+        """
+        Loads the projections calculated by previous processes for all unit
+        handlers. A missing, unreadable or out-of-date cache is treated as
+        empty.
+        """
+        try:
+            with open(cls._persistent_cache_path(), 'rb') as f:
+                version, caches = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError,
+                pickle.UnpicklingError) as e:
+            if not (isinstance(e, (IOError, OSError)) and
+                    e.errno == errno.ENOENT):
+                logger.debug("Could not load unit handler cache from '{}' "
+                             "({})".format(cls._persistent_cache_path(), e))
+            return {}
+        if version != cls._CACHE_VERSION:
+            logger.debug("Ignoring unit handler cache at '{}' as it was "
+                         "created with a different version ({} vs {})".format(
+                             cls._persistent_cache_path(), version,
+                             cls._CACHE_VERSION))
+            return {}
+        return caches
+
+    @classmethod
+    def save_persistent_cache(cls):
+        """
+        Saves the projections solved by this process to the persistent cache
+        (called automatically when the process exits). The existing cache is
+        reloaded and merged before it is rewritten, and the new cache is
+        written to a temporary file and then renamed so that concurrent
+        processes never read a partially written cache (at worst projections
+        saved concurrently are dropped and solved again later).
+        """
+        if not UnitHandler._unsaved_projections:
+            return
+        path = cls._persistent_cache_path()
+        caches = cls._load_persistent_cache()
+        for key, projections in UnitHandler._unsaved_projections.items():
+            caches.setdefault(key, {}).update(projections)
+        UnitHandler._unsaved_projections.clear()
+        try:
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                            prefix=cls._CACHE_FILENAME)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump((cls._CACHE_VERSION, caches), f, protocol=2)
+                os.rename(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except (IOError, OSError) as e:
+            logger.debug("Could not save unit handler cache to '{}' ({})"
+                         .format(path, e))
 
     @classmethod
     def _select_best_compound(cls, xs):
@@ -498,3 +655,7 @@ class UnitHandler(with_metaclass(ABCMeta, DynamicsDimensionResolver)):
         base, exponent = expr.args
         scaled_base, dims = self._flatten(base)
         return scaled_base ** exponent, dims ** exponent
+
+
+# Save the projections solved by the process in a single write on exit
+atexit.register(UnitHandler.save_persistent_cache)
@@ -14,3 +14,4 @@ from .network import (  # @IgnorePep8
     Network, ComponentArray, Selection, ConnectionGroup,
     PyNNCellWrapperMetaClass)
 from .units import UnitHandler  # @IgnorePep8
+from .sweep import Sweep  # @IgnorePep8
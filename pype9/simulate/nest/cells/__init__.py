@@ -1,2 +1,2 @@
-from .base import Cell, CellMetaClass
+from .base import Cell, CellMetaClass, CellArray
 from pype9.simulate.nest import simulation
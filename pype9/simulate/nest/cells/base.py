@@ -8,6 +8,8 @@
            the MIT Licence, see LICENSE for details.
 """
 from __future__ import absolute_import
+import os.path
+import errno
 import numpy
 import neo
 import nest
@@ -19,7 +21,7 @@ from pype9.simulate.nest.simulation import Simulation
 from pype9.simulate.common.cells import base
 from pype9.annotations import PYPE9_NS, MEMBRANE_VOLTAGE, BUILD_TRANS
 from pype9.exceptions import (
-    Pype9UsageError, Pype9Unsupported9MLException)
+    Pype9UsageError, Pype9Unsupported9MLException, Pype9DimensionError)
 from pype9.utils.logging import logger
 
 basic_nineml_translations = {
@@ -28,25 +30,52 @@ basic_nineml_translations = {
 
 class Cell(base.Cell):
 
+    # Receptor types of each cell model, which are the same for every
+    # instance so they only need to be looked up once
+    _receptor_types = {}
+
     def __init__(self, *properties, **kwprops):
         self._flag_created(False)
-        self._cell = nest.Create(self.__class__.name)
+        # A pre-created NEST node can be passed by a CellArray
+        gid = kwprops.pop('_gid', None)
+        self._cell = nest.Create(self.__class__.name) if gid is None else gid
         super(Cell, self).__init__(*properties, **kwprops)
-        self._receive_ports = nest.GetDefaults(
-            self.__class__.name)['receptor_types']
+        self._receive_ports = self.receptor_types()
         self._inputs = {}
         self._flag_created(True)
 
+    @classmethod
+    def receptor_types(cls):
+        try:
+            receptor_types = cls._receptor_types[cls.name]
+        except KeyError:
+            receptor_types = cls._receptor_types[cls.name] = nest.GetDefaults(
+                cls.name)['receptor_types']
+        return receptor_types
+
     def _get(self, varname):
         return nest.GetStatus(self._cell, keys=varname)[0]
 
     def _set(self, varname, value):
         nest.SetStatus(self._cell, varname, value)
 
+    def _get_many(self, varnames):
+        return nest.GetStatus(self._cell, keys=list(varnames))[0]
+
+    def _set_many(self, values):
+        nest.SetStatus(self._cell, values)
+
     def _set_regime(self):
         nest.SetStatus(self._cell, self.code_generator.REGIME_VARNAME,
                        self._regime_index)
 
+    def clear_recorders(self):
+        """
+        Clears all recorders and recordings
+        """
+        super(Cell, self).clear_recorders()
+        super(base.Cell, self).__setattr__('_streams', {})
+
     def record(self, port_name, interval=None, **kwargs):  # @UnusedVariable @IgnorePep8
         # Create dictionaries for storing local recordings. These are not
         # created initially to save memory if recordings are not required or
@@ -69,6 +98,7 @@ class Cell(base.Cell):
             self._recorders[port_name] = recorder = nest.Create(
                 "spike_detector", params={"precise_times": True})
             nest.Connect(self._cell, recorder)
+            self._stream(port_name, None)
         else:
             if interval is None:
                 interval = Simulation.active().dt
@@ -80,6 +110,7 @@ class Cell(base.Cell):
             nest.Connect(
                 recorder, self._cell,
                 syn_spec={'delay': self.device_delay_ms})
+            self._stream(port_name, interval)
 
     def record_regime(self, interval=None):
         self._initialize_local_recording()
@@ -94,11 +125,34 @@ class Cell(base.Cell):
         nest.Connect(
             recorder, self._cell,
             syn_spec={'delay': self.device_delay_ms})
+        self._stream(self.code_generator.REGIME_VARNAME, interval)
 
-    def recording(self, port_name, t_start=None):
+    def _stream(self, key, interval):
+        """
+        Sets up the streaming of a recording to disk if the active simulation
+        has a stream directory
+        """
+        sim = Simulation.active()
+        if sim.stream_dir is not None:
+            self._streams[key] = RecordingStream(
+                os.path.join(sim.stream_run_dir,
+                             '{}_{}'.format(self.name, self._cell[0]), key),
+                interval)
+            sim.register_stream(self)
+
+    def _spill_recordings(self):
+        """
+        Appends the events held by the streamed recording devices to their
+        on-disk stores and clears them from the devices
+        """
+        for key, stream in self._streams.items():
+            stream.append(self._device_recording(key)[0])
+            nest.SetStatus(self._recorders[key], {'n_events': 0})
+
+    def recording(self, port_name, t_start=None, raw=False):
         """
         Return recorded data as a dictionary containing one numpy array for
-        each neuron, ids as keys.
+        each neuron, ids as keys (see base.Cell.recording)
         """
         # NB: Port could also be a state variable
         try:
@@ -115,39 +169,68 @@ class Cell(base.Cell):
         t_start = pq.Quantity(t_start, 'ms')
         t_stop = self.unit_handler.to_pq_quantity(t_stop)
         if port.nineml_type in ('EventSendPort', 'EventSendPortExposure'):
-            spikes = nest.GetStatus(
-                self._recorders[port_name], 'events')[0]['times']
+            spikes, _ = self._recorded(port_name)
+            if raw:
+                return self._trim_spike_train(spikes, float(t_start)), None
             data = neo.SpikeTrain(
                 self._trim_spike_train(spikes * pq.ms, t_start),
                 t_start=t_start, t_stop=t_stop, name=port_name)
         else:
-            port_name = self.build_name(port_name)
-            events, interval = nest.GetStatus(self._recorders[port_name],
-                                              ('events', 'interval'))[0]
-            try:
-                port = self._nineml.component_class.port(port_name)
-            except NineMLNameError:
-                port = self._nineml.component_class.state_variable(port_name)
+            values, interval = self._recorded(port_name)
             unit_str = self.unit_handler.dimension_to_unit_str(
                 port.dimension, one_as_dimensionless=True)
-            variable_name = self.build_name(port_name)
-            signal = self._trim_analog_signal(events[variable_name],
-                                              t_start, interval * pq.ms)
+            signal = self._trim_analog_signal(values, t_start,
+                                              interval * pq.ms)
+            if raw:
+                times = (float(t_start) +
+                         numpy.arange(len(signal)) * interval)
+                return times, signal
             data = neo.AnalogSignal(
                 signal, sampling_period=interval * pq.ms,
                 t_start=t_start, units=unit_str, name=port_name)
         return data
 
     def _regime_recording(self):
-        events, interval = nest.GetStatus(
-            self._recorders[self.code_generator.REGIME_VARNAME],
-            ('events', 'interval'))[0]
+        values, interval = self._recorded(self.code_generator.REGIME_VARNAME)
         return neo.AnalogSignal(
-            events[self.code_generator.REGIME_VARNAME],
-            sampling_period=interval * pq.ms, units='dimensionless',
+            values, sampling_period=interval * pq.ms, units='dimensionless',
             t_start=self.unit_handler.to_pq_quantity(self._t_start),
             name=self.code_generator.REGIME_VARNAME)
 
+    def _fetch_recording(self, key, copy=False):  # @UnusedVariable
+        # NEST always returns new arrays so there is no need to copy
+        try:
+            stream = self._streams[key]
+        except KeyError:
+            return self._device_recording(key)
+        if self._recorders[key] is None:  # Device has been released
+            return stream.read(), stream.interval
+        values, interval = self._device_recording(key)
+        return numpy.concatenate((stream.read(), values)), interval
+
+    def _recording_keys(self):
+        # Streamed recordings are read back from disk when requested instead
+        # of being loaded into the cache
+        return [k for k in self._recorders if k not in self._streams]
+
+    def _kill(self, t_stop):
+        if hasattr(self, '_streams') and not self.is_dead():
+            self._spill_recordings()
+        super(Cell, self)._kill(t_stop)
+
+    def _device_recording(self, key):
+        recorder = self._recorders[key]
+        if str(nest.GetStatus(recorder, 'model')[0]) == 'spike_detector':
+            spikes = nest.GetStatus(recorder, 'events')[0]['times']
+            return numpy.array(spikes, dtype=float), None
+        events, interval = nest.GetStatus(recorder,
+                                          ('events', 'interval'))[0]
+        if key == self.code_generator.REGIME_VARNAME:
+            variable_name = key
+        else:
+            variable_name = self.build_name(key)
+        return numpy.array(events[variable_name], dtype=float), interval
+
     def build_name(self, varname):
         # Get mapped port name if port corresponds to membrane voltage
         if varname == self.component_class.annotations.get(
@@ -300,9 +383,293 @@ class Cell(base.Cell):
         return Simulation.active().device_delay_ms
 
 
+class RecordingStream(object):
+    """
+    Append-only on-disk store for the events of a recording device, which are
+    saved as a sequence of numpy (.npy) segments
+
+    Parameters
+    ----------
+    directory : str
+        The directory to save the segments in
+    interval : float | None
+        The sampling interval of the recording in ms (None for spike times)
+    """
+
+    def __init__(self, directory, interval):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._directory = directory
+        self._num_segments = 0
+        self.interval = interval
+
+    def append(self, values):
+        if len(values):
+            numpy.save(self._segment_path(self._num_segments),
+                       numpy.asarray(values, dtype=float))
+            self._num_segments += 1
+
+    def read(self):
+        segments = [numpy.load(self._segment_path(i))
+                    for i in range(self._num_segments)]
+        if not segments:
+            return numpy.array([], dtype=float)
+        return numpy.concatenate(segments)
+
+    def _segment_path(self, index):
+        return os.path.join(self._directory, 'seg{:06}.npy'.format(index))
+
+
+class CellArray(base.CellArray):
+    """
+    A set of independent cells created together with a single call to
+    ``nest.Create``, with their properties and initial states set by a
+    single call to ``nest.SetStatus``. Each variable recorded from the cells
+    is recorded by a single device connected to all of them. See
+    base.CellArray for parameters
+    """
+
+    def __init__(self, cell_class, size, prototype_=None, regime_=None,
+                 **kwargs):
+        self._cell_class = cell_class
+        self._size = int(size)
+        sim = Simulation.active()
+        self._t_start = sim.t_start
+        self._t_stop = None
+        if regime_ is None:
+            if cell_class.component_class.num_regimes == 1:
+                regime_ = next(cell_class.component_class.regime_names)
+            else:
+                raise Pype9UsageError(
+                    "Need to specify initial regime using 'regime_' "
+                    "keyword arg for component class with multiple "
+                    "regimes ('{}')".format(
+                        "', '".join(cell_class.component_class.regime_names)))
+        values = {}
+        for name in cell_class._variables:
+            try:
+                qty = kwargs.pop(name)
+            except KeyError:
+                qty = self._prototype_quantity(prototype_, name)
+            values[name] = self._scale(name, qty)
+        if kwargs:
+            self._check_varnames(kwargs)
+        self._gids = nest.Create(cell_class.name, self._size)
+        self._initial_state = dict(
+            (n, v) for n, v in values.items()
+            if cell_class._variables[n].kind == 'state_variable')
+        self._initial_state[self.code_generator.REGIME_VARNAME] = numpy.repeat(
+            float(cell_class.regime_index(regime_)), self._size)
+        values.update(self._initial_state)
+        self._set_status(values)
+        # Lightweight handles to the individual cells for playing signals
+        # into and connecting them
+        self._cells = [cell_class(_in_array=True, _gid=(gid,))
+                       for gid in self._gids]
+        self._recorders = {}
+        self._recording_cache = {}
+        sim.register_cell(self)
+
+    @property
+    def name(self):
+        return self._cell_class.name
+
+    @property
+    def code_generator(self):
+        return self._cell_class.code_generator
+
+    @property
+    def in_array(self):
+        return False
+
+    def initialize(self):
+        self._set_status(self._initial_state)
+
+    def get(self, varnames):
+        varnames = list(varnames)
+        self._check_varnames(varnames)
+        values = numpy.array(nest.GetStatus(self._gids, keys=varnames),
+                             dtype=float).reshape(self._size, len(varnames))
+        return self._to_quantities(varnames, values)
+
+    def set(self, **values):
+        scaled = dict((n, self._scale(n, v)) for n, v in values.items())
+        for name, value in scaled.items():
+            if name in self._initial_state:
+                self._initial_state[name] = value
+        self._set_status(scaled)
+
+    def record(self, port_name, interval=None, **kwargs):  # @UnusedVariable @IgnorePep8
+        port = self._port(port_name)
+        if port.nineml_type in ('EventSendPort', 'EventSendPortExposure'):
+            recorder = nest.Create("spike_detector",
+                                   params={"precise_times": True})
+            nest.Connect(self._gids, recorder)
+            self._recorders[port_name] = (recorder, None)
+        else:
+            if interval is None:
+                interval = Simulation.active().dt
+            variable_name = self._cells[0].build_name(port_name)
+            recorder = nest.Create(
+                'multimeter', 1,
+                {"interval": float(interval.in_units(un.ms)),
+                 'record_from': [variable_name]})
+            nest.Connect(
+                recorder, self._gids,
+                syn_spec={'delay': Simulation.active().device_delay_ms})
+            self._recorders[port_name] = (recorder, variable_name)
+
+    def recording(self, port_name, t_start=None):
+        try:
+            senders, times, values, interval = self._recording_cache[port_name]
+        except KeyError:
+            senders, times, values, interval = self._device_events(port_name)
+        unit_handler = self._cell_class.unit_handler
+        if self._t_stop is not None:
+            t_stop = self._t_stop
+        else:
+            t_stop = Simulation.active().t
+        t_stop = unit_handler.to_pq_quantity(t_stop)
+        if t_start is None:
+            t_start = unit_handler.to_pq_quantity(self._t_start)
+        t_start = pq.Quantity(t_start, 'ms')
+        if values is None:
+            units_str = None
+        else:
+            port = self._port(port_name)
+            units_str = unit_handler.dimension_to_unit_str(
+                port.dimension, one_as_dimensionless=True)
+        recordings = []
+        for cell, gid in zip(self._cells, self._gids):
+            mask = senders == gid
+            if values is None:
+                recordings.append(neo.SpikeTrain(
+                    cell._trim_spike_train(times[mask] * pq.ms, t_start),
+                    t_start=t_start, t_stop=t_stop, name=port_name))
+            else:
+                signal = cell._trim_analog_signal(
+                    values[mask], t_start, interval * pq.ms)
+                recordings.append(neo.AnalogSignal(
+                    signal, sampling_period=interval * pq.ms,
+                    t_start=t_start, units=units_str, name=port_name))
+        return recordings
+
+    def _port(self, port_name):
+        # NB: Port could also be a state variable (as in Cell.recording)
+        component_class = self._cell_class.component_class
+        try:
+            return component_class.send_port(port_name)
+        except NineMLNameError:
+            # For convenient access to state variables
+            return component_class.state_variable(port_name)
+
+    def _device_events(self, key):
+        recorder, variable_name = self._recorders[key]
+        events, interval = nest.GetStatus(recorder, ('events', 'interval'))[0]
+        senders = numpy.array(events['senders'], dtype=int)
+        times = numpy.array(events['times'], dtype=float)
+        # Events are collected from each thread in turn when NEST is run with
+        # multiple threads so they are sorted by sender and time to make them
+        # independent of the thread layout
+        order = numpy.lexsort((times, senders))
+        senders = senders[order]
+        times = times[order]
+        if variable_name is None:
+            return senders, times, None, None
+        return (senders, times,
+                numpy.array(events[variable_name], dtype=float)[order],
+                interval)
+
+    def _kill(self, t_stop):
+        if self._t_stop is None:
+            self._recording_cache.update(
+                (k, self._device_events(k)) for k in self._recorders)
+            self._recorders = {}
+        self._t_stop = t_stop
+
+    def _get_checkpoint(self):
+        names = list(self._initial_state)
+        values = numpy.array(nest.GetStatus(self._gids, keys=names),
+                             dtype=float).reshape(self._size, len(names))
+        return {'name': self.name, 'size': self._size,
+                'state': dict(zip(names, values.T))}
+
+    def _restore_checkpoint(self, checkpoint):
+        if (checkpoint['name'] != self.name or
+                checkpoint.get('size') != self._size):
+            raise Pype9UsageError(
+                "Checkpoint of {} '{}' cell(s) cannot be restored into an "
+                "array of {} '{}' cells".format(
+                    checkpoint.get('size', 1), checkpoint['name'], self._size,
+                    self.name))
+        self._initial_state = dict(checkpoint['state'])
+        self._set_status(self._initial_state)
+
+    def _set_status(self, values):
+        """
+        Sets the values (in simulator units) of each cell with a single call
+        to nest.SetStatus
+        """
+        nest.SetStatus(self._gids, [
+            dict((n, float(v[i])) for n, v in values.items())
+            for i in range(self._size)])
+
+    def _scale(self, varname, qty):
+        """
+        Checks the dimension of the value and scales it into the units used in
+        the simulator, returning an array with a value for each cell
+        """
+        self._check_varnames([varname])
+        unit_handler = self._cell_class.unit_handler
+        if isinstance(qty, pq.Quantity):
+            elem = qty if qty.ndim == 0 else qty[0]
+            units = unit_handler.from_pq_quantity(elem).units
+        else:
+            units = qty.units
+        dimension = self._cell_class._variables[varname].dimension
+        if units.dimension != dimension:
+            raise Pype9DimensionError(
+                "Attempting so set '{}', which has dimension {} to "
+                "{}, which has dimension {}".format(
+                    varname, dimension, qty, units.dimension))
+        value = numpy.asarray(unit_handler.scale_value(qty), dtype=float)
+        if value.ndim == 0:
+            return numpy.repeat(float(value), self._size)
+        if len(value) != self._size:
+            raise Pype9UsageError(
+                "Number of values provided for '{}' ({}) doesn't match size "
+                "of cell array ({})".format(varname, len(value), self._size))
+        return value
+
+    def _prototype_quantity(self, prototype, name):
+        try:
+            if self._cell_class._variables[name].kind == 'state_variable':
+                return prototype.initial_value(name).quantity
+            return prototype.property(name).quantity
+        except (AttributeError, NineMLNameError):
+            raise Pype9UsageError(
+                "No value provided for '{}' either as a keyword argument or "
+                "in the prototype ({})".format(name, prototype))
+
+
 class CellMetaClass(base.CellMetaClass):
 
     _built_types = {}  # Stores previously created types for reuse
+    _checksums = {}  # Memoized checksums of the builds (see _checksum)
     CodeGenerator = CodeGenerator
     BaseCellClass = Cell
+    CellArray = CellArray
     Simulation = Simulation
+
+    @classmethod
+    def _build_name(cls, name, component_class, build_component_class):
+        # The membrane voltage can be renamed in the build transform (see
+        # Cell.build_name)
+        if name == component_class.annotations.get(
+                (BUILD_TRANS, PYPE9_NS), MEMBRANE_VOLTAGE, default=None):
+            name = build_component_class.annotations.get(
+                (BUILD_TRANS, PYPE9_NS), MEMBRANE_VOLTAGE)
+        return name
@@ -233,8 +233,8 @@ class CodeGenerator(BaseCodeGenerator):
             path.append(path.join(os.environ['NEST_INSTALL_DIR'], 'bin'))
         return path
 
-    def load_libraries(self, name, url, **kwargs):  # @UnusedVariable
-        install_dir = self.get_install_dir(name, url)
+    def load_libraries(self, name, checksum, **kwargs):  # @UnusedVariable
+        install_dir = self.get_install_dir(name, checksum)
         lib_dir = os.path.join(install_dir, 'lib')
         add_lib_path(lib_dir)
         # Add module install directory to NEST path
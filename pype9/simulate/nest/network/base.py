@@ -15,7 +15,9 @@ if '--debug' in sys.argv:
     raise Pype9RuntimeError(
         "'--debug' argument passed to script conflicts with an argument to "
         "nest, causing the import to stop at the NEST prompt")
+import numpy  # @IgnorePep8
 import pyNN.nest  # @IgnorePep8
+import nest  # @IgnorePep8
 from pyNN.common.control import build_state_queries  # @IgnorePep8
 from pyNN.nest.standardmodels.synapses import StaticSynapse  # @IgnorePep8
 from pype9.simulate.common.network.base import (  # @IgnorePep8
@@ -59,6 +61,16 @@ class ComponentArray(BaseComponentArray, pyNN.nest.Population):
             to_record = 'spikes'  # FIXME: Need a way of differentiating event send ports @IgnorePep8
         pyNN.nest.Population.record(self, to_record)
 
+    def _get_local_state(self, varnames):
+        # Map the 9ML names onto the names of the variables in the NEST model
+        # (the regime variable isn't in the table and is used as is)
+        variables = self.celltype.model._variables
+        keys = [variables[n].build_name if n in variables else n
+                for n in varnames]
+        return numpy.array(nest.GetStatus(
+            [int(i) for i in self.local_cells], keys=keys),
+            dtype=float).reshape(-1, len(keys)).T
+
 
 class Selection(BaseSelection, pyNN.nest.Assembly):
 
@@ -69,6 +81,7 @@ class ConnectionGroup(BaseConnectionGroup, pyNN.nest.Projection):
 
     SynapseClass = StaticSynapse
     PyNNProjectionClass = pyNN.nest.Projection
+    FromListConnector = pyNN.nest.FromListConnector
     UnitHandler = UnitHandler
     Simulation = Simulation
 
@@ -78,6 +91,17 @@ class ConnectionGroup(BaseConnectionGroup, pyNN.nest.Projection):
 
 
 class Network(BaseNetwork):
+    """
+    In addition to the options of the base class the following NEST-specific
+    options can be provided
+
+    Parameters
+    ----------
+    native_connect : bool
+        Whether to create the connections of each connection group with a
+        single call to nest.Connect, so they are built in parallel by the NEST
+        kernel instead of cell-by-cell by PyNN (see PyNNConnectivity)
+    """
 
     ComponentArrayClass = ComponentArray
     SelectionClass = Selection
@@ -86,6 +110,13 @@ class Network(BaseNetwork):
     CodeGenerator = CodeGenerator
     Simulation = Simulation
 
+    def __init__(self, nineml_model, native_connect=False, **kwargs):
+        self._native_connect = native_connect
+        super(Network, self).__init__(nineml_model, **kwargs)
+
+    def _connectivity_kwargs(self):
+        return {'native': self._native_connect}
+
     @property
     def min_delay(self):
         return get_min_delay()
@@ -45,11 +45,13 @@ class PyNNCellWrapperMetaClass(BasePyNNCellWrapperMetaClass):
     """
 
     loaded_celltypes = {}
+    CellMetaClass = CellMetaClass
 
     def __new__(cls, component_class, default_properties,
                 initial_state, initial_regime, **kwargs):  # @UnusedVariable
         # Get the basic Pype9 cell class
-        model = CellMetaClass(component_class=component_class)
+        model = CellMetaClass(**cls.cell_metaclass_kwargs(
+            component_class, default_properties, initial_state, **kwargs))
         try:
             celltype = cls.loaded_celltypes[model.name]
         except (KeyError, Pype9BuildMismatchError):
@@ -63,3 +65,8 @@ class PyNNCellWrapperMetaClass(BasePyNNCellWrapperMetaClass):
                 cls, model.name, (PyNNCellWrapper,), dct)
             cls.loaded_celltypes[model.name] = celltype
         return celltype
+
+    @classmethod
+    def cell_metaclass_kwargs(cls, component_class, default_properties,
+                              initial_state, **kwargs):  # @UnusedVariable
+        return {'component_class': component_class}
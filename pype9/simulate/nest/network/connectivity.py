@@ -5,11 +5,175 @@
            the MIT Licence, see LICENSE for details.
 """
 from __future__ import absolute_import
+from collections import namedtuple
+import numpy
+import nest
 import pyNN.nest.connectors
+from pyNN.random import RandomDistribution
 from pype9.simulate.common.network.connectivity import (
     PyNNConnectivity as BasePyNNConnectivity)
+from pype9.utils.logging import logger
 
 
 class PyNNConnectivity(BasePyNNConnectivity):
+    """
+    Connectivity of a projection in a NEST network
+
+    In addition to the options of the base class the following NEST-specific
+    options can be provided
+
+    Parameters
+    ----------
+    native : bool
+        Whether to create the connections with a single call to nest.Connect,
+        where the connection rule is mapped onto a NEST connection
+        specification and the weights and delays are passed as arrays, instead
+        of connecting each cell in Python with the PyNN connectors. Note that
+        the NEST random number generators are used to sample probabilistic and
+        random fan-in/out connections in this case. Connection groups with
+        synapse parameters that depend on the indices of the connections
+        (e.g. arrays of values) are still connected with PyNN
+    """
 
     _pyNN_module = pyNN.nest.connectors
+
+    def __init__(self, *args, **kwargs):
+        super(PyNNConnectivity, self).__init__(*args, **kwargs)
+        self._native = kwargs.get('native', False)
+
+    def connect(self, connection_group):
+        if self._native:
+            spec = self._native_spec()
+            syn_spec = self._native_syn_spec(connection_group, spec.shape)
+            if syn_spec is not None:
+                self._native_connect(connection_group, spec, syn_spec)
+                return
+            logger.info(
+                "Could not map connections of '{}' onto a single nest.Connect "
+                "call, connecting them with PyNN instead"
+                .format(connection_group.label))
+        super(PyNNConnectivity, self).connect(connection_group)
+
+    def _native_spec(self):
+        """
+        Maps the connection rule (or the previously sampled connections) onto
+        a NEST connection specification
+        """
+        lib_type = self.rule_properties.lib_type
+        if self.has_been_sampled():
+            # Connect the same pairs of cells as the previous connection
+            # group. NEST only creates the connections to the cells local to
+            # each process so there is no need to gather the connections
+            # stored on the other processes
+            sources, destinations = self.connection_array(local=True).T
+            return _NativeSpec({'rule': 'one_to_one'}, sources, destinations,
+                               (len(sources),))
+        elif lib_type == 'AllToAll':
+            return _NativeSpec({'rule': 'all_to_all'}, None, None,
+                               (self.destination_size, self.source_size))
+        elif lib_type == 'OneToOne':
+            return _NativeSpec({'rule': 'one_to_one'}, None, None,
+                               (self.source_size,))
+        elif lib_type == 'Explicit':
+            sources, destinations = self._explicit_indices()
+            return _NativeSpec({'rule': 'one_to_one'}, sources, destinations,
+                               (len(sources),))
+        elif lib_type == 'Probabilistic':
+            # The number of connections isn't known beforehand so only
+            # homogeneous weights and delays can be used
+            return _NativeSpec(
+                {'rule': 'pairwise_bernoulli',
+                 'p': float(self.rule_properties.property(
+                     'probability').value)}, None, None, None)
+        elif lib_type == 'RandomFanIn':
+            number = int(self.rule_properties.property('number').value)
+            return _NativeSpec(
+                {'rule': 'fixed_indegree', 'indegree': number,
+                 'multapses': False}, None, None,
+                (self.destination_size, number))
+        elif lib_type == 'RandomFanOut':
+            number = int(self.rule_properties.property('number').value)
+            return _NativeSpec(
+                {'rule': 'fixed_outdegree', 'outdegree': number,
+                 'multapses': False}, None, None,
+                (self.source_size, number))
+        else:
+            assert False
+
+    def _native_syn_spec(self, connection_group, shape):
+        """
+        Evaluates the (translated) synapse parameters of the connection group
+        into scalars or arrays of the shape expected by nest.Connect. Returns
+        None if they can't be evaluated for the connection rule, which is the
+        case for parameters whose values depend on the (pre, post) indices of
+        the connections (e.g. arrays), as they would need to be rearranged
+        into the order NEST creates the connections in
+        """
+        syn_spec = {
+            'model': connection_group.nest_synapse_model,
+            'synapse_label': connection_group.nest_synapse_label,
+            'receptor_type': self._receptor_index(connection_group)}
+        parameters = connection_group.synapse_type.native_parameters
+        if not all(self._is_position_independent(v)
+                   for _, v in parameters.items()):
+            return None
+        if shape is None:
+            if not parameters.is_homogeneous:
+                return None
+            parameters.shape = (1,)
+            parameters.evaluate(simplify=True)
+            syn_spec.update(parameters.items())
+        else:
+            parameters.shape = (int(numpy.prod(shape)),)
+            parameters.evaluate(simplify=True)
+            for name, value in parameters.items():
+                if not numpy.isscalar(value):
+                    value = numpy.reshape(value, shape)
+                syn_spec[name] = value
+        return syn_spec
+
+    def _native_connect(self, connection_group, spec, syn_spec):
+        pre = connection_group.pre.all_cells
+        post = connection_group.post.all_cells
+        if spec.sources is not None:
+            pre = pre[spec.sources]
+            post = post[spec.destinations]
+        pre = [int(c) for c in pre]
+        nest.Connect(pre, [int(c) for c in post], spec.conn_spec, syn_spec)
+        # Update the book-keeping of the PyNN projection (as in
+        # pyNN.nest.Projection._connect) so it can find its connections. Only
+        # the unique presynaptic cells are required, which for the random
+        # rules may include some cells that didn't end up being connected
+        connection_group._simulator.state.stale_connection_cache = True
+        connection_group._sources = numpy.unique(pre).tolist()
+        self._prev_connected = connection_group
+
+    @classmethod
+    def _is_position_independent(cls, value):
+        """
+        Whether the values of a (lazy) synapse parameter don't depend on the
+        indices of the connections, i.e. it is either homogeneous or drawn
+        from a random distribution (scaled by homogeneous values)
+        """
+        if value.is_homogeneous:
+            return True
+        return (isinstance(value.base_value, RandomDistribution) and
+                all(operand is None or numpy.isscalar(operand) or
+                    getattr(operand, 'is_homogeneous', False)
+                    for _, operand in value.operations))
+
+    @classmethod
+    def _receptor_index(cls, connection_group):
+        # Destinations are either component arrays (populations) or
+        # selections (assemblies) of component arrays of the same cell type
+        post = getattr(connection_group.post, 'populations',
+                       [connection_group.post])[0]
+        return post.celltype.get_receptor_type(connection_group.receptor_type)
+
+
+# A NEST connection specification along with the indices of the sources and
+# destinations to connect one-to-one (if None the whole populations are
+# passed to nest.Connect) and the shape of array-valued synapse parameters
+# (if None the parameters need to be homogeneous)
+_NativeSpec = namedtuple('_NativeSpec', ('conn_spec', 'sources',
+                                         'destinations', 'shape'))
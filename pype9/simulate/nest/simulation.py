@@ -1,23 +1,89 @@
+import os
+import errno
+import tempfile
 import nineml.units as un
 from pype9.simulate.common.simulation import Simulation as BaseSimulation
 from pyNN.nest import (
-    setup as pyNN_setup, run as pyNN_run, state as pyNN_state, end as pyNN_end)
+    setup as pyNN_setup, run_until as pyNN_run_until, state as pyNN_state,
+    end as pyNN_end)
+import nest
 from pype9.exceptions import Pype9UsageError
 from .code_gen import CodeGenerator
 
 
 class Simulation(BaseSimulation):
-    """Represent the simulator state."""
+    """
+    Represent the simulator state.
+
+    In addition to the options of the base class the following NEST-specific
+    options can be provided
+
+    Parameters
+    ----------
+    device_delay : nineml.Quantity (time) | None
+        The delay used when connecting recording and input devices
+    threads_per_proc : int
+        The number of threads used by each MPI process (passed to the NEST
+        kernel as 'local_num_threads'). A dynamics seed is generated for each
+        of the resulting virtual processes, so simulations are reproducible
+        for a given seed and number of processes and threads
+    stream_dir : str | None
+        If provided, the data recorded from cells is periodically written
+        to disk in this directory and cleared from the NEST recording
+        devices, so the memory used by the recordings doesn't grow with the
+        length of the simulation. Each time the simulation is entered the
+        recordings are written to a new subdirectory so they aren't
+        overwritten by subsequent simulations
+    stream_chunk : nineml.Quantity (time)
+        The length of simulated time between which the recordings are
+        written to disk when 'stream_dir' is provided
+    """
 
     _active = None
     name = 'NEST'
     CodeGenerator = CodeGenerator
 
+    DEFAULT_STREAM_CHUNK = 1000.0 * un.ms
+
     def __init__(self, *args, **kwargs):
         self._device_delay = kwargs.get('device_delay', None)
         self._threads_per_proc = kwargs.get('threads_per_proc', 1)
+        self._stream_dir = kwargs.get('stream_dir', None)
+        self._stream_chunk = kwargs.get('stream_chunk',
+                                        self.DEFAULT_STREAM_CHUNK)
+        self._check_units('stream_chunk', self._stream_chunk, un.time)
+        self._stream_run_dir = None
+        self._streaming_cells = []
         super(Simulation, self).__init__(*args, **kwargs)
 
+    @property
+    def stream_dir(self):
+        return self._stream_dir
+
+    @property
+    def stream_run_dir(self):
+        """
+        The subdirectory of 'stream_dir' the recordings of the current
+        simulation are streamed to. NEST gids restart each time the kernel is
+        reset so a unique directory is required for each simulation
+        """
+        if self._stream_run_dir is None and self._stream_dir is not None:
+            try:
+                os.makedirs(self._stream_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            self._stream_run_dir = tempfile.mkdtemp(prefix='sim',
+                                                    dir=self._stream_dir)
+        return self._stream_run_dir
+
+    def register_stream(self, cell):
+        """
+        Registers a cell with recordings that are streamed to disk
+        """
+        if cell not in self._streaming_cells:
+            self._streaming_cells.append(cell)
+
     @property
     def device_delay(self):
         if self._device_delay is None:
@@ -48,10 +114,22 @@ class Simulation(BaseSimulation):
             A function callback to allow the update of external objects (e.g.
             progress bar) during the simulation.
         """
-        pyNN_run(float(t_stop.in_units(un.ms)), callbacks=callbacks)
+        pyNN_run_until(float(t_stop.in_units(un.ms)), callbacks=callbacks)
+
+    @property
+    def _default_chunk(self):
+        # Streamed recordings need the simulation to be run in chunks so they
+        # can be written to disk and cleared from the recording devices
+        return self._stream_chunk if self._streaming_cells else None
+
+    def _flush_recordings(self):
+        for cell in self._streaming_cells:
+            cell._spill_recordings()
 
     def _prepare(self, **kwargs):
         "Reset the simulation and prepare it for creating new cells/networks"
+        self._streaming_cells = []
+        self._stream_run_dir = None
         if self._min_delay is None:
             if self.num_threads() == 1:
                 min_delay = self.device_delay
@@ -73,9 +151,15 @@ class Simulation(BaseSimulation):
         pyNN_setup(timestep=float(self.dt.in_units(un.ms)),
                    min_delay=float(min_delay.in_units(un.ms)),
                    max_delay=float(max_delay.in_units(un.ms)),
+                   threads=self._threads_per_proc,
                    grng_seed=self.global_seed,
                    rng_seeds=self.all_dynamics_seeds, **kwargs)
 
+    def _apply_seeds(self):
+        nest.SetKernelStatus({
+            'grng_seed': int(self.global_seed),
+            'rng_seeds': [int(s) for s in self.all_dynamics_seeds]})
+
     def mpi_rank(self):
         "The rank of the MPI node the code is running on"
         return pyNN_state.mpi_rank
@@ -85,7 +169,10 @@ class Simulation(BaseSimulation):
         return pyNN_state.num_processes
 
     def num_threads(self):
-        "The total number of threads across all MPI nodes"
+        """
+        The total number of threads across all MPI nodes (i.e. the number of
+        NEST virtual processes, which each have their own RNG)
+        """
         return self.num_processes() * self._threads_per_proc
 
     @classmethod
@@ -0,0 +1,14 @@
+from __future__ import absolute_import
+from pype9.simulate.common.sweep import Sweep as BaseSweep
+from .cells import CellMetaClass
+from .simulation import Simulation
+
+
+class Sweep(BaseSweep):
+    """
+    Runs simulations of a cell model over a set of different properties in a
+    pool of worker processes using NEST (see common.sweep.Sweep)
+    """
+
+    CellMetaClass = CellMetaClass
+    Simulation = Simulation
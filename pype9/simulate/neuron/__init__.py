@@ -6,6 +6,7 @@ from .network import (
     Network, ComponentArray, Selection, ConnectionGroup,
     PyNNCellWrapperMetaClass)
 from .units import UnitHandler
+from .sweep import Sweep
 # from .pynn_interface.network import Network  # @UnusedImport
 # from .pynn_interface.population import Population  # @UnusedImport
 # from .pynn_interface.projection import Projection  # @UnusedImport
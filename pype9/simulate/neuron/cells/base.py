@@ -288,10 +288,25 @@ class Cell(base.Cell):
         recording.record(getattr(self._hoc, '_ref_{}'
                                  .format(self.code_generator.REGIME_VARNAME)))
 
-    def recording(self, port_name, t_start=None):
+    def recording(self, port_name, t_start=None, raw=False):
         """
         Return recorded data as a dictionary containing one numpy array for
         each neuron, ids as keys.
+
+        Parameters
+        ----------
+        port_name : str
+            Name of the port to retrieve the recording for
+        t_start : pq.Quantity | None
+            The time to return the recording from
+        raw : bool
+            Whether to return the recording as a (times, values) tuple of
+            numpy arrays (in ms and simulator units respectively) instead of
+            a neo object. For event ports the values are None. While the
+            simulation is running the signal values are a view onto the
+            NEURON vector, which is only valid until the simulation is
+            continued or its recordings are reset, whereas the neo objects
+            returned by default hold their own copy of the data.
         """
         if self.is_dead():
             t_stop = self._t_stop
@@ -306,37 +321,69 @@ class Cell(base.Cell):
         except NineMLNameError:
             port = self.component_class.state_variable(port_name)
         if isinstance(port, EventPort):
-            events = numpy.asarray(self._recordings[port_name])
+            events, _ = self._recorded(port_name)
+            events = self._trim_spike_train(events, float(t_start))
+            if raw:
+                return events, None
             recording = neo.SpikeTrain(
-                self._trim_spike_train(events, t_start), t_start=t_start,
-                t_stop=t_stop, units='ms')
+                events, t_start=t_start, t_stop=t_stop, units='ms',
+                copy=False)
         else:
+            signal, interval = self._recorded(port_name)
+            interval = interval * pq.ms
+            signal = self._trim_analog_signal(
+                signal[:-1], t_start, interval)  # Drop final timepoint
+            if raw:
+                times = (float(t_start) +
+                         numpy.arange(len(signal)) * float(interval))
+                return times, signal
             units_str = self.unit_handler.dimension_to_unit_str(
                 port.dimension, one_as_dimensionless=True)
-            interval = h.dt * pq.ms
-            signal = numpy.asarray(self._recordings[port_name])
+            # The signal only needs to be copied while it is still a view
+            # onto the NEURON vector (i.e. not cached when the cell is killed)
             recording = neo.AnalogSignal(
-                self._trim_analog_signal(signal, t_start, interval),
-                sampling_period=interval,
-                t_start=t_start, units=units_str, name=port_name)
-            recording = recording[:-1]  # Drop final timepoint
+                signal, sampling_period=interval, t_start=t_start,
+                units=units_str, name=port_name, copy=not self.is_dead())
         return recording
 
     def _regime_recording(self):
         t_start = self.unit_handler.to_pq_quantity(self._t_start)
+        values, interval = self._recorded(self.code_generator.REGIME_VARNAME)
         return neo.AnalogSignal(
-            self._recordings[self.code_generator.REGIME_VARNAME],
-            sampling_period=h.dt * pq.ms,
+            values, sampling_period=interval * pq.ms,
             t_start=t_start, units='dimensionless',
             name=self.code_generator.REGIME_VARNAME)
 
+    def _fetch_recording(self, key, copy=False):
+        # Unless a copy is requested, return a view onto the memory of the
+        # NEURON vector. The interval is ignored for spike times
+        values = self._recordings[key].as_numpy()
+        if copy:
+            values = numpy.array(values)
+        return values, h.dt
+
+    def _recording_keys(self):
+        return list(self._recordings)
+
+    def _release_recorders(self):
+        super(Cell, self)._release_recorders()
+        super(base.Cell, self).__setattr__(
+            '_recordings', dict((k, None) for k in self._recordings))
+
     def reset_recordings(self):
         """
         Resets the recordings for the cell and the NEURON simulator (assumes
         that only one cell is instantiated)
         """
-        for rec in self._recordings.values():
-            rec.resize(0)
+        self._initialize_local_recording()
+        for key, rec in self._recordings.items():
+            if rec is None:
+                # The vector has been released after the cell was killed so
+                # reset the cached copy of the recording instead
+                values, interval = self._recording_cache[key]
+                self._recording_cache[key] = (values[:0], interval)
+            else:
+                rec.resize(0)
 
     def clear_recorders(self):
         """
@@ -478,11 +525,11 @@ class Cell(base.Cell):
         self._input_auxs.extend((seclamp_amps, seclamp_times))
 
     def _escaped_name(self, name):
-        if name == self.component_class.annotations.get(
-                (BUILD_TRANS, PYPE9_NS), MEMBRANE_VOLTAGE):
-            name = self.build_component_class.annotations.get(
-                (BUILD_TRANS, PYPE9_NS), MEMBRANE_VOLTAGE)
-        return name
+        try:
+            return self._variables[name].build_name
+        except KeyError:
+            return self.__class__._build_name(
+                name, self.component_class, self.build_component_class)
 
     @classmethod
     def get_v_threshold(self, dynamics_properties, port_name):
@@ -562,10 +609,21 @@ class CellMetaClass(base.CellMetaClass):
     """
 
     _built_types = {}  # Stores previously created types for reuse
+    _checksums = {}  # Memoized checksums of the builds (see _checksum)
     CodeGenerator = CodeGenerator
     BaseCellClass = Cell
+    CellArray = base.CellArray
     Simulation = Simulation
 
+    @classmethod
+    def _build_name(cls, name, component_class, build_component_class):
+        # The membrane voltage can be renamed in the build transform
+        if name == component_class.annotations.get(
+                (BUILD_TRANS, PYPE9_NS), MEMBRANE_VOLTAGE):
+            name = build_component_class.annotations.get(
+                (BUILD_TRANS, PYPE9_NS), MEMBRANE_VOLTAGE)
+        return name
+
 
 class OuputEventTransitionsFinder(BaseVisitorWithContext):
     """
@@ -12,6 +12,8 @@ from __future__ import unicode_literals
 from builtins import next, str
 import os.path
 import tempfile
+import shutil
+import hashlib
 import platform
 import re
 import uuid
@@ -36,6 +38,7 @@ from nineml.abstraction.dynamics.visitors.queriers import (
     DynamicsInterfaceInferer)
 from sympy.printing import ccode
 from pype9.utils.mpi import is_mpi_master, mpi_comm
+from pype9.utils.paths import remove_ignore_missing
 from pype9.simulate.neuron.units import UnitHandler
 try:
     from nineml.extensions.kinetics import Kinetics  # @UnusedImport
@@ -71,6 +74,10 @@ class CodeGenerator(BaseCodeGenerator):
 
     _inbuilt_ions = ['na', 'k', 'ca']
 
+    _COMBINED_NAME = '__combined__'
+    # (name, checksum) pairs of mechanisms loaded from combined libraries
+    _combined_loaded = set()
+
     def __init__(self, gsl_path=None, **kwargs):
         super(CodeGenerator, self).__init__(**kwargs)
         self.nrnivmodl_path = self.get_neuron_util_path('nrnivmodl')
@@ -483,7 +490,7 @@ class CodeGenerator(BaseCodeGenerator):
                          ' '.join(self.nrnivmodl_flags)]
         logger.debug("Building nrnivmodl in {} with {}".format(
             compile_dir, nrnivmodl_cmd))
-        self.run_command(nrnivmodl_cmd, fail_msg=(
+        stdout, stderr = self.run_command(nrnivmodl_cmd, fail_msg=(
             "Compilation of NMODL files for '{}' model failed. See src "
             "directory '{}':\n\n{{}}".format(name, compile_dir)))
         if stderr.strip().endswith('Error 1'):
@@ -493,20 +500,107 @@ class CodeGenerator(BaseCodeGenerator):
         logger.info("Compilation of NEURON (NMODL) files for '{}' "
                     "completed successfully".format(name))
 
-    def get_install_dir(self, name, url):
+    def get_install_dir(self, name, checksum):
         # return the platform-specific location of the nrnivmodl output files
-        return os.path.join(self.get_source_dir(name, url), self.specials_dir)
+        return os.path.join(self.get_source_dir(name, checksum),
+                            self.specials_dir)
 
-    def get_compile_dir(self, name, url):
+    def get_compile_dir(self, name, checksum):
         """
         The compile dir is the same as the src dir for NEURON compile
         """
-        return self.get_source_dir(name, url)
+        return self.get_source_dir(name, checksum)
 
-    def load_libraries(self, name, url):
-        install_dir = self.get_install_dir(name, url)
+    def load_libraries(self, name, checksum):
+        if (name, checksum) in self._combined_loaded:
+            return  # Already loaded as part of a combined library
+        install_dir = self.get_install_dir(name, checksum)
         load_mechanisms(os.path.dirname(install_dir))
 
+    def is_built(self, name, checksum):
+        return ((name, checksum) in self._combined_loaded or
+                super(CodeGenerator, self).is_built(name, checksum))
+
+    def generate_combined(self, builds, build_mode='lazy', num_workers=None):
+        """
+        Generates the NMODL files of multiple component classes and compiles
+        them with a single call to nrnivmodl, so that the (relatively
+        expensive) compilation and linking of the 'special' library is only
+        performed once and NEURON only needs to load one library.
+
+        Parameters
+        ----------
+        builds : list(tuple(nineml.Dynamics, str, str, dict))
+            The build component class, url, checksum and template arguments
+            of each build (see 'generate')
+        build_mode : str
+            The build mode (see 'generate')
+        num_workers : int | None
+            The maximum number of processes used to generate the NMODL files
+        """
+        checksum = self._combined_checksum(builds)
+        if build_mode == 'require':
+            if not super(CodeGenerator, self).is_built(self._COMBINED_NAME,
+                                                       checksum):
+                raise Pype9BuildError(
+                    "Prebuilt combined installation of '{}' (checksum {}) is "
+                    "not present in '{}', and is required for 'require' "
+                    "build option".format(
+                        "', '".join(b[0].name for b in builds), checksum,
+                        self.get_build_dir(self._COMBINED_NAME, checksum)))
+            return
+        if build_mode == 'lazy' and super(CodeGenerator, self).is_built(
+                self._COMBINED_NAME, checksum):
+            logger.info("Found existing combined build of '{}' with matching "
+                        "checksum in '{}' directory, code generation and "
+                        "compilation skipped".format(
+                            "', '".join(b[0].name for b in builds),
+                            self.get_build_dir(self._COMBINED_NAME,
+                                               checksum)))
+            return
+        # Generate the NMODL files of each component class separately
+        self.generate_all(builds, build_mode='generate_only',
+                          num_workers=num_workers)
+        if build_mode == 'generate_only':
+            return
+        # Collect the generated NMODL files into a combined src directory
+        if build_mode == 'purge':
+            remove_ignore_missing(self.get_build_dir(self._COMBINED_NAME,
+                                                     checksum))
+        remove_ignore_missing(self._checksum_path(self._COMBINED_NAME,
+                                                  checksum))
+        src_dir = self.get_source_dir(self._COMBINED_NAME, checksum)
+        self.clean_src_dir(src_dir, self._COMBINED_NAME)
+        for component_class, _, member_checksum, _ in builds:
+            member_src_dir = self.get_source_dir(component_class.name,
+                                                 member_checksum)
+            for fname in os.listdir(member_src_dir):
+                if fname.endswith('.mod'):
+                    shutil.copy(os.path.join(member_src_dir, fname), src_dir)
+        self.compile_source_files(src_dir, self._COMBINED_NAME)
+        with open(self._checksum_path(self._COMBINED_NAME, checksum),
+                  'w') as f:
+            f.write(checksum)
+
+    def load_combined(self, builds):
+        """
+        Loads the library built by 'generate_combined' for the given builds
+        """
+        checksum = self._combined_checksum(builds)
+        members = set((b[0].name, b[2]) for b in builds)
+        if members <= self._combined_loaded:
+            return
+        load_mechanisms(self.get_source_dir(self._COMBINED_NAME, checksum))
+        self._combined_loaded.update(members)
+
+    @classmethod
+    def _combined_checksum(cls, builds):
+        sha = hashlib.sha1()
+        for name_checksum in sorted('{}:{}'.format(b[0].name, b[2])
+                                    for b in builds):
+            sha.update(name_checksum.encode('utf-8'))
+        return sha.hexdigest()
+
     def clean_compile_dir(self, *args, **kwargs):
         pass  # NEURON doesn't use a separate compile dir
 
@@ -8,6 +8,7 @@
            the MIT Licence, see LICENSE for details.
 """
 from __future__ import absolute_import
+import numpy
 import pyNN.neuron
 from pyNN.common.control import build_state_queries
 import pyNN.neuron.simulator as simulator
@@ -53,6 +54,10 @@ class ComponentArray(BaseComponentArray, pyNN.neuron.Population):
             to_record = 'spikes'  # FIXME: Need a way of differentiating event send ports @IgnorePep8
         pyNN.neuron.Population.record(self, to_record)
 
+    def _get_local_state(self, varnames):
+        return numpy.array([id_._cell._get_many(varnames) for id_ in self],
+                           dtype=float).reshape(-1, len(varnames)).T
+
 
 class Selection(BaseSelection, pyNN.neuron.Assembly):
 
@@ -63,6 +68,7 @@ class ConnectionGroup(BaseConnectionGroup, pyNN.neuron.Projection):
 
     SynapseClass = StaticSynapse
     PyNNProjectionClass = pyNN.neuron.Projection
+    FromListConnector = pyNN.neuron.FromListConnector
     UnitHandler = UnitHandler
     Simulation = Simulation
 
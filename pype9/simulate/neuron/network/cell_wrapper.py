@@ -27,13 +27,12 @@ class PyNNCellWrapper(BasePyNNCellWrapper, pyNN.models.BaseCellType):
 class PyNNCellWrapperMetaClass(BasePyNNCellWrapperMetaClass):
 
     loaded_celltypes = {}
+    CellMetaClass = CellMetaClass
 
     def __new__(cls, component_class, default_properties,
                 initial_state, initial_regime, **kwargs):  # @UnusedVariable @IgnorePep8
-        model = CellMetaClass(component_class=component_class,
-                              default_properties=default_properties,
-                              initial_state=initial_state,
-                              standalone=False, **kwargs)
+        model = CellMetaClass(**cls.cell_metaclass_kwargs(
+            component_class, default_properties, initial_state, **kwargs))
         try:
             celltype = cls.loaded_celltypes[model.name]
         except KeyError:
@@ -2,7 +2,8 @@ from builtins import object
 from nineml import units as un
 import ctypes
 from pyNN.neuron import (
-    setup as pyNN_setup, run as pyNN_run, end as pyNN_end, state as pyNN_state)
+    setup as pyNN_setup, run_until as pyNN_run_until, end as pyNN_end,
+    state as pyNN_state)
 from pyNN.neuron.simulator import initializer as pyNN_initializer
 from pype9.simulate.common.simulation import Simulation as BaseSimulation
 from pype9.simulate.neuron.code_gen import CodeGenerator
@@ -45,7 +46,7 @@ class Simulation(BaseSimulation):
             A function callback to allow the update of external objects (e.g.
             progress bar) during the simulation.
         """
-        pyNN_run(float(t_stop.in_units(un.ms)), callbacks=callbacks)
+        pyNN_run_until(float(t_stop.in_units(un.ms)), callbacks=callbacks)
 
     def _prepare(self, **kwargs):
         "Reset the simulation and prepare it for creating new cells/networks"
@@ -1,5 +1,30 @@
+import multiprocessing
+
 
 class classproperty(property):
     """Used to set a property of a class"""
     def __get__(self, cls, owner):
         return self.fget.__get__(None, owner)()
+
+
+def spawn_pool(num_workers, **kwargs):
+    """
+    Creates a pool of worker processes that are started afresh instead of
+    being forked, so they don't inherit the state of simulator kernels that
+    have already been imported and initialised by the parent process. NB: as
+    the main module is reimported in the workers, scripts that use the pool
+    need to protect their entry point with "if __name__ == '__main__':"
+
+    Parameters
+    ----------
+    num_workers : int
+        The number of worker processes
+    kwargs : dict
+        Keyword arguments passed to multiprocessing.Pool (e.g. 'initializer')
+    """
+    try:
+        context = multiprocessing.get_context('spawn')
+    except AttributeError:
+        # Python 2 doesn't support start methods other than forking
+        context = multiprocessing
+    return context.Pool(num_workers, **kwargs)
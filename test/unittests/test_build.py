@@ -1,11 +1,16 @@
 from __future__ import division
 from __future__ import print_function
+import os
+import tempfile
+import shutil
+from mock import patch
 import ninemlcatalog
 from nineml.abstraction import Parameter, TimeDerivative, StateVariable
 import nineml.units as un
 from pype9.simulate.nest import CellMetaClass
+from pype9.simulate.neuron import CellMetaClass as NeuronCellMetaClass
 from pype9.simulate.common.cells.with_synapses import WithSynapses
-from pype9.exceptions import Pype9BuildMismatchError
+from pype9.exceptions import Pype9BuildMismatchError, Pype9UsageError
 from unittest import TestCase  # @Reimport
 import pype9.utils.logging.handlers.sysout  # @UnusedImport
 
@@ -28,3 +33,156 @@ class TestSeeding(TestCase):
             Pype9BuildMismatchError,
             CellMetaClass,
             izhi2_wrap)
+
+    def test_build_checksum(self):
+        izhi = ninemlcatalog.load('neuron/Izhikevich.xml#Izhikevich')
+        izhi2 = izhi.clone()
+        izhi2.add(Parameter('zp', dimension=un.time))
+        code_gen = CellMetaClass.CodeGenerator()
+        checksums = []
+        for comp_class in (izhi, izhi.clone(), izhi2):
+            build_comp_class = code_gen.transform_for_build(
+                name='IzhikevichChecksum',
+                component_class=WithSynapses.wrap(comp_class))
+            checksums.append(code_gen.checksum(build_comp_class))
+        self.assertEqual(checksums[0], checksums[1],
+                         "Checksums of identical component classes differ")
+        self.assertNotEqual(checksums[0], checksums[2],
+                            "Checksums of different component classes match")
+
+    def test_build_checksum_template_args(self):
+        izhi = ninemlcatalog.load('neuron/Izhikevich.xml#Izhikevich')
+        code_gen = CellMetaClass.CodeGenerator()
+        build_comp_class = code_gen.transform_for_build(
+            name='IzhikevichChecksum',
+            component_class=WithSynapses.wrap(izhi))
+        self.assertEqual(
+            code_gen.checksum(build_comp_class, ode_solver='euler',
+                              ss_solver=None),
+            code_gen.checksum(build_comp_class, ss_solver=None,
+                              ode_solver='euler'),
+            "Checksums depend on the order of the template arguments")
+        self.assertNotEqual(
+            code_gen.checksum(build_comp_class, ode_solver='euler'),
+            code_gen.checksum(build_comp_class, ode_solver='rk4'),
+            "Checksums of builds with different template arguments match")
+        self.assertEqual(
+            code_gen.canonical_template_args(
+                {'a': {'x': 1, 'y': [2.5, None]}, 'b': set(['s', 't'])}),
+            code_gen.canonical_template_args(
+                {'b': set(['t', 's']), 'a': {'y': (2.5, None), 'x': 1}}))
+        self.assertRaises(Pype9UsageError, code_gen.checksum,
+                          build_comp_class, ode_solver=object())
+
+    def test_build_checksum_memoized(self):
+        izhi = ninemlcatalog.load('neuron/Izhikevich.xml#Izhikevich')
+        code_gen = CellMetaClass.CodeGenerator()
+        with patch.object(code_gen, 'checksum',
+                          wraps=code_gen.checksum) as mock_checksum:
+            checksums = [
+                CellMetaClass._prepare_build(
+                    izhi, build_version='Memoized', code_generator=code_gen,
+                    ode_solver='euler')[4]
+                for _ in range(2)]
+            self.assertEqual(mock_checksum.call_count, 1,
+                             "Checksum of the same component class and "
+                             "template arguments was calculated twice")
+            self.assertEqual(checksums[0], checksums[1])
+            # Different template arguments need a new checksum
+            checksum = CellMetaClass._prepare_build(
+                izhi, build_version='Memoized', code_generator=code_gen,
+                ode_solver='rk4')[4]
+            self.assertEqual(mock_checksum.call_count, 2)
+            self.assertNotEqual(checksum, checksums[0])
+
+
+class TestBuildAll(TestCase):
+
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        izhi = ninemlcatalog.load('neuron/Izhikevich.xml#Izhikevich')
+        izhi2 = izhi.clone(name='Izhikevich2')
+        izhi2.add(Parameter('zp', dimension=un.time))
+        self.component_classes = [izhi, izhi2]
+
+    def tearDown(self):
+        shutil.rmtree(self.build_dir)
+
+    def _builds(self, CellMetaClass, code_gen):
+        builds = []
+        for comp_class in self.component_classes:
+            (_, url, _, build_comp_class, checksum,
+             _) = CellMetaClass._prepare_build(
+                 comp_class, build_version='BuildAllTest',
+                 code_generator=code_gen)
+            builds.append((build_comp_class, url, checksum, {}))
+        return builds
+
+    def test_generate_all(self):
+        code_gen = CellMetaClass.CodeGenerator(base_dir=self.build_dir)
+        builds = self._builds(CellMetaClass, code_gen)
+        code_gen.generate_all(builds, build_mode='generate_only',
+                              num_workers=2)
+        for build_comp_class, _, checksum, _ in builds:
+            src_dir = code_gen.get_source_dir(build_comp_class.name, checksum)
+            self.assertTrue(
+                os.path.exists(src_dir) and os.listdir(src_dir),
+                "Source of '{}' was not generated by generate_all"
+                .format(build_comp_class.name))
+        # Generating in parallel should give the same source as generating
+        # in serial
+        serial_gen = CellMetaClass.CodeGenerator(
+            base_dir=os.path.join(self.build_dir, 'serial'))
+        serial_gen.generate_all(builds, build_mode='generate_only',
+                                num_workers=1)
+        for build_comp_class, _, checksum, _ in builds:
+            src_dir = code_gen.get_source_dir(build_comp_class.name, checksum)
+            serial_src_dir = serial_gen.get_source_dir(build_comp_class.name,
+                                                       checksum)
+            self.assertEqual(sorted(os.listdir(src_dir)),
+                             sorted(os.listdir(serial_src_dir)))
+
+    def test_generate_combined(self):
+        code_gen = NeuronCellMetaClass.CodeGenerator(base_dir=self.build_dir)
+        builds = self._builds(NeuronCellMetaClass, code_gen)
+        checksum = code_gen._combined_checksum(builds)
+        self.assertEqual(checksum,
+                         code_gen._combined_checksum(list(reversed(builds))),
+                         "Combined checksum depends on the order of builds")
+        code_gen.generate_combined(builds, build_mode='force', num_workers=2)
+        combined_src_dir = code_gen.get_source_dir(code_gen._COMBINED_NAME,
+                                                   checksum)
+        # The NMODL files of every member are compiled together
+        for build_comp_class, _, member_checksum, _ in builds:
+            member_src_dir = code_gen.get_source_dir(build_comp_class.name,
+                                                     member_checksum)
+            for fname in os.listdir(member_src_dir):
+                if fname.endswith('.mod'):
+                    self.assertTrue(os.path.exists(
+                        os.path.join(combined_src_dir, fname)))
+        self.assertTrue(code_gen.is_built(code_gen._COMBINED_NAME, checksum))
+        code_gen.load_combined(builds)
+        for build_comp_class, _, member_checksum, _ in builds:
+            # Members are treated as built once the combined library has
+            # been loaded
+            self.assertTrue(code_gen.is_built(build_comp_class.name,
+                                              member_checksum))
+        # A lazy rebuild reuses the combined build
+        mtime = os.path.getmtime(code_gen._checksum_path(
+            code_gen._COMBINED_NAME, checksum))
+        code_gen.generate_combined(builds, build_mode='lazy')
+        self.assertEqual(mtime, os.path.getmtime(code_gen._checksum_path(
+            code_gen._COMBINED_NAME, checksum)))
+
+    def test_build_all_combined(self):
+        cell_kwargs = [{'component_class': c, 'build_version': 'Combined',
+                        'build_base_dir': self.build_dir}
+                       for c in self.component_classes]
+        NeuronCellMetaClass.build_all(cell_kwargs, build_mode='force',
+                                      num_workers=2, combined=True)
+        # The cell classes are loaded from the combined library so don't
+        # need to be built separately
+        for kwargs in cell_kwargs:
+            Cell = NeuronCellMetaClass(build_mode='require', **kwargs)
+            self.assertTrue(Cell.code_generator.is_built(Cell.name,
+                                                         Cell.checksum))
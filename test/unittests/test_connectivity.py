@@ -0,0 +1,74 @@
+from __future__ import division
+from __future__ import print_function
+import numpy
+from pype9.simulate.common.network.connectivity import SparseConnectionMap
+from unittest import TestCase  # @Reimport
+
+
+class TestSparseConnectionMap(TestCase):
+
+    # (source, target) pairs including a duplicate connection
+    addresses = [(2, 0), (0, 0), (1, 2), (3, 2), (0, 2), (2, 0)]
+    shape = (4, 3)
+
+    def setUp(self):
+        self.sparse_map = SparseConnectionMap.from_addresses(
+            self.addresses, *self.shape)
+        self.dense = numpy.zeros(self.shape, dtype=bool)
+        for source, target in self.addresses:
+            self.dense[source, target] = True
+
+    def test_from_addresses(self):
+        self.assertEqual(self.sparse_map.shape, self.shape)
+        # Duplicate connections are removed
+        self.assertEqual(len(self.sparse_map), 5)
+        self.assertEqual(list(self.sparse_map.indptr), [0, 2, 2, 5])
+        self.assertEqual(list(self.sparse_map.indices), [0, 2, 0, 1, 3])
+        # The map can be built from an array as well as a list
+        from_array = SparseConnectionMap.from_addresses(
+            numpy.array(self.addresses), *self.shape)
+        self.assertTrue(numpy.array_equal(from_array.keys,
+                                          self.sparse_map.keys))
+        # Maps gathered from different processes can be combined from their
+        # keys
+        half = len(self.addresses) // 2
+        parts = [SparseConnectionMap.from_addresses(a, *self.shape)
+                 for a in (self.addresses[:half], self.addresses[half:])]
+        combined = SparseConnectionMap.from_keys(
+            numpy.concatenate([p.keys for p in parts]), *self.shape)
+        self.assertTrue(numpy.array_equal(combined.indptr,
+                                          self.sparse_map.indptr))
+        self.assertTrue(numpy.array_equal(combined.indices,
+                                          self.sparse_map.indices))
+
+    def test_empty(self):
+        empty = SparseConnectionMap.from_addresses([], *self.shape)
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(list(empty.sources(1)), [])
+        self.assertFalse(empty.is_connected(0, 0))
+        self.assertFalse(numpy.any(empty.is_connected(
+            numpy.arange(self.shape[0]), 1)))
+
+    def test_sources(self):
+        for target in range(self.shape[1]):
+            self.assertEqual(list(self.sparse_map.sources(target)),
+                             list(numpy.nonzero(self.dense[:, target])[0]))
+
+    def test_is_connected(self):
+        sources, targets = numpy.meshgrid(numpy.arange(self.shape[0]),
+                                          numpy.arange(self.shape[1]),
+                                          indexing='ij')
+        self.assertTrue(numpy.array_equal(
+            self.sparse_map.is_connected(sources, targets), self.dense))
+        # Columns (as evaluated by PyNN's MapConnector)
+        for target in range(self.shape[1]):
+            self.assertTrue(numpy.array_equal(
+                self.sparse_map.is_connected(numpy.arange(self.shape[0]),
+                                             target),
+                self.dense[:, target]))
+        # Scalar (0-d) indices, including ones past the last connection
+        for source in range(self.shape[0]):
+            for target in range(self.shape[1]):
+                connected = self.sparse_map.is_connected(source, target)
+                self.assertEqual(numpy.shape(connected), ())
+                self.assertEqual(bool(connected), self.dense[source, target])
@@ -3,6 +3,7 @@ from __future__ import print_function
 from itertools import chain
 import ninemlcatalog
 import numpy
+import nest
 import sys
 from nineml import units as un, Property
 from pype9.simulate.neuron import (
@@ -126,6 +127,53 @@ class TestSeeding(TestCase):
                                     list(chain(*ext1_spikes.spiketrains)),
                                     list(chain(*ext4_spikes.spiketrains))))
 
+    def test_nest_threads(self):
+        with NESTSimulation(dt=0.01 * un.ms, seed=1, threads_per_proc=2,
+                            min_delay=0.1 * un.ms,
+                            max_delay=10.0 * un.ms) as sim:
+            status = nest.GetKernelStatus()
+            self.assertEqual(status['local_num_threads'], 2,
+                             "Threads per process not passed to NEST kernel")
+            self.assertEqual(len(status['rng_seeds']), sim.num_threads(),
+                             "A seed is not provided for every virtual "
+                             "process")
+            self.assertEqual(list(status['rng_seeds']),
+                             [int(s) for s in sim.all_dynamics_seeds])
+
+    def test_threaded_network_seed(self):
+        brunel_model = self._load_brunel('AI', 1)
+        brunel_model.population('Ext').cell['rate'] = 300 / un.s
+        for native_connect in (False, True):
+            results = []
+            for seed, threads in ((1, 2), (1, 2), (2, 2)):
+                with NESTSimulation(dt=0.01 * un.ms, seed=seed,
+                                    threads_per_proc=threads,
+                                    **brunel_model.delay_limits()) as sim:
+                    network = NESTNetwork(brunel_model,
+                                          native_connect=native_connect)
+                    network.component_array('Exc').record('spike_output')
+                    sim.run(20 * un.ms)
+                conns = sorted(network.connection_group('Excitation').get(
+                    ['weight', 'delay'], 'list'))
+                spiketrains = network.component_array('Exc').recording(
+                    'spike_output').spiketrains
+                spikes = sorted((float(t), i)
+                                for i, st in enumerate(spiketrains)
+                                for t in st)
+                results.append((conns, spikes))
+            self.assertEqual(
+                results[0][0], results[1][0],
+                "Connections of threaded network not the same despite using "
+                "the same seed (native_connect={})".format(native_connect))
+            self.assertEqual(
+                results[0][1], results[1][1],
+                "Spikes of threaded network not the same despite using the "
+                "same seed (native_connect={})".format(native_connect))
+            self.assertNotEqual(
+                results[0][1], results[2][1],
+                "Spikes of threaded network the same despite using different "
+                "seeds (native_connect={})".format(native_connect))
+
     def _load_brunel(self, case, order):
         model = ninemlcatalog.load('network/Brunel2000/' + case).as_network(
             'Brunel_{}'.format(case))
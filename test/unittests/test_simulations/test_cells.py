@@ -2,7 +2,11 @@
 from __future__ import print_function
 from __future__ import division
 from builtins import zip
+import os
 import sys
+import tempfile
+import shutil
+import numpy
 import quantities as pq
 from itertools import chain, repeat
 import logging
@@ -11,6 +15,8 @@ from nineml import units as un
 from nineml.user import Property
 from nineml.user.multi.dynamics import MultiDynamics
 from nineml.user import DynamicsProperties
+from nineml.abstraction import Alias
+from nineml.abstraction.ports import AnalogSendPort
 from pype9.simulate.common.cells import (
     MultiDynamicsWithSynapses, DynamicsWithSynapsesProperties,
     ConnectionParameterSet, ConnectionPropertySet)
@@ -20,7 +26,10 @@ from pype9.simulate.neuron import (
 argv = sys.argv[1:]  # Save argv before it is clobbered by the NEST init.
 from pype9.simulate.nest import (  # @IgnorePep8
     CellMetaClass as NESTCellMetaClass,
-    Simulation as NESTSimulation)
+    Simulation as NESTSimulation, Sweep as NESTSweep)
+from pype9.simulate.common.simulation import ChunkStats  # @IgnorePep8
+from pype9.exceptions import Pype9UsageError  # @IgnorePep8
+from pype9.simulate.common.sweep import Sweep  # @IgnorePep8
 from pype9.utils.testing import Comparer, input_step, input_freq  # @IgnorePep8
 from pype9.simulate.nest.units import UnitHandler as UnitHandlerNEST  # @IgnorePep8
 import pype9.utils.logging.handlers.sysout  # @IgnorePep8
@@ -437,6 +446,222 @@ class TestDynamics(TestCase):
                      recorded_rate - ref_rate)))
 
 
+class TestRecordings(TestCase):
+
+    izhi_initial_states = {'U': -14.0 * pq.mV / pq.ms, 'V': -65.0 * pq.mV}
+
+    def _izhi_cell(self, sim_name, build_mode=BUILD_MODE_DEFAULT):
+        Cell = cell_metaclasses[sim_name](
+            ninemlcatalog.load('neuron/Izhikevich', 'Izhikevich'),
+            build_mode=build_mode, build_version='TestRec')
+        cell = Cell(ninemlcatalog.load('neuron/Izhikevich',
+                                       'SampleIzhikevich'),
+                    **self.izhi_initial_states)
+        cell.play(*input_step('Isyn', 0.02, 50, 100, 0.1, 30))
+        cell.record('V')
+        return cell
+
+    def test_reset_recordings_after_kill(self):
+        with NeuronSimulation(dt=0.1 * un.ms) as sim:
+            cell = self._izhi_cell('neuron')
+            sim.run(10 * un.ms)
+        self.assertTrue(len(cell.recording('V')))
+        # The NEURON vectors have been released so the cached recording
+        # should be reset instead
+        cell.reset_recordings()
+        self.assertEqual(len(cell.recording('V', raw=True)[1]), 0)
+
+    def test_recording_copied_while_running(self):
+        with NeuronSimulation(dt=0.1 * un.ms) as sim:
+            cell = self._izhi_cell('neuron')
+            sim.run(10 * un.ms)
+            recording = cell.recording('V')
+            values = numpy.array(recording)
+            # Continuing the simulation shouldn't alter the recording that
+            # has already been returned
+            sim.run(20 * un.ms)
+            self.assertTrue(numpy.array_equal(numpy.array(recording),
+                                              values))
+            self.assertGreater(len(cell.recording('V')), len(recording))
+
+    def test_stream_consecutive_simulations(self):
+        stream_dir = tempfile.mkdtemp()
+        try:
+            cells = []
+            for _ in range(2):
+                with NESTSimulation(dt=0.1 * un.ms, stream_dir=stream_dir,
+                                    stream_chunk=5 * un.ms) as sim:
+                    cell = self._izhi_cell('nest')
+                    sim.run(20 * un.ms)
+                    # Read the live recording, which is partially streamed
+                    live = numpy.array(cell.recording('V'))
+                cells.append((cell, live))
+            # The gids restart in the second simulation so its recordings
+            # shouldn't overwrite the segments of the first
+            self.assertEqual(len(os.listdir(stream_dir)), 2)
+            for cell, live in cells:
+                self.assertTrue(numpy.array_equal(
+                    numpy.array(cell.recording('V')), live))
+        finally:
+            shutil.rmtree(stream_dir)
+
+    def test_cell_array_recording(self):
+        properties = ninemlcatalog.load('neuron/Izhikevich',
+                                        'SampleIzhikevich')
+        with NESTSimulation(dt=0.1 * un.ms, seed=NEST_RNG_SEED) as sim:
+            cell = self._izhi_cell('nest')
+            Cell = type(cell)
+            array = Cell.create_many(2, prototype_=properties,
+                                     **self.izhi_initial_states)
+            array.record('V')
+            sim.run(20 * un.ms)
+        ref = cell.recording('V')
+        array_recordings = array.recording('V')
+        self.assertEqual(len(array_recordings), 2)
+        # The cells in the array don't receive the input current played
+        # into the single cell but it only starts after 50 ms
+        for recording in array_recordings:
+            self.assertEqual(len(recording), len(ref))
+            self.assertEqual(recording.t_start, ref.t_start)
+            self.assertEqual(recording.sampling_period, ref.sampling_period)
+            self.assertTrue(numpy.allclose(
+                numpy.array(recording), numpy.array(ref)))
+
+    def test_cell_array_send_port_recording(self):
+        izhi = ninemlcatalog.load('neuron/Izhikevich', 'Izhikevich').clone(
+            name='IzhikevichSendPort')
+        izhi.add(Alias('V_out', 'V'))
+        izhi.add(AnalogSendPort('V_out', dimension=un.voltage))
+        sample = ninemlcatalog.load('neuron/Izhikevich', 'SampleIzhikevich')
+        properties = DynamicsProperties(
+            'SampleIzhikevichSendPort', izhi,
+            properties=dict((p.name, p.quantity) for p in sample.properties))
+        Cell = NESTCellMetaClass(izhi, build_mode=BUILD_MODE_DEFAULT,
+                                 build_version='TestRec')
+        with NESTSimulation(dt=0.1 * un.ms, seed=NEST_RNG_SEED) as sim:
+            array = Cell.create_many(2, prototype_=properties,
+                                     **self.izhi_initial_states)
+            array.record('V')
+            # NEST only records state variables so the recorder of the state
+            # variable the send port is an alias of is used for it
+            array._recorders['V_out'] = array._recorders['V']
+            sim.run(20 * un.ms)
+        for recording, ref in zip(array.recording('V_out'),
+                                  array.recording('V')):
+            self.assertEqual(recording.name, 'V_out')
+            self.assertEqual(recording.units, ref.units)
+            self.assertTrue(numpy.array_equal(numpy.array(recording),
+                                              numpy.array(ref)))
+
+
+class TestSimulation(TestCase):
+
+    def _izhi_cell(self):
+        Cell = NESTCellMetaClass(
+            ninemlcatalog.load('neuron/Izhikevich', 'Izhikevich'),
+            build_mode=BUILD_MODE_DEFAULT, build_version='TestRec')
+        cell = Cell(ninemlcatalog.load('neuron/Izhikevich',
+                                       'SampleIzhikevich'),
+                    **TestRecordings.izhi_initial_states)
+        cell.record('V')
+        return cell
+
+    def test_reenter(self):
+        simulation = NESTSimulation(dt=0.1 * un.ms, seed=NEST_RNG_SEED)
+        recordings = []
+        for _ in range(2):
+            with simulation as sim:
+                cell = self._izhi_cell()
+                sim.run(20 * un.ms)
+                self.assertEqual(float(sim.t.in_units(un.ms)), 20.0)
+            recordings.append(numpy.array(cell.recording('V')))
+            self.assertEqual(len(simulation.chunk_stats), 1)
+        # The second time the simulation is entered it should be run from
+        # the start again
+        self.assertTrue(numpy.array_equal(*recordings))
+
+    def test_chunks(self):
+        with NESTSimulation(dt=0.1 * un.ms, seed=NEST_RNG_SEED,
+                            min_delay=1 * un.ms) as sim:
+            cell = self._izhi_cell()
+            sim.run(20 * un.ms, chunk=5 * un.ms)
+        self.assertEqual(float(sim.t.in_units(un.ms)), 20.0)
+        self.assertEqual([(s.t_start, s.t_stop) for s in sim.chunk_stats],
+                         [(0.0, 5.0), (5.0, 10.0), (10.0, 15.0),
+                          (15.0, 20.0)])
+        for stats in sim.chunk_stats:
+            self.assertIsInstance(stats, ChunkStats)
+            self.assertGreaterEqual(stats.wall_time, 0.0)
+            self.assertGreater(stats.rate, 0.0)
+        # A chunked run should give the same recording as an unchunked one
+        with NESTSimulation(dt=0.1 * un.ms, seed=NEST_RNG_SEED,
+                            min_delay=1 * un.ms) as sim:
+            ref_cell = self._izhi_cell()
+            sim.run(20 * un.ms)
+        self.assertTrue(numpy.array_equal(
+            numpy.array(cell.recording('V')),
+            numpy.array(ref_cell.recording('V'))))
+
+    def test_hook_stop(self):
+        called = []
+
+        def hook(simulation, stats):
+            called.append(stats)
+            # Stop after the second chunk
+            return len(called) == 2
+
+        with NESTSimulation(dt=0.1 * un.ms, seed=NEST_RNG_SEED,
+                            min_delay=1 * un.ms) as sim:
+            sim.add_hook(hook)
+            self._izhi_cell()
+            sim.run(20 * un.ms, chunk=5 * un.ms)
+            self.assertEqual(float(sim.t.in_units(un.ms)), 10.0)
+            self.assertEqual(called, sim.chunk_stats)
+            sim.remove_hook(hook)
+            # The remainder of the run can be completed without the hook
+            sim.run(20 * un.ms, chunk=5 * un.ms)
+            self.assertEqual(float(sim.t.in_units(un.ms)), 20.0)
+        self.assertEqual(len(called), 2)
+        self.assertEqual(len(sim.chunk_stats), 4)
+
+    def test_run_not_after_current_time(self):
+        called = []
+        with NESTSimulation(dt=0.1 * un.ms, seed=NEST_RNG_SEED) as sim:
+            sim.add_hook(lambda simulation, stats: called.append(stats))
+            self._izhi_cell()
+            sim.run(20 * un.ms)
+            # Running to the current time or a time before it should be
+            # rejected rather than silently doing nothing
+            for t_stop in (20 * un.ms, 10 * un.ms):
+                self.assertRaises(Pype9UsageError, sim.run, t_stop)
+            self.assertEqual(float(sim.t.in_units(un.ms)), 20.0)
+            self.assertEqual(len(sim.chunk_stats), 1)
+            self.assertEqual(len(called), 1)
+
+
+class TestSweep(TestCase):
+
+    def test_parallel_sweep(self):
+        sweep = NESTSweep(
+            ninemlcatalog.load('neuron/Izhikevich', 'SampleIzhikevich'),
+            20 * un.ms, 0.1 * un.ms, record=['V'],
+            inputs=dict([input_step('Isyn', 0.02, 5, 15, 0.1, 1)]),
+            seed=NEST_RNG_SEED,
+            build_kwargs={'build_mode': BUILD_MODE_DEFAULT,
+                          'build_version': 'TestSweep'})
+        property_sets = [dict(p, **TestRecordings.izhi_initial_states)
+                         for p in Sweep.grid(a=[0.02, 0.1] / pq.ms)]
+        parallel = sweep.run(property_sets, num_workers=2)
+        serial = sweep.run(property_sets, num_workers=1)
+        self.assertEqual(len(parallel), 2)
+        self.assertEqual(parallel['V'].shape, serial['V'].shape)
+        self.assertTrue(numpy.array_equal(numpy.array(parallel['V']),
+                                          numpy.array(serial['V'])))
+        # The different property sets should give different traces
+        self.assertFalse(numpy.array_equal(numpy.array(parallel['V'][0]),
+                                           numpy.array(parallel['V'][1])))
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
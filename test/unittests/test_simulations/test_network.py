@@ -6,9 +6,14 @@ from builtins import range
 from itertools import groupby
 from operator import itemgetter
 import itertools
+import os
+import json
+import tempfile
+import shutil
 import numpy
 import quantities as pq
 import neo
+from mock import patch
 from nineml.user import (
     Projection, Network, DynamicsProperties,
     Population, ComponentArray, EventConnectionGroup,
@@ -35,6 +40,7 @@ import ninemlcatalog
 import sys
 argv = sys.argv[1:]  # Save argv before it is clobbered by the NEST init.
 import nest  # @IgnorePep8
+import pyNN.nest  # @IgnorePep8
 from pype9.simulate.nest.network import Network as NestPype9Network  # @IgnorePep8
 from pype9.simulate.nest import Simulation as NESTSimulation  # @IgnorePep8
 from pype9.utils.testing import ReferenceBrunel2000  # @IgnorePep8
@@ -216,6 +222,83 @@ class TestBrunel2000(TestCase):
                         self.out_stdev_error[(pop1_name, pop2_name)],
                         percent_error))
 
+    def test_native_connection_degrees(self, case='AI', order=100, **kwargs):  # @UnusedVariable @IgnorePep8
+        """
+        Checks that connecting the RandomFanIn projections natively with
+        nest.Connect gives every cell the in-degree of the connection rule
+        """
+        with self.simulations['nest']:
+            nml = self._construct_nineml(case, order, 'nest',
+                                         native_connect=True)
+            for proj in nml.nineml.projections:
+                props = proj.connectivity.rule_properties
+                if props.lib_type != 'RandomFanIn':
+                    continue
+                number = int(props.property('number').value)
+                pre, post = (
+                    (nml.component_array(p.name)
+                     if p.nineml_type == 'Population'
+                     else nml.selection(p.name)).all_cells
+                    for p in (proj.pre, proj.post))
+                conns = numpy.asarray(nest.GetConnections(list(pre),
+                                                          list(post)))
+                in_degree = numpy.array(
+                    [numpy.count_nonzero(conns[:, 1] == i) for i in post])
+                self.assertTrue(
+                    all(in_degree == number),
+                    "In-degree of '{}' projection doesn't match its connection"
+                    " rule ({})".format(proj.name, number))
+
+    def test_native_connections(self, case='AI', order=10, **kwargs):  # @UnusedVariable @IgnorePep8
+        """
+        Checks that connecting the AllToAll, Explicit and OneToOne projections
+        (and reconnecting their sampled connectivities) natively with
+        nest.Connect gives the same connections, weights and delays as
+        connecting them with PyNN
+        """
+        connection_rules = {
+            'Excitation': ConnectionRuleProperties(
+                'AllToAllProps',
+                ninemlcatalog.load('/connectionrule/AllToAll', 'AllToAll')),
+            'Inhibition': ConnectionRuleProperties(
+                'ExplicitProps',
+                ninemlcatalog.load('/connectionrule/Explicit', 'Explicit'),
+                properties={'sourceIndices': [0, 2, 2, 7, 9],
+                            'destinationIndices': [0, 5, 41, 41, 49]})}
+        connections = {}
+        for native in (False, True):
+            with self.simulations['nest']:
+                nml = self._construct_nineml(
+                    case, order, 'nest', connection_rules=connection_rules,
+                    native_connect=native)
+                conns = connections[native] = {}
+                for conn_grp in nml.connection_groups:
+                    conns[conn_grp.name] = sorted(
+                        conn_grp.get(['weight', 'delay'], format='list'))
+                    # Connect the same cells again from the connectivity
+                    # sampled for the connection group
+                    reconnected = pyNN.nest.Projection(
+                        conn_grp.pre, conn_grp.post, conn_grp.connectivity,
+                        synapse_type=conn_grp.synapse_type,
+                        receptor_type=conn_grp.receptor_type)
+                    conns[(conn_grp.name, 'reconnected')] = sorted(
+                        reconnected.get(['weight', 'delay'], format='list'))
+                    self.assertEqual(
+                        conns[(conn_grp.name, 'reconnected')],
+                        conns[conn_grp.name],
+                        "Reconnecting '{}' from its sampled connectivity "
+                        "(native={}) didn't give the same connections"
+                        .format(conn_grp.name, native))
+        self.assertEqual(
+            len(connections[True][('Excitation', 'reconnected')]),
+            nml.component_array('Exc').size * nml.selection('All').size)
+        self.assertEqual(len(connections[True]['Inhibition']), 5)
+        for name, pynn_conns in connections[False].items():
+            self.assertEqual(
+                connections[True][name], pynn_conns,
+                "Native connections of '{}' don't match the ones connected "
+                "with PyNN".format(name))
+
     def test_connection_params(self, case='AI', order=10, **kwargs):  # @UnusedVariable @IgnorePep8
         with self.simulations['nest']:
             nml = self._construct_nineml(case, order, 'nest')
@@ -573,8 +656,171 @@ class TestBrunel2000(TestCase):
         self.assertEqual(len(connection_groups), 3)
         self.assertEqual(len(selections), 1)
 
+    def test_flatten_cache(self, **kwargs):  # @UnusedVariable
+        brunel_network = ninemlcatalog.load(
+            'network/Brunel2000/AI/').as_network('brunel_ai')
+        cache_dir = tempfile.mkdtemp()
+        try:
+            flattened = [
+                BasePype9Network._flatten_to_arrays_and_conns(
+                    brunel_network, cache_dir=cache_dir)
+                for _ in range(2)]
+        finally:
+            shutil.rmtree(cache_dir)
+        # The second flattening is loaded from the cache
+        for original, cached in zip(*flattened):
+            self.assertEqual(original, cached)
+
+    def test_connections(self, case='AI', order=10, **kwargs):  # @UnusedVariable @IgnorePep8
+        with self.simulations['nest']:
+            nml = self._construct_nineml(case, order, 'nest')
+            for conn_grp in nml.connection_groups:
+                connectivity = conn_grp.connectivity
+                ref = set(
+                    (int(s), int(d)) for s, d in conn_grp.get(
+                        [], format='list', with_address=True, gather='all'))
+                conn_array = connectivity.connection_array()
+                self.assertEqual(conn_array.shape, (len(ref), 2))
+                self.assertEqual(set(map(tuple, conn_array.tolist())), ref)
+                # The connections should be iterated in the same order as
+                # the rows of the connection array
+                self.assertEqual(list(connectivity.connections()),
+                                 [tuple(c) for c in conn_array.tolist()])
+                # Only one process so the local connections are all of them
+                self.assertEqual(
+                    set(connectivity.connections(local=True)), ref)
+                self.assertEqual(
+                    set(map(tuple,
+                            connectivity.connection_array(
+                                local=True).tolist())), ref)
+
+    def test_save_load_connections(self, case='AI', order=10, **kwargs):  # @UnusedVariable @IgnorePep8
+        connections_dir = tempfile.mkdtemp()
+        try:
+            with self.simulations['nest']:
+                nml = self._construct_nineml(case, order, 'nest')
+                nml.save_connections(connections_dir)
+                saved = dict(
+                    (cg.name, sorted(cg.get(['weight', 'delay'],
+                                            format='list')))
+                    for cg in nml.connection_groups)
+            with open(os.path.join(connections_dir,
+                                   nml.CONNECTIONS_MANIFEST)) as f:
+                manifest = json.load(f)
+            self.assertEqual(manifest['num_processes'], 1)
+            self.assertEqual(set(manifest['connection_groups']), set(saved))
+            for name, info in manifest['connection_groups'].items():
+                conn_grp = nml.connection_group(name)
+                self.assertEqual(info['source'], conn_grp.pre.label)
+                self.assertEqual(info['destination'], conn_grp.post.label)
+                self.assertEqual(info['attributes'], ['weight', 'delay'])
+            # Reconstruct the network from the saved connections in a new
+            # simulation with a different seed
+            with NESTSimulation(dt=self.timestep * un.ms,
+                                seed=NEST_RNG_SEED + 1,
+                                min_delay=ReferenceBrunel2000.min_delay,
+                                max_delay=ReferenceBrunel2000.max_delay):
+                loaded_nml = self._construct_nineml(
+                    case, order, 'nest', connections_dir=connections_dir)
+                for conn_grp in loaded_nml.connection_groups:
+                    self.assertEqual(
+                        sorted(conn_grp.get(['weight', 'delay'],
+                                            format='list')),
+                        saved[conn_grp.name],
+                        "Connections of '{}' weren't reloaded from '{}'"
+                        .format(conn_grp.name, connections_dir))
+        finally:
+            shutil.rmtree(connections_dir)
+
+    def test_connectivity_cache(self, case='AI', order=10, **kwargs):  # @UnusedVariable @IgnorePep8
+        cache_dir = tempfile.mkdtemp()
+        try:
+            weights = []
+            next_seeds = []
+            # Construct the network without the cache, then saving to and
+            # loading from it, all with the same seed
+            for cache in (None, cache_dir, cache_dir):
+                with self.simulations['nest'] as sim:
+                    nml = self._construct_nineml(case, order, 'nest',
+                                                 connectivity_cache=cache)
+                    weights.append(dict(
+                        (cg.name, sorted(cg.get(['weight', 'delay'],
+                                                format='list')))
+                        for cg in nml.connection_groups))
+                    # Draws made from the properties RNG after the network
+                    # is constructed shouldn't depend on the cache
+                    next_seeds.append(sim.derived_properties_seed)
+            self.assertTrue(os.listdir(cache_dir))
+            self.assertEqual(weights[0], weights[1])
+            self.assertEqual(weights[0], weights[2])
+            self.assertEqual(next_seeds[0], next_seeds[1])
+            self.assertEqual(next_seeds[0], next_seeds[2])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_shared_cell_types(self, case='AI', order=10, **kwargs):  # @UnusedVariable @IgnorePep8
+        model = ninemlcatalog.load('network/Brunel2000/' + case).as_network(
+            'Brunel_{}'.format(case)).clone()
+        # Give the inhibitory cells a different membrane time constant from
+        # the excitatory cells, which otherwise share their cell type
+        inh_cell = model.population('Inh').cell
+        tau = inh_cell.property('tau')
+        inh_cell.set(Property('tau', tau.quantity * 2))
+        for sim_name, NetworkClass in (('nest', NestPype9Network),
+                                       ('neuron', NeuronPype9Network)):
+            with self.simulations[sim_name]:
+                nml = NetworkClass(model)
+                exc = nml.component_array('Exc')
+                inh = nml.component_array('Inh')
+                self.assertIs(exc.celltype.model, inh.celltype.model,
+                              "Cell type of 'Exc' and 'Inh' arrays wasn't "
+                              "shared")
+                exc_tau, inh_tau = (
+                    numpy.unique(a.get('tau__cell')) for a in (exc, inh))
+                self.assertEqual(len(exc_tau), 1)
+                self.assertEqual(len(inh_tau), 1)
+                self.assertAlmostEqual(float(inh_tau[0]),
+                                       float(exc_tau[0]) * 2)
+                # The properties of each array are kept separately
+                self.assertEqual(
+                    exc.nineml.dynamics_properties.property(
+                        'tau__cell').quantity * 2,
+                    inh.nineml.dynamics_properties.property(
+                        'tau__cell').quantity)
+
+    def test_checkpoint(self, case='AI', order=10, **kwargs):  # @UnusedVariable @IgnorePep8
+        checkpoint_dir = tempfile.mkdtemp()
+        path = os.path.join(checkpoint_dir, 'checkpoint.pkl')
+        try:
+            with self.simulations['nest'] as sim:
+                nml = self._construct_nineml(case, order, 'nest')
+                sim.run(20 * un.ms)
+                sim.checkpoint(path)
+                saved = dict((a.name, a._get_checkpoint())
+                             for a in nml.component_arrays)
+                sim.run(40 * un.ms)
+                self.assertEqual(sim.restore(path), 20 * un.ms)
+                # The state of each array should be the one at the time of
+                # the checkpoint, not the time it was restored
+                for array in nml.component_arrays:
+                    restored = array._get_checkpoint()
+                    for name, values in saved[array.name]['state'].items():
+                        self.assertTrue(
+                            numpy.allclose(restored['state'][name], values),
+                            "State '{}' of '{}' wasn't restored from the "
+                            "checkpoint".format(name, array.name))
+                    self.assertTrue(numpy.array_equal(
+                        restored['regime'], saved[array.name]['regime']))
+                # The simulation can be continued from the restored state
+                sim.run(60 * un.ms)
+                for array in nml.component_arrays:
+                    for values in array._get_checkpoint()['state'].values():
+                        self.assertTrue(numpy.all(numpy.isfinite(values)))
+        finally:
+            shutil.rmtree(checkpoint_dir)
+
     def _construct_nineml(self, case, order, simulator, external_input=None,
-                          **kwargs):
+                          connection_rules=None, **kwargs):
         model = ninemlcatalog.load('network/Brunel2000/' + case).as_network(
             'Brunel_{}'.format(case))
         model = model.clone()
@@ -589,6 +835,12 @@ class TestBrunel2000(TestCase):
             props.set(Property(
                 number.name,
                 int(numpy.ceil(float(number.value) * scale)) * un.unitless))
+        if connection_rules is not None:
+            # Replace the connection rules of the given projections
+            for proj_name, rule_props in connection_rules.items():
+                proj = model.projection(proj_name)
+                proj._connectivity = Connectivity(
+                    rule_props, proj.pre.size, proj.post.size)
         if simulator == 'nest':
             NetworkClass = NestPype9Network
         elif simulator == 'neuron':
@@ -611,6 +863,35 @@ class TestNetwork(TestCase):
             'all_to_all_props', ninemlcatalog.load('/connectionrule/AllToAll',
                                                    'AllToAll'))
 
+    def test_connection_dependencies_cache(self):
+        model = ninemlcatalog.load('network/Brunel2000/AI').as_network(
+            'Brunel_AI')
+        projs = [model.projection(n) for n in ('Excitation', 'Inhibition')]
+        # The projections share the same response and plasticity classes
+        for role in ('response', 'plasticity'):
+            self.assertIs(getattr(projs[0], role).component_class,
+                          getattr(projs[1], role).component_class)
+        analyse = BasePype9Network._analyse_connection_dependencies
+        with patch.dict(BasePype9Network._connection_dependencies_cache,
+                        clear=True), \
+            patch.object(BasePype9Network,
+                         '_analyse_connection_dependencies',
+                         wraps=analyse) as mock_analyse:
+            synapses = [BasePype9Network._flatten_synapse(p)[0]
+                        for p in projs]
+            # A new synapse class is created for each projection
+            self.assertIsNot(synapses[0].component_class,
+                             synapses[1].component_class)
+            dependencies = [
+                BasePype9Network._connection_dependencies(s.component_class)
+                for s in synapses]
+            self.assertEqual(mock_analyse.call_count, 1,
+                             "Dependencies of synapses sharing the same "
+                             "dynamics were analysed more than once")
+            self.assertEqual(dependencies[0], dependencies[1])
+            self.assertEqual(dependencies[0],
+                             analyse(synapses[1].component_class))
+
     def test_component_arrays_and_connection_groups(self, **kwargs):  # @UnusedVariable @IgnorePep8
 
         # =====================================================================
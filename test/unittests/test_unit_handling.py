@@ -3,6 +3,8 @@ from __future__ import division
 from past.utils import old_div
 import os.path
 import math
+import tempfile
+import shutil
 from nineml import units as un
 from pype9.simulate.common.units import UnitHandler as BaseUnitHandler
 from pype9.simulate.nest.units import UnitHandler as NestUnitHandler
@@ -11,6 +13,12 @@ from nineml.abstraction import (
     StateVariable)
 import numpy
 from nineml.units import Quantity
+from nineml.values import ArrayValue, RandomDistributionValue
+from nineml.user import RandomDistributionProperties
+import ninemlcatalog
+from pyNN.random import NumpyRNG, RandomDistribution
+from pype9.simulate.common.network.values import (
+    get_pyNN_value, ScaledRandomDistribution)
 import pype9.utils.logging.handlers.sysout  # @UnusedImport
 if __name__ == '__main__':
     from pype9.utils.testing import DummyTestCase as TestCase  # @UnusedImport
@@ -122,6 +130,109 @@ class TestUnitAssignment(TestCase):
                              "New unit mapped incorrectly {}->{} ({})"
                              .format(unit, new_unit, unit_mapped))
 
+    def test_persistent_cache(self):
+        unit = old_div(un.K ** 2, (un.uF * un.mV ** 2))
+        cache_dir = tempfile.mkdtemp()
+        orig_cache_dir = BaseUnitHandler._persistent_cache_dir
+        try:
+            self._reset_persistent_cache(cache_dir)
+            scale, compound = TestUnitHandler1.dimension_to_units_compound(
+                unit.dimension)
+            BaseUnitHandler.save_persistent_cache()
+            # A new process should load the projection saved to disk
+            self._reset_persistent_cache(cache_dir)
+            self.assertNotIn(tuple(unit.dimension), TestUnitHandler1.cache)
+            self.assertIn(tuple(unit.dimension),
+                          TestUnitHandler1._persistent_cache())
+            self.assertEqual(
+                TestUnitHandler1.dimension_to_units_compound(unit.dimension),
+                (scale, compound))
+            # Saved projections should only be used for exact matches, so
+            # projections of other dimensions are the same as in a process
+            # without the persistent cache
+            squared = unit.dimension ** 2
+            self._reset_persistent_cache(cache_dir)
+            with_cache = TestUnitHandler1.dimension_to_units_compound(squared)
+            self._reset_persistent_cache(tempfile.mkdtemp(dir=cache_dir))
+            without_cache = TestUnitHandler1.dimension_to_units_compound(
+                squared)
+            self.assertEqual(with_cache, without_cache)
+        finally:
+            self._reset_persistent_cache(orig_cache_dir)
+            shutil.rmtree(cache_dir)
+
+    def _reset_persistent_cache(self, cache_dir):
+        BaseUnitHandler._persistent_cache_dir = cache_dir
+        BaseUnitHandler._persistent_projections = None
+        BaseUnitHandler._unsaved_projections.clear()
+        TestUnitHandler1.clear_cache()
+
+    def test_units_info_cache(self):
+        units = [un.mV, un.nA, un.ms]
+        keys = [(u.name, u.power, tuple(u.dimension)) for u in units]
+        TestUnitHandler1.clear_cache()
+        TestUnitHandler1._UNITS_INFO_CACHE_SIZE = 2
+        try:
+            self.assertEqual(TestUnitHandler1.scalar(un.mV), 1.0)
+            TestUnitHandler1.scalar(un.nA)
+            # Access mV again so nA becomes the least recently used
+            TestUnitHandler1.scalar(un.mV)
+            TestUnitHandler1.scalar(un.ms)
+            cache = TestUnitHandler1._units_info_cache
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(list(cache), [keys[0], keys[2]],
+                             "Least recently used units were not evicted")
+            # Evicted units are recalculated with the same results
+            exponent, compound = TestUnitHandler1.dimension_to_units_compound(
+                un.nA.dimension)
+            self.assertEqual(
+                TestUnitHandler1._units_info(un.nA),
+                (10 ** (un.nA.power - exponent), compound,
+                 TestUnitHandler1.compound_to_units_str(compound)))
+            self.assertNotIn(keys[0], cache)
+            # Each unit handler has its own cache, which isn't cleared along
+            # with the caches of the other handlers
+            NestUnitHandler.scalar(un.mV)
+            self.assertIsNot(NestUnitHandler._units_info_cache, cache)
+            TestUnitHandler1.clear_cache()
+            self.assertEqual(len(cache), 0)
+            self.assertIn(keys[0], NestUnitHandler._units_info_cache)
+        finally:
+            del TestUnitHandler1._UNITS_INFO_CACHE_SIZE
+            TestUnitHandler1.clear_cache()
+
+    def test_pyNN_value_scaling(self):
+        values = numpy.arange(10.0)
+        seq = get_pyNN_value(Quantity(ArrayValue(values), un.pA),
+                             TestUnitHandler1, None)
+        self.assertTrue(numpy.allclose(seq.value, values * 1e-3))
+        # Scaled random samples should match the unscaled samples drawn from
+        # the same seed
+        scaled = ScaledRandomDistribution(1e-3, 'uniform', (0.0, 1.0),
+                                          rng=NumpyRNG(seed=1))
+        unscaled = ScaledRandomDistribution(1.0, 'uniform', (0.0, 1.0),
+                                            rng=NumpyRNG(seed=1))
+        self.assertTrue(numpy.allclose(scaled.next(100),
+                                       unscaled.next(100) * 1e-3))
+        # Random values in non-native units should be drawn from a
+        # distribution that scales its samples into the native units
+        uniform = RandomDistributionValue(RandomDistributionProperties(
+            name='uniform',
+            definition=ninemlcatalog.load('randomdistribution/Uniform',
+                                          'UniformDistribution'),
+            properties={'minimum': 0.0, 'maximum': 1.0}))
+        random_pA = get_pyNN_value(Quantity(uniform, un.pA),
+                                   TestUnitHandler1, NumpyRNG(seed=1))
+        self.assertIsInstance(random_pA, ScaledRandomDistribution)
+        reference = RandomDistribution('uniform', (0.0, 1.0),
+                                       rng=NumpyRNG(seed=1))
+        self.assertTrue(numpy.allclose(random_pA.next(100),
+                                       reference.next(100) * 1e-3))
+        # Random values already in native units aren't scaled
+        random_nA = get_pyNN_value(Quantity(uniform, un.nA),
+                                   TestUnitHandler1, NumpyRNG(seed=1))
+        self.assertNotIsInstance(random_nA, ScaledRandomDistribution)
+
     def test_conversions(self):
         test_units = [old_div(un.mV, un.uF),
                       un.ms * un.C / un.um,